@@ -0,0 +1,241 @@
+"""
+Offline crawl benchmark. Starts the synthetic web (see syntheticweb.py) in a separate process,
+and runs the recursive search of every driver against it: the drivers get their recorded result
+pages, with links into a generated link graph, instead of the real search engines. Delays between
+requests are off, so the numbers show the cost of the crawler itself.
+
+Reports pages fetched per second, results per second, CPU time per page, parse and link filter time
+per page (from the crawl metrics), and peak memory of Python objects (in a separate run, under tracemalloc).
+Timings are medians over the repetitions, after a warm-up run. The synthetic web is generated from a seed,
+so runs with the same settings crawl the same pages, and can be compared (--save, --baseline).
+
+Run from the project root:
+
+    python -m benchmarks.crawl [--driver google] [--crawler async] [--repeat N] [--save bench.json]
+"""
+import json
+import multiprocessing
+import statistics
+import time
+import tracemalloc
+import click
+from tabulate import tabulate
+import search.drivers  # noqa: F401  Need this to load / register drivers
+from search.asyncsearch import iterate, DEFAULT_CONCURRENCY
+from search.contentfilter import ContentFilter
+from search.frontier import FrontierRegistry, DEFAULT_CRAWL_STRATEGY
+from search.linkextractor import SEDriverRegistry
+from search.logger import SearchLogger
+from search.metrics import CrawlMetrics
+from search.parsepool import ParsePool
+from .syntheticweb import DEFAULT_WEB_SETTINGS, WebSettings, serve
+
+
+QUERY = "python generators"
+COMPARED_FIELDS = ("pages/s", "results/s", "CPU ms/page")
+
+
+def local_driver(name, port):
+    """
+    :param name: name of a registered driver
+    :param port: port of the synthetic web server
+    :return: a subclass of the driver, which gets its result pages from the synthetic web, without delays
+    """
+    def next_search_page_url_generator(cls, query):
+        page = 0
+        while True:
+            yield f"http://127.0.0.1:{port}/serp/{name}?q={query}&page={page}"
+            page += 1
+
+    return type(f"Local{SEDriverRegistry.get_driver(name).__name__}", (SEDriverRegistry.get_driver(name),), {
+        "next_search_page_url_generator": classmethod(next_search_page_url_generator),
+        "delay_in_seconds_between_search_requests": 0,
+        "delay_in_seconds_between_normal_requests": 0,
+    })
+
+
+def crawl(driver, crawler, limit, depth_limit, strategy, concurrency):
+    """
+    Runs a search with a fresh driver and content filter state
+    :return: number of results
+    """
+    ContentFilter.init_filter()
+    if crawler == "async":
+        results = iterate(driver.async_recursive_link_generator(
+            QUERY, limit=limit, depth_limit=depth_limit, concurrency=concurrency
+        ))
+    else:
+        results = driver.recursive_link_generator(QUERY, limit=limit, depth_limit=depth_limit, strategy=strategy)
+    return sum(1 for _ in results)
+
+
+def stage_seconds(metrics, name, **labels):
+    """
+    :return: total seconds, and number of observations of the histograms <name> with given labels
+    """
+    total, count = 0, 0
+    for histogram in metrics.to_dict()["histograms"]:
+        if histogram["name"] == name and all(histogram["labels"].get(k) == v for k, v in labels.items()):
+            total += histogram["sum"]
+            count += histogram["count"]
+    return total, count
+
+
+def measure(name, port, crawler, limit, depth_limit, strategy, concurrency, repeat):
+    """
+    :return: dict with the measurements for the driver <name>
+    """
+    # Разогрев: соединения с сервером, ленивые импорты и кэши не должны попадать в замеры
+    crawl(local_driver(name, port), crawler, limit, depth_limit, strategy, concurrency)
+    runs = []
+    for _ in range(repeat):
+        CrawlMetrics.init_metrics()
+        driver = local_driver(name, port)
+        wall, cpu = time.perf_counter(), time.process_time()
+        results = crawl(driver, crawler, limit, depth_limit, strategy, concurrency)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        metrics = CrawlMetrics.get_metrics()
+        pages = sum(
+            counter["value"] for counter in metrics.to_dict()["counters"] if counter["name"] == "responses_total"
+        )
+        parse, parsed_pages = stage_seconds(metrics, "parse_seconds", stage="page")
+        runs.append({
+            "pages": pages,
+            "results": results,
+            "wall": wall,
+            "cpu": cpu,
+            "parse": parse / max(parsed_pages, 1),
+            "filter": stage_seconds(metrics, "filter_seconds", stage="page")[0] / max(parsed_pages, 1),
+        })
+    CrawlMetrics.disable_metrics()
+
+    tracemalloc.start()
+    crawl(local_driver(name, port), crawler, limit, depth_limit, strategy, concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    wall = statistics.median(run["wall"] for run in runs)
+    cpu = statistics.median(run["cpu"] for run in runs)
+    pages = runs[0]["pages"]
+    return {
+        "pages": pages,
+        "results": runs[0]["results"],
+        "wall s": round(wall, 3),
+        "pages/s": round(pages / wall, 1),
+        "results/s": round(runs[0]["results"] / wall, 1),
+        "CPU s": round(cpu, 3),
+        "CPU ms/page": round(cpu / max(pages, 1) * 1000, 3),
+        "parse ms/page": round(statistics.median(run["parse"] for run in runs) * 1000, 3),
+        "filter ms/page": round(statistics.median(run["filter"] for run in runs) * 1000, 3),
+        "peak MB": round(peak / (1024 * 1024), 2),
+    }
+
+
+def start_web(settings):
+    """
+    Starts the synthetic web server in a separate process
+    :return: a pair (process, port)
+    """
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(settings, ports), daemon=True)
+    process.start()
+    return process, ports.get(timeout=30)
+
+
+def load_baseline(path):
+    """
+    :param path: path to the results saved with --save
+    :return: a dict {driver name: dict of the measures}
+    """
+    with open(path, encoding="utf8") as f:
+        return json.load(f)["results"]
+
+
+def compare(result, baseline_result):
+    """
+    :param result: a dict of the measures of a driver
+    :param baseline_result: a dict of the baseline measures of the driver, or None
+    :return: a list of the changes of COMPARED_FIELDS against the baseline, in percents. Empty without a baseline
+    """
+    if not baseline_result:
+        return []
+    return [
+        f"{(result[field] / baseline_result[field] - 1) * 100:+.1f}%" if baseline_result.get(field) else ""
+        for field in COMPARED_FIELDS
+    ]
+
+
+@click.command()
+@click.option(
+    "--driver",
+    multiple=True,
+    type=click.Choice(sorted(SEDriverRegistry.registered_drivers_names())),
+    help="Driver to benchmark, can be given several times. Defaults to all drivers"
+)
+@click.option("--crawler", default="sync", type=click.Choice(["sync", "async"]), help="Crawl engine")
+@click.option(
+    "--strategy",
+    default=DEFAULT_CRAWL_STRATEGY,
+    type=click.Choice(sorted(FrontierRegistry.registered_strategies_names())),
+    help="Crawl strategy of the sync crawler"
+)
+@click.option("--concurrency", default=DEFAULT_CONCURRENCY, help="Concurrency of the async crawler")
+@click.option("--parse_workers", default=0, help="Number of processes to parse the pages in (0 - in the crawler)")
+@click.option("--limit", default=2000, help="Number of results per search")
+@click.option("--depth_limit", default=5, help="Max recursion depth")
+@click.option("--repeat", default=3, help="Number of repetitions per driver (medians are reported)")
+@click.option("--pages", default=DEFAULT_WEB_SETTINGS.pages, help="Number of pages in the link graph")
+@click.option("--fan_out", default=DEFAULT_WEB_SETTINGS.fan_out, help="Number of links per page")
+@click.option("--page_size", default=DEFAULT_WEB_SETTINGS.page_size, help="Size of a page in bytes")
+@click.option("--latency", default=DEFAULT_WEB_SETTINGS.latency, help="Server response latency in seconds")
+@click.option("--error_rate", default=DEFAULT_WEB_SETTINGS.error_rate, help="Share of pages, which respond with 500")
+@click.option("--binary_rate", default=DEFAULT_WEB_SETTINGS.binary_rate, help="Share of links to binary files")
+@click.option("--match_rate", default=DEFAULT_WEB_SETTINGS.match_rate, help="Share of links, which match the query")
+@click.option("--seed", default=DEFAULT_WEB_SETTINGS.seed, help="Seed of the link graph")
+@click.option("--save", "save_path", default=None, help="Save the results to this JSON file")
+@click.option(
+    "--baseline",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare with the results saved earlier with --save"
+)
+def main(driver, crawler, strategy, concurrency, parse_workers, limit, depth_limit, repeat, pages, fan_out, page_size, latency,
+         error_rate, binary_rate, match_rate, seed, save_path, baseline):
+    SearchLogger.init_logger(path=None, level="critical")
+    settings = WebSettings(
+        pages=pages, fan_out=fan_out, page_size=page_size, latency=latency, error_rate=error_rate,
+        binary_rate=binary_rate, match_rate=match_rate, seed=seed
+    )
+    process, port = start_web(settings)
+    if parse_workers:
+        ParsePool.init_pool(parse_workers)
+    try:
+        results = {
+            name: measure(name, port, crawler, limit, depth_limit, strategy, concurrency, repeat)
+            for name in (driver or sorted(SEDriverRegistry.registered_drivers_names()))
+        }
+    finally:
+        ParsePool.close_pool()
+        process.terminate()
+
+    baseline_results = load_baseline(baseline) if baseline else {}
+    fields = list(next(iter(results.values())))
+    rows = [[name, *result.values(), *compare(result, baseline_results.get(name))] for name, result in results.items()]
+    headers = ["Driver", *fields] + ([f"{field} vs baseline" for field in COMPARED_FIELDS] if baseline_results else [])
+    print(f"Crawler: {crawler}{'' if crawler == 'async' else f', strategy: {strategy}'}, limit: {limit}, "
+          f"depth limit: {depth_limit}, parse workers: {parse_workers}, {settings}")
+    print(tabulate(rows, headers=headers))
+
+    if save_path:
+        with open(save_path, mode="w", encoding="utf8") as f:
+            json.dump({
+                "settings": {
+                    **settings._asdict(), "crawler": crawler, "strategy": strategy, "limit": limit,
+                    "depth_limit": depth_limit, "concurrency": concurrency, "parse_workers": parse_workers
+                },
+                "results": results
+            }, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
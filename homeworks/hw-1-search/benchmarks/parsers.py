@@ -0,0 +1,83 @@
+"""
+Compares parser backends on recorded search engine result pages (benchmarks/pages/*.html)
+and on a generated "portal" page with thousands of anchors.
+
+Run from the project root:
+
+    python -m benchmarks.parsers [--repeat N]
+"""
+import os
+import timeit
+import click
+from tabulate import tabulate
+import search.drivers  # noqa: F401  Need this to load / register drivers
+from search.linkextractor import SEDriverRegistry
+from search.logger import SearchLogger
+from search.parsers import ParserRegistry
+from search.searchutils import valid_page_links
+
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), "pages")
+QUERY_WORDS = ["python", "generators"]
+
+
+def recorded_page(name):
+    with open(os.path.join(PAGES_DIR, f"{name}.html"), encoding="utf8") as f:
+        return f.read()
+
+
+def portal_page(anchors=5000):
+    """
+    A large page with many anchors, most of which do not match the query
+    :param anchors: number of anchors on the page
+    :return: string, page contents
+    """
+    links = "".join(
+        f'<li><a href="https://portal.example.com/{"python-generators" if i % 50 == 0 else "news"}/{i}">'
+        f'<span>Item {i}</span> {"python generators" if i % 25 == 0 else "other topic"}</a></li>'
+        for i in range(anchors)
+    )
+    return f"<html><head><title>Portal</title></head><body><ul>{links}</ul></body></html>"
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def take(gen, n):
+    for i, item in enumerate(gen):
+        if i + 1 == n:
+            break
+
+
+@click.command()
+@click.option("--repeat", default=20, help="Number of repetitions per measurement (best is reported)")
+def main(repeat):
+    SearchLogger.init_logger(path=None, level="error")
+    portal = portal_page()
+    cases = [
+        (
+            f"SERP: {name}",
+            lambda parser, name=name, page=recorded_page(name): list(
+                parser.search_results(SEDriverRegistry.get_driver(name), page)
+            )
+        )
+        for name in sorted(SEDriverRegistry.registered_drivers_names())
+    ] + [
+        ("Portal: all valid links", lambda parser: list(valid_page_links(portal, QUERY_WORDS))),
+        ("Portal: first 10 valid links", lambda parser: take(valid_page_links(portal, QUERY_WORDS), 10)),
+    ]
+    backends = sorted(ParserRegistry.registered_parsers_names())
+    rows = []
+    for title, case in cases:
+        row = [title]
+        for backend in backends:
+            ParserRegistry.set_default(backend)
+            parser = ParserRegistry.get_parser()
+            row.append(round(best_time(lambda: case(parser), repeat), 3))
+        rows.append(row)
+    print(tabulate(rows, headers=["Case (ms, best of {})".format(repeat), *backends]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Measures the startup time of the CLI: `python -m search --help`, and the import of the CLI module,
+each in a fresh interpreter, with the bare interpreter startup subtracted. Also checks that the heavy
+libraries (HTTP client, HTML parsers, ...) are not imported before a search actually starts.
+
+Run from the project root:
+
+    python -m benchmarks.startup [--repeat N] [--max_ms MS] [--importtime]
+
+With --max_ms, exits with code 1 if `--help` takes longer than MS milliseconds (above the bare
+interpreter), or if any of the heavy libraries is imported at startup, so that it can guard scripts / CI.
+"""
+import statistics
+import subprocess
+import sys
+import time
+import click
+from tabulate import tabulate
+
+
+HEAVY_MODULES = ("requests", "urllib3", "bs4", "soupsieve", "lxml", "tabulate", "asyncio")
+IMPORTTIME_TOP = 15     # Number of the slowest imports to show with --importtime
+
+CASES = [
+    ("python -c pass", ["-c", "pass"]),
+    ("import search.__main__", ["-c", "import search.__main__"]),
+    ("python -m search --help", ["-m", "search", "--help"]),
+]
+
+
+def run_time(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def loaded_heavy_modules():
+    """
+    :return: a list of the HEAVY_MODULES, imported by the CLI module at startup
+    """
+    output = subprocess.run(
+        [
+            sys.executable, "-c",
+            f"import sys, search.__main__; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        ],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return output.split()
+
+
+def slowest_imports(top=IMPORTTIME_TOP):
+    """
+    :return: a list of pairs (module, cumulative import time in ms) of the slowest imports of the CLI module
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import search.__main__"], check=True, capture_output=True, text=True
+    ).stderr
+    imports = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(imports, key=lambda pair: -pair[1])[:top]
+
+
+@click.command()
+@click.option("--repeat", default=10, help="Number of runs per case (median and best are reported)")
+@click.option(
+    "--max_ms",
+    default=None,
+    type=float,
+    help="Fail if `--help` takes longer than this, above the bare interpreter startup, or if heavy modules are loaded"
+)
+@click.option("--importtime", is_flag=True, default=False, help="Show the slowest imports of the CLI module")
+def main(repeat, max_ms, importtime):
+    timings = {}
+    for title, args in CASES:
+        run_time(args)  # Разогрев файлового кэша и .pyc
+        timings[title] = [run_time(args) for _ in range(repeat)]
+    interpreter = statistics.median(timings[CASES[0][0]])
+    rows = [
+        [
+            title,
+            round(statistics.median(times) * 1000, 1),
+            round(min(times) * 1000, 1),
+            round((statistics.median(times) - interpreter) * 1000, 1)
+        ]
+        for title, times in timings.items()
+    ]
+    print(tabulate(rows, headers=["Case", "Median, ms", "Best, ms", "Above interpreter, ms"]))
+
+    heavy = loaded_heavy_modules()
+    print(f"\nHeavy modules loaded at startup: {', '.join(heavy) if heavy else 'none'}")
+
+    if importtime:
+        print()
+        print(tabulate(slowest_imports(), headers=["Module", "Cumulative, ms"]))
+
+    help_ms = rows[-1][-1]
+    if max_ms is not None and (help_ms > max_ms or heavy):
+        heavy_info = f", heavy modules loaded: {', '.join(heavy)}" if heavy else ""
+        print(f"\nStartup regression: `--help` takes {help_ms} ms above the interpreter (limit {max_ms} ms){heavy_info}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
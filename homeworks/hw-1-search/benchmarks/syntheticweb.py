@@ -0,0 +1,179 @@
+"""
+A local synthetic web for offline crawl benchmarks: a generated link graph, and the recorded
+search engine result pages (benchmarks/pages/<driver>.html) with the result links pointing into
+the graph. Everything is generated from the settings and the seed, so that every run crawls
+exactly the same pages.
+
+Urls served (<base> is http://127.0.0.1:<port>):
+
+    <base>/serp/<driver>?page=N     - the recorded result page of the driver, with links to graph pages
+    <base>/page/<n>/<slug>          - page #n of the graph
+    http://localhost:<port>/file/<n>.bin - a binary file. Served from another host name, so that
+                                      the content filter blocks this host, but not the graph
+"""
+import random
+import sys
+import time
+from collections import namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import search.drivers  # noqa: F401  Need this to load / register drivers
+from search.linkextractor import SEDriverRegistry
+from search.logger import SearchLogger
+from .parsers import recorded_page
+
+
+MATCHING_SLUG = "python-generators"     # Graph pages with this slug match the benchmark query
+OTHER_SLUG = "news"
+
+WebSettings = namedtuple(
+    "WebSettings",
+    ["pages", "fan_out", "page_size", "latency", "error_rate", "binary_rate", "match_rate", "seed"]
+)
+DEFAULT_WEB_SETTINGS = WebSettings(
+    pages=10000, fan_out=20, page_size=20 * 1024, latency=0.0, error_rate=0.02, binary_rate=0.02,
+    match_rate=0.3, seed=1
+)
+
+
+def link_marker(i, encoded=False):
+    return f"@@{'E' if encoded else ''}LINK{i}@@"
+
+
+def encode_url(url):
+    """
+    Url, as embedded in redirect links of some search engines (e.g. Yahoo)
+    """
+    return url.replace(":", "%3a").replace("/", "%2f")
+
+
+def serp_template(name):
+    """
+    :param name: name of a registered driver
+    :return: a pair (recorded result page of the driver, with result urls replaced by markers, number of results)
+    """
+    page = recorded_page(name)
+    urls = [link["url"] for link in SEDriverRegistry.get_driver(name).get_links_info(page)]
+    # Длинные url заменяем первыми, на случай, если один из url - начало другого
+    for i, url in sorted(enumerate(urls), key=lambda pair: -len(pair[1])):
+        page = page.replace(encode_url(url), link_marker(i, encoded=True)).replace(url, link_marker(i))
+    return page, len(urls)
+
+
+class SyntheticWeb:
+    """
+    Generates the pages of the synthetic web
+    """
+
+    def __init__(self, settings=DEFAULT_WEB_SETTINGS):
+        self.settings = settings
+        self.serp_templates = {
+            name: serp_template(name) for name in SEDriverRegistry.registered_drivers_names()
+        }
+
+    def _random(self, n):
+        return random.Random(self.settings.seed * 1000003 + n)
+
+    def serp_links(self, name, page_number, base):
+        """
+        :return: a list of urls of graph pages, returned by the driver <name> on the result page #<page_number>
+        """
+        _, count = self.serp_templates[name]
+        return [
+            f"{base}/page/{(page_number * count + i) % self.settings.pages}/{MATCHING_SLUG}" for i in range(count)
+        ]
+
+    def serp(self, name, page_number, base):
+        page, _ = self.serp_templates[name]
+        for i, url in enumerate(self.serp_links(name, page_number, base)):
+            page = page.replace(link_marker(i, encoded=True), encode_url(url)).replace(link_marker(i), url)
+        return page
+
+    def is_error(self, n):
+        return self._random(-n - 1).random() < self.settings.error_rate
+
+    def page(self, n, base, files_base):
+        """
+        :param n: number of the page
+        :param base: base url of the graph pages
+        :param files_base: base url of binary files
+        :return: string, HTML of the page
+        """
+        rng = self._random(n)
+        items = []
+        for _ in range(self.settings.fan_out):
+            target = rng.randrange(self.settings.pages)
+            if rng.random() < self.settings.binary_rate:
+                items.append(f'<li><a href="{files_base}/file/{target}.bin">Python generators data {target}</a></li>')
+            elif rng.random() < self.settings.match_rate:
+                items.append(
+                    f'<li><a href="{base}/page/{target}/{MATCHING_SLUG}">Python generators, part {target}</a></li>'
+                )
+            else:
+                items.append(f'<li><a href="{base}/page/{target}/{OTHER_SLUG}">Other topic <b>{target}</b></a></li>')
+        head = f"<html><head><title>Page {n}</title></head><body><h1>Page {n}</h1><ul>{''.join(items)}</ul>"
+        filler = []
+        size = len(head)
+        while size < self.settings.page_size:
+            paragraph = f"<p>Paragraph {len(filler)} of page {n}: lorem ipsum dolor sit amet, consectetur.</p>"
+            filler.append(paragraph)
+            size += len(paragraph)
+        return f"{head}{''.join(filler)}</body></html>"
+
+
+class SyntheticWebHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep-alive, as real servers
+    disable_nagle_algorithm = True  # Headers and body are sent separately, Nagle would delay the body
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        web = self.server.web
+        port = self.server.server_port
+        base = f"http://127.0.0.1:{port}"
+        if web.settings.latency:
+            time.sleep(web.settings.latency)
+        parts = self.path.split("?")[0].split("/")
+        if parts[1] == "serp" and parts[2] in web.serp_templates:
+            page_number = int(self.path.split("page=")[1]) if "page=" in self.path else 0
+            self._send(200, web.serp(parts[2], page_number, base).encode())
+        elif parts[1] == "page" and len(parts) > 2 and parts[2].isdigit():
+            n = int(parts[2])
+            if web.is_error(n):
+                self._send(500, b"Internal Server Error", content_type="text/plain")
+            else:
+                self._send(200, web.page(n, base, f"http://localhost:{port}").encode())
+        elif parts[1] == "file":
+            self._send(200, bytes(64 * 1024), content_type="application/octet-stream")
+        else:
+            self._send(404, b"Not Found", content_type="text/plain")
+
+
+class SyntheticWebServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиент закрывает соединение, не дочитав отклоненный ответ (напр. бинарный файл) - это норма
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(settings, ports):
+    """
+    Runs the synthetic web server, until the process is terminated. Meant to be the target of
+    a separate process, so that the server does not take CPU time from the measured crawler
+    :param settings: WebSettings
+    :param ports: multiprocessing.Queue, to put the port of the server to, once it is started
+    """
+    SearchLogger.init_logger(path=None, level="error")
+    server = SyntheticWebServer(("127.0.0.1", 0), SyntheticWebHandler)
+    server.web = SyntheticWeb(settings)
+    ports.put(server.server_port)
+    server.serve_forever()
@@ -1,31 +1,79 @@
-import search.drivers  # Need this to load / register drivers
+import search.drivers  # Need this to declare drivers
 import click
-from .linkextractor import SEDriverRegistry
-from .results import ResultsHandler
-from .logger import SearchLogger, DEFAULT_LOG_PATH
+from contextlib import ExitStack
+from types import SimpleNamespace
+from .driverregistry import SEDriverRegistry
+from .logger import SearchLogger, DEFAULT_LOG_PATH, DEFAULT_LOG_SAMPLE
+from .sessions import HttpSessionPool, DEFAULT_POOL_SIZE, DEFAULT_POOL_PER_HOST, DEFAULT_CONCURRENCY
+from .parsers import ParserRegistry, DEFAULT_PARSER
+from .parsepool import ParsePool, DEFAULT_PARSE_WORKERS
+from .checkpoint import CrawlCheckpoint, DEFAULT_CHECKPOINT_PATH, DEFAULT_CHECKPOINT_INTERVAL
+from .frontier import FrontierRegistry, DEFAULT_CRAWL_STRATEGY, DEFAULT_FRONTIER_MEMORY
+from .visited import VisitedStoreRegistry, DEFAULT_VISITED_STORE, DEFAULT_BLOOM_ERROR_RATE
+from .contentfilter import ContentFilter, DEFAULT_MAX_PAGE_SIZE
+from .metrics import CrawlMetrics
+from .warc import WarcWriter, WarcReplay
+from .cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_SIZE
+from .runner import (
+    engine_names, get_extractor, search_results, DEFAULT_MAX_RESULTS, DEFAULT_MAX_RECURSION_DEPTH,
+    DEFAULT_SEARCH_ENGINE, DEFAULT_SEARCH_MODE, DEFAULT_CRAWLER, DEFAULT_PREFETCH_FLAG, DEFAULT_BATCH_WORKERS,
+    DEFAULT_SHARDS, DEFAULT_COORDINATOR, ALL_ENGINES, SUPPORTED_SEARCH_MODES, SUPPORTED_CRAWLERS,
+    SUPPORTED_COORDINATORS
+)
 
 
-DEFAULT_MAX_RESULTS = 30
-DEFAULT_MAX_RECURSION_DEPTH = 5
 DEFAULT_CONSOLE_FLAG = True
-DEFAULT_SEARCH_ENGINE = "google"
-DEFAULT_SEARCH_MODE = "all"
 DEFAULT_VERBOSE_FLAG = False
 DEFAULT_LOG_LEVEL = 'info'
 DEFAULT_RECURSIVE_MODE = True
+DEFAULT_CACHE_FLAG = True
 
 REGISTERED_ENGINES = SEDriverRegistry.registered_drivers_names()
-SUPPORTED_SEARCH_MODES = ('any', 'all')
 SUPPORTED_LOG_LEVELS = SearchLogger.log_level_mappings().keys()
+SUPPORTED_PARSERS = ParserRegistry.registered_parsers_names()
+SUPPORTED_VISITED_STORES = VisitedStoreRegistry.registered_stores_names()
+SUPPORTED_CRAWL_STRATEGIES = FrontierRegistry.registered_strategies_names()
+
+# Параметры, которые не поддерживаются поиском данного вида (см. _search_kind()): предупреждение, и значения,
+# которые задаются параметрам вместо данных
+UNSUPPORTED_OPTIONS = {
+    "service": [
+        (
+            "--checkpoint, --resume, --warc and --replay are not supported with --service, ignoring them",
+            {"checkpoint": False, "resume": False, "warc_path": None, "replay_path": None}
+        ),
+        ("--parse_workers is not supported with --service, ignoring it", {"parse_workers": 0}),
+    ],
+    # Запросы выполняются в рабочих процессах, у каждого свой архив и контрольная точка не имеют смысла
+    "batch": [
+        (
+            "--checkpoint, --resume and --warc are not supported with --queries_file, ignoring them",
+            {"checkpoint": False, "resume": False, "warc_path": None}
+        ),
+        # Рабочие процессы пула (daemon) не могут запускать свои процессы
+        ("--parse_workers is not supported with --queries_file, ignoring it", {"parse_workers": 0}),
+    ],
+    # Страницы обходят рабочие процессы шардов, по очереди координатора
+    "distributed": [
+        (
+            "--checkpoint, --resume and --warc are not supported with --shards, ignoring them",
+            {"checkpoint": False, "resume": False, "warc_path": None}
+        ),
+        ("The shard workers crawl one page at a time, ignoring --crawler async", {"crawler": "sync"}),
+        ("--parse_workers is not supported with --shards, ignoring it", {"parse_workers": 0}),
+    ],
+}
 
 
 @click.command()
-@click.argument("query")
+@click.argument("query", required=False)
 @click.option(
     "--engine",
-    default=DEFAULT_SEARCH_ENGINE,
-    type=click.Choice(REGISTERED_ENGINES),
-    help=f"Search engine type. Defaults to '{DEFAULT_SEARCH_ENGINE}'"
+    default=[DEFAULT_SEARCH_ENGINE],
+    multiple=True,
+    type=click.Choice([*REGISTERED_ENGINES, ALL_ENGINES]),
+    help="Search engine type. Can be given several times, to query several engines at once and merge "
+         f"their results, or '{ALL_ENGINES}' to query all of them. Defaults to '{DEFAULT_SEARCH_ENGINE}'"
 )
 @click.option(
     "--limit",
@@ -43,6 +91,12 @@ SUPPORTED_LOG_LEVELS = SearchLogger.log_level_mappings().keys()
     # is_flag=True,
     help="Whether to print results to console (default) or not"
 )
+@click.option(
+    "--console_stream",
+    is_flag=True,
+    default=False,
+    help="Print each result to console as soon as it is found, instead of a table at the end"
+)
 @click.option(
     "--mode",
     default=DEFAULT_SEARCH_MODE,
@@ -57,7 +111,9 @@ SUPPORTED_LOG_LEVELS = SearchLogger.log_level_mappings().keys()
 @click.option(
     "--resultpath",
     default=None,
-    help="A path to .csv or .json file to save the results to. Defaults to None"
+    help="A path to .csv, .json or .jsonl (JSON Lines) file to save the results to, optionally "
+         "gzip-compressed (e.g. .jsonl.gz), or to .sqlite / .db database, which keeps the results of "
+         "many searches. Results are written as they are found. Defaults to None"
 )
 @click.option(
     "--verbose/--brief",
@@ -76,51 +132,557 @@ SUPPORTED_LOG_LEVELS = SearchLogger.log_level_mappings().keys()
     type=click.Choice(SUPPORTED_LOG_LEVELS),
     help="Sets the log level. Defaults to 'info'"
 )
-def search(query, engine, limit, recursive, console, mode, depth_limit, resultpath, verbose, logpath, loglevel):
+@click.option(
+    "--log_sample",
+    default=DEFAULT_LOG_SAMPLE,
+    type=click.IntRange(min=1),
+    help="Log only every n-th of the per link messages ('Adding link', 'Recursing', ...). "
+         f"Defaults to {DEFAULT_LOG_SAMPLE} (log all of them)"
+)
+@click.option(
+    "--crawler",
+    default=DEFAULT_CRAWLER,
+    type=click.Choice(SUPPORTED_CRAWLERS),
+    help=f"Crawl engine: one page at a time (sync), or several pages in flight at once (async). "
+         f"Defaults to '{DEFAULT_CRAWLER}'"
+)
+@click.option(
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    help=f"Max number of pages fetched at the same time by the async crawler. Defaults to {DEFAULT_CONCURRENCY}"
+)
+@click.option(
+    "--pool_size",
+    default=DEFAULT_POOL_SIZE,
+    help=f"Number of hosts to keep open HTTP connections to. Defaults to {DEFAULT_POOL_SIZE}"
+)
+@click.option(
+    "--pool_per_host",
+    default=DEFAULT_POOL_PER_HOST,
+    help=f"Max number of open HTTP connections per host. Defaults to {DEFAULT_POOL_PER_HOST}"
+)
+@click.option(
+    "--pool_stats",
+    is_flag=True,
+    default=False,
+    help="Print HTTP connection reuse statistics after the search"
+)
+@click.option(
+    "--metrics",
+    is_flag=True,
+    default=False,
+    help="Collect timings and counters of the crawl stages (fetch, parse, filter, sleep), per host "
+         "and per search engine, and print their summary after the search"
+)
+@click.option(
+    "--metrics_path",
+    multiple=True,
+    help="Save the metrics to this file (implies --metrics): JSON if the path ends with '.json', "
+         "Prometheus text format otherwise. Can be given several times"
+)
+@click.option(
+    "--cache/--no-cache",
+    default=DEFAULT_CACHE_FLAG,
+    help="Whether to use the on-disk cache of HTTP responses (default) or bypass it"
+)
+@click.option(
+    "--cache_refresh",
+    is_flag=True,
+    default=False,
+    help="Revalidate all cached responses with the servers, even those not yet expired"
+)
+@click.option(
+    "--cache_clear",
+    is_flag=True,
+    default=False,
+    help="Remove all responses from the cache before the search"
+)
+@click.option(
+    "--cache_path",
+    default=DEFAULT_CACHE_PATH,
+    help=f"Path to the cache database. Defaults to {DEFAULT_CACHE_PATH}"
+)
+@click.option(
+    "--cache_ttl",
+    default=DEFAULT_CACHE_TTL,
+    help=f"Number of seconds cached responses are used without revalidation. Defaults to {DEFAULT_CACHE_TTL}"
+)
+@click.option(
+    "--cache_size",
+    default=DEFAULT_CACHE_MAX_SIZE // (1024 * 1024),
+    help=f"Max size of the cache in megabytes. Defaults to {DEFAULT_CACHE_MAX_SIZE // (1024 * 1024)}"
+)
+@click.option(
+    "--parser",
+    default=DEFAULT_PARSER,
+    type=click.Choice(SUPPORTED_PARSERS),
+    help=f"HTML parser backend: fast lxml-based one, or Beautiful Soup. Defaults to '{DEFAULT_PARSER}'"
+)
+@click.option(
+    "--parse_workers",
+    default=DEFAULT_PARSE_WORKERS,
+    type=click.IntRange(min=0),
+    help="Number of worker processes to parse the pages in, so that the fetches go on while pages are "
+         f"parsed, on other CPU cores. Defaults to {DEFAULT_PARSE_WORKERS} - parse in the crawling thread"
+)
+@click.option(
+    "--max_page_size",
+    default=DEFAULT_MAX_PAGE_SIZE // 1024,
+    help=f"Max number of kilobytes read from a single page. Defaults to {DEFAULT_MAX_PAGE_SIZE // 1024}"
+)
+@click.option(
+    "--visited",
+    default=DEFAULT_VISITED_STORE,
+    type=click.Choice(SUPPORTED_VISITED_STORES),
+    help="How to store visited urls: full urls (exact), 64-bit url fingerprints (compact), "
+         f"or a Bloom filter (bloom). Defaults to '{DEFAULT_VISITED_STORE}'"
+)
+@click.option(
+    "--bloom_error_rate",
+    default=DEFAULT_BLOOM_ERROR_RATE,
+    type=click.FloatRange(0, 1, min_open=True, max_open=True),
+    help=f"False positive rate of the Bloom filter visited urls store. Defaults to {DEFAULT_BLOOM_ERROR_RATE}"
+)
+@click.option(
+    "--strategy",
+    default=DEFAULT_CRAWL_STRATEGY,
+    type=click.Choice(SUPPORTED_CRAWL_STRATEGIES),
+    help="Order of visiting pages in the recursive search: depth-first (dfs), breadth-first (bfs), "
+         "or the most relevant pages first (best-first). "
+         f"The async crawler is always breadth-first. Defaults to '{DEFAULT_CRAWL_STRATEGY}'"
+)
+@click.option(
+    "--frontier_memory",
+    default=DEFAULT_FRONTIER_MEMORY,
+    help="Max number of pages waiting to be visited, which are kept in memory. The rest are kept "
+         f"in a temporary file. Defaults to {DEFAULT_FRONTIER_MEMORY}"
+)
+@click.option(
+    "--prefetch/--no-prefetch",
+    default=DEFAULT_PREFETCH_FLAG,
+    help="Whether to request the next search engine result page in background, while the links "
+         "from the current one are being crawled (default) or not"
+)
+@click.option(
+    "--warc",
+    "warc_path",
+    default=None,
+    help="Archive all pages read by the search (search engine result pages and crawled pages) "
+         "to this gzip-compressed WARC file (.warc.gz)"
+)
+@click.option(
+    "--replay",
+    "replay_path",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Search over the pages archived with --warc, without any network requests or delays. "
+         "Search engine result pages are taken by their numbers, so the query and mode may differ"
+)
+@click.option(
+    "--checkpoint",
+    is_flag=True,
+    default=False,
+    help="Periodically save the search state, so that an interrupted search can be resumed (sync crawler only)"
+)
+@click.option(
+    "--checkpoint_path",
+    default=DEFAULT_CHECKPOINT_PATH,
+    help=f"Path to the checkpoint file. Defaults to {DEFAULT_CHECKPOINT_PATH}"
+)
+@click.option(
+    "--checkpoint_interval",
+    default=DEFAULT_CHECKPOINT_INTERVAL,
+    help=f"Min number of seconds between checkpoints. Defaults to {DEFAULT_CHECKPOINT_INTERVAL}"
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue the search from the last checkpoint (implies --checkpoint)"
+)
+@click.option(
+    "--service",
+    default=None,
+    help="Run the search in a search service (see `python -m search.service`) at this address: "
+         "http://HOST:PORT or unix:PATH (a Unix socket), and only print / save the results here"
+)
+@click.option(
+    "--queries_file",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Run the searches for all the queries in this file (a query per line) instead of QUERY, in "
+         "several worker processes. Results are tagged with their queries. The delays between requests "
+         "hold for all the workers together, and pages found by several queries are fetched once"
+)
+@click.option(
+    "--workers",
+    default=DEFAULT_BATCH_WORKERS,
+    type=click.IntRange(min=1),
+    help=f"Number of worker processes for --queries_file. Defaults to {DEFAULT_BATCH_WORKERS}"
+)
+@click.option(
+    "--shards",
+    default=DEFAULT_SHARDS,
+    type=click.IntRange(min=0),
+    help="Distributed crawl: split the pages to crawl into this number of shards by host, each crawled by "
+         f"a worker process, here or on other machines. Defaults to {DEFAULT_SHARDS} - crawl in this process"
+)
+@click.option(
+    "--shard_workers",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Number of shards crawled by the worker processes on this machine. The rest are left to "
+         "`python -m search.distributed` on other machines. Defaults to --shards"
+)
+@click.option(
+    "--coordinator",
+    default=DEFAULT_COORDINATOR,
+    type=click.Choice(SUPPORTED_COORDINATORS),
+    help="Storage of the state of a distributed crawl: a SQLite database, or memory of a coordinator process, "
+         f"reached through a socket (for workers on other machines). Defaults to '{DEFAULT_COORDINATOR}'"
+)
+@click.option(
+    "--coordinator_address",
+    default=None,
+    help="Path of the SQLite database, or of the Unix socket, or HOST:PORT to listen on for the socket "
+         "coordinator. Defaults to a file in ~/.cache/websearch"
+)
+@click.option(
+    "--coordinator_key",
+    default=None,
+    help="Authentication key of the socket coordinator, needed by the workers on other machines"
+)
+def search(**kwargs):
+    options = SimpleNamespace(**kwargs)
+    _check_options(options)
 
-    SearchLogger.init_logger(path=logpath, log_to_console=True, level=loglevel)
+    SearchLogger.init_logger(
+        path=options.logpath, log_to_console=True, level=options.loglevel, sample_every=options.log_sample
+    )
     logger = SearchLogger.get_logger()
 
-    extractor = SEDriverRegistry.get_driver(engine)
-
-    if not recursive:
-        depth_limit = 1
-
-    start_info = "\n".join(
-        [s for s in (
-            "Starting the search with parameters:\n",
-            f"Original query:                   {query}",
-            f"Search engine used:               {engine}",
-            f"Total results needed:             {limit}",
-            f"Search mode:                      {mode} query words",
-            f"Recursive search:                 {recursive}",
-            f"Max recursion depth:              {depth_limit}" if recursive else "",
-            f"Print results to console:         {console}",
-            f"Save results to:                  {resultpath}" if resultpath else "",
-            f"Save log at:                      {logpath}",
-            f"Log level:                        {loglevel}",
-        ) if s]
+    kind = _search_kind(options)
+    _adjust_options(options, kind)
+    queries = None
+    if kind == "batch":
+        queries = _read_queries(options)
+        if not queries:
+            return
+
+    engines = engine_names(options.engine)
+    if kind != "service":
+        _init_search(options)
+
+    logger.info(f"\n\n{_start_info(options, engines, queries)}\n", force_console_print=True)
+
+    results, run = SEARCH_RUNS[kind](options, engines, queries)
+    with ExitStack() as stack:
+        _enter_search_contexts(stack, options, engines, kind)
+        # Результаты передаются всем получателям по мере того, как поиск их находит
+        writers = _result_writers(stack, options, engines, tagged=kind == "batch")
+        for result in results:
+            for writer in writers:
+                writer.write(result)
+        logger.info("Finished search...", force_console_print=True)
+
+    if run:
+        run.log_summary()
+    _log_stats(options, kind)
+
+
+def _check_options(options):
+    if not options.query and not options.queries_file:
+        raise click.UsageError("Missing argument 'QUERY' (or --queries_file)")
+    if options.query and options.queries_file:
+        raise click.UsageError("Give either QUERY or --queries_file, not both")
+    if options.queries_file and options.service:
+        raise click.UsageError("--queries_file is not supported with --service")
+    if options.shards and (options.service or options.queries_file):
+        raise click.UsageError("--shards is not supported with --service or --queries_file")
+
+
+def _search_kind(options):
+    """
+    :return: one of "service", "batch", "distributed" and "local" (see SEARCH_RUNS)
+    """
+    if options.service:
+        return "service"
+    if options.queries_file:
+        return "batch"
+    return "distributed" if options.shards else "local"
+
+
+def _adjust_options(options, kind):
+    """
+    Replaces the options, which are not supported by the kind of search, warning about them, and
+    the options, which depend on the others
+    :param options: the command line options
+    :param kind: kind of the search (see _search_kind())
+    """
+    for warning, values in UNSUPPORTED_OPTIONS.get(kind, ()):
+        if any(getattr(options, name) != value for name, value in values.items()):
+            SearchLogger.get_logger().warning(warning)
+        vars(options).update(values)
+    if not options.recursive:
+        options.depth_limit = 1
+    if kind == "distributed":
+        if options.shard_workers is None:
+            options.shard_workers = options.shards
+        options.shard_workers = min(options.shard_workers, options.shards)
+
+
+def _read_queries(options):
+    """
+    :return: a list of the queries of a batch search. Logs an error, if there are none
+    """
+    from .batch import read_queries
+    queries = read_queries(options.queries_file)
+    if not queries:
+        SearchLogger.get_logger().error("No queries found in %s", options.queries_file)
+    return queries
+
+
+def _process_settings(options):
+    """
+    Settings of the worker processes of a batch search and a distributed crawl (see init_process())
+    :return: a dict
+    """
+    return {
+        "logpath": options.logpath,
+        "loglevel": options.loglevel,
+        "log_sample": options.log_sample,
+        "parser": options.parser,
+        "max_page_size": options.max_page_size * 1024,
+        "pool_size": options.pool_size,
+        "pool_per_host": options.pool_per_host,
+        "cache": options.cache,
+        "cache_path": options.cache_path,
+        "cache_ttl": options.cache_ttl,
+        "cache_size": options.cache_size * 1024 * 1024,
+        "cache_refresh": options.cache_refresh,
+        "replay_path": options.replay_path
+    }
+
+
+def _search_params(options):
+    """
+    :return: keyword arguments of search_results(), shared by the local, batch and remote searches
+    """
+    return {
+        "limit": options.limit,
+        "mode": options.mode,
+        "depth_limit": options.depth_limit,
+        "crawler": options.crawler,
+        "concurrency": options.concurrency,
+        "strategy": options.strategy,
+        "frontier_memory": options.frontier_memory,
+        "visited": options.visited,
+        "bloom_error_rate": options.bloom_error_rate,
+        "prefetch": options.prefetch
+    }
+
+
+def _init_search(options):
+    ParserRegistry.set_default(options.parser)
+    ContentFilter.init_filter(max_page_size=options.max_page_size * 1024)
+    HttpSessionPool.init_pool(pool_size=options.pool_size, pool_per_host=options.pool_per_host)
+    if options.metrics or options.metrics_path:
+        CrawlMetrics.init_metrics()
+    if options.cache or options.cache_clear:
+        ResponseCache.init_cache(
+            path=options.cache_path, ttl=options.cache_ttl, max_size=options.cache_size * 1024 * 1024,
+            refresh=options.cache_refresh
+        )
+        if options.cache_clear:
+            ResponseCache.get_cache().clear()
+        if not options.cache:
+            ResponseCache.disable_cache()
+
+
+def _start_info(options, engines, queries):
+    lines = [
+        "Starting the search with parameters:\n",
+        *_queries_info(options, engines, queries),
+        *_crawl_info(options),
+        *_pages_info(options),
+        *_output_info(options)
+    ]
+    return "\n".join(line for line in lines if line)
+
+
+def _queries_info(options, engines, queries):
+    return (
+        f"Original query:                   {options.query}" if options.query else "",
+        f"Queries file:                     {options.queries_file} ({len(queries)} queries)" if queries else "",
+        f"Worker processes:                 {min(options.workers, len(queries))}" if queries else "",
+        f"Search engines used:              {', '.join(engines)}",
+        f"Total results needed:             {options.limit}",
+        f"Search mode:                      {options.mode} query words",
+    )
+
+
+def _crawl_info(options):
+    coordinator_address = f" at {options.coordinator_address}" if options.coordinator_address else ""
+    return (
+        f"Recursive search:                 {options.recursive}",
+        f"Max recursion depth:              {options.depth_limit}" if options.recursive else "",
+        f"Crawler:                          {options.crawler}",
+        f"Crawl strategy:                   {options.strategy}"
+        if options.recursive and options.crawler == "sync" and not options.shards else "",
+        f"Shards:                           {options.shards} ({options.shard_workers} on this machine)"
+        if options.shards else "",
+        f"Coordinator:                      {options.coordinator}{coordinator_address}" if options.shards else "",
+        f"Search service:                   {options.service}" if options.service else "",
+    )
+
+
+def _pages_info(options):
+    return (
+        f"HTML parser:                      {options.parser}" if not options.service else "",
+        f"Parse worker processes:           {options.parse_workers}" if options.parse_workers else "",
+        f"Visited urls store:               {options.visited}",
+        f"Checkpoint file:                  {options.checkpoint_path}" if options.checkpoint or options.resume else "",
+        f"Resume from checkpoint:           {options.resume}" if options.resume else "",
+        f"Concurrency:                      {options.concurrency}" if options.crawler == "async" else "",
+    )
+
+
+def _output_info(options):
+    use_cache = options.cache and not options.replay_path and not options.service
+    return (
+        f"Print results to console:         {options.console}",
+        f"Use response cache at:            {options.cache_path}" if use_cache else "",
+        f"Archive pages to:                 {options.warc_path}" if options.warc_path else "",
+        f"Replay pages from:                {options.replay_path}" if options.replay_path else "",
+        f"Save results to:                  {options.resultpath}" if options.resultpath else "",
+        f"Save log at:                      {options.logpath}",
+        f"Log level:                        {options.loglevel}",
+        f"Log every n-th link message:      {options.log_sample}" if options.log_sample > 1 else "",
     )
 
-    logger.info(
-        f"\n\n{start_info}\n",
-        force_console_print=True
+
+def _run_remote(options, engines, queries):
+    """
+    The search runs in the service, with its own connection pool, cache and metrics - here the results
+    are only printed / saved
+    :return: a generator of the results, and None - there is no summary of the run
+    """
+    from .service import remote_search
+    return remote_search(options.service, options.query, engines, **_search_params(options)), None
+
+
+def _run_batch(options, engines, queries):
+    """
+    :return: a generator of the results of all the queries, and the BatchSearch, to log its summary
+    """
+    from .batch import BatchSearch
+    batch = BatchSearch(
+        queries, engines, settings=_process_settings(options), workers=options.workers, **_search_params(options)
     )
+    return batch.results(), batch
+
+
+def _run_distributed(options, engines, queries):
+    """
+    :return: a generator of the results, and the DistributedSearch, to log its summary
+    """
+    from .distributed import DistributedSearch
+    distributed = DistributedSearch(
+        get_extractor(engines), options.query, settings=_process_settings(options), shards=options.shards,
+        shard_workers=options.shard_workers, coordinator=options.coordinator, address=options.coordinator_address,
+        key=options.coordinator_key, limit=options.limit, mode=options.mode, depth_limit=options.depth_limit,
+        visited=options.visited, bloom_error_rate=options.bloom_error_rate, prefetch=options.prefetch
+    )
+    return distributed.results(), distributed
+
+
+def _run_local(options, engines, queries):
+    """
+    :return: a generator of the results, and None - there is no summary of the run
+    """
+    crawl_checkpoint = None
+    if options.checkpoint or options.resume:
+        if options.crawler == "async":
+            SearchLogger.get_logger().warning(
+                "Checkpoints are only supported by the sync crawler, ignoring --checkpoint / --resume"
+            )
+        else:
+            crawl_checkpoint = CrawlCheckpoint(path=options.checkpoint_path, interval=options.checkpoint_interval)
+    results = search_results(
+        get_extractor(engines), options.query, checkpoint=crawl_checkpoint, resume=options.resume,
+        **_search_params(options)
+    )
+    return results, None
+
+
+# Функции запуска поиска каждого вида: (options, engines, queries) -> (результаты, поиск с итогами или None)
+SEARCH_RUNS = {
+    "service": _run_remote,
+    "batch": _run_batch,
+    "distributed": _run_distributed,
+    "local": _run_local
+}
+
+
+def _enter_search_contexts(stack, options, engines, kind):
+    # Рабочие процессы пакетного поиска читают архив сами (см. init_process())
+    if options.replay_path and kind != "batch":
+        WarcReplay.init_replay(options.replay_path)
+        stack.callback(WarcReplay.disable_replay)
+    if options.warc_path:
+        WarcWriter.init_writer(options.warc_path, info={"query": options.query, "engines": ", ".join(engines)})
+        stack.callback(WarcWriter.close_writer)
+    if options.parse_workers:
+        ParsePool.init_pool(options.parse_workers, parser=options.parser)
+        stack.callback(ParsePool.close_pool)
+
+
+def _result_writers(stack, options, engines, tagged):
+    """
+    Opens the writers of the results, to the file and to the console
+    :param stack: ExitStack, which closes the writers
+    :param tagged: whether the results are tagged with their queries
+    :return: a list of ResultWriter
+    """
+    # Модуль вывода результатов тянет за собой тяжелые библиотеки, поэтому импортируется
+    # только здесь: --help и ошибки в аргументах не должны тратить время на его загрузку
+    from .results import ResultsHandler
+    writers = []
+    if options.resultpath:
+        writer = ResultsHandler.file_writer(options.resultpath, verbose=options.verbose, tagged=tagged, run_info={
+            "query": options.query,
+            "engines": engines,
+            "limit": options.limit,
+            "mode": options.mode,
+            "depth_limit": options.depth_limit,
+            "crawler": options.crawler,
+            "strategy": options.strategy
+        })
+        if writer:
+            writers.append(stack.enter_context(writer))
+    if options.console:
+        writers.append(stack.enter_context(
+            ResultsHandler.console_writer(verbose=options.verbose, stream=options.console_stream, tagged=tagged)
+        ))
+    return writers
 
-    results = list(extractor.recursive_link_generator(
-        query,
-        limit=limit,
-        search_mode=mode,
-        depth_limit=depth_limit
-    ))
 
-    logger.info("Finished search...", force_console_print=True)
+def _log_stats(options, kind):
+    # Пул соединений и кэш пакетного поиска - в рабочих процессах, их статистика - в итогах пакета
+    if options.pool_stats and kind in ("distributed", "local"):
+        HttpSessionPool.get_pool().log_stats()
 
-    if console:
-        ResultsHandler.console_print(results, verbose=verbose)
+    if CrawlMetrics.get_metrics():
+        CrawlMetrics.get_metrics().log_summary()
+        for path in options.metrics_path:
+            CrawlMetrics.get_metrics().save(path)
 
-    if resultpath:
-        ResultsHandler.save_results(results, resultpath, verbose=verbose)
+    response_cache = ResponseCache.get_cache()
+    if response_cache and kind != "batch":
+        SearchLogger.get_logger().info(
+            f"Response cache: {response_cache.hits} hits, {response_cache.revalidated} revalidated, "
+            f"{response_cache.misses} misses"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+import asyncio
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .searchutils import read_web_page, page_needs_request, fix_child_link, to_canonical_url, \
+    link_is_valid_for_recursion, valid_page_links
+from .logger import SearchLogger
+from .visited import VisitedStoreRegistry
+from .sessions import DEFAULT_CONCURRENCY
+
+
+def _recursive_sublinks(page_contents, query_words, search_mode, visited):
+    """
+    Collects the child links of a page, which are good both as results and for further recursion
+    :param page_contents: string, web page contents as text
+    :param query_words: a list of query words
+    :param search_mode: "any" or "all"
+    :param visited: VisitedStore of already visited canonical urls, to skip early
+    :return: a list of objects {'url':..., 'text':...}
+    """
+    return [
+        link
+        for link in valid_page_links(page_contents, query_words, mode=search_mode, exclude=visited)
+        if link_is_valid_for_recursion(link)
+    ]
+
+
+def async_recursive_link_generator(
+        extractor, query, limit=100, depth_limit=5, search_mode="all", concurrency=DEFAULT_CONCURRENCY,
+        visited=None, prefetch=True
+):
+    """
+    Asynchronous version of the search algorithm implemented in
+    AbstractLinkExtractor.recursive_link_generator().
+
+    The blocking HTTP requests (and HTML parsing) run in a thread pool, and up to
+    <concurrency> pages are being fetched at the same time. The pages of one recursion
+    level are processed in the order they were found, so that the results are deterministic,
+    while the fetches for the next pages of the same level are already in flight. Unlike the
+    synchronous version, which goes depth-first after each level, the recursion here is a
+    pure breadth-first one, for every batch of links from the search engine.
+
+    :param extractor: search engine driver class (subclass of AbstractLinkExtractor)
+    :param query: search query string
+    :param limit: Limit on a number of results
+    :param depth_limit: recursion depth limit
+    :param search_mode: string, can be 'all' or 'any'
+    :param concurrency: max number of pages being fetched at the same time
+    :param visited: VisitedStore to keep visited urls in. By default, full urls are stored
+    :param prefetch: whether to request the next search engine result page in background
+    :return: an async generator of results - objects of the form
+        {"url":..., "text":..., "rec.depth":..., "parent_url":..., "search_page":..., "engines":..., "index":...}
+    """
+    return AsyncRecursiveSearch(
+        extractor, query, limit=limit, depth_limit=depth_limit, search_mode=search_mode, concurrency=concurrency,
+        visited=visited, prefetch=prefetch
+    ).results()
+
+
+class AsyncRecursiveSearch:
+    """
+    A search of async_recursive_link_generator(). Iterate over results() (in an event loop) to run it
+    """
+
+    def __init__(self, extractor, query, limit, depth_limit, search_mode, concurrency, visited, prefetch):
+        """
+        Parameters are the same as of async_recursive_link_generator()
+        """
+        self.extractor = extractor
+        self.query = query
+        self.limit = limit
+        self.depth_limit = depth_limit
+        self.search_mode = search_mode
+        self.concurrency = concurrency
+        self.visited = visited if visited is not None else VisitedStoreRegistry.create(expected_items=limit)
+        self.prefetch = prefetch
+        self.query_words = extractor.get_query_words(query)
+        self.scheduler = extractor.get_scheduler()
+        self.logger = SearchLogger.get_logger()
+        self._index = 0
+        self._empty_attempts = 0
+        # Создаются в цикле событий, при запуске поиска
+        self._loop = None
+        self._executor = None
+        self._semaphore = None
+
+    async def results(self):
+        """
+        :return: an async generator of results (see async_recursive_link_generator())
+        """
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency + 1)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        link_batch_gen = self.extractor.search_link_batches(self.query, prefetch=self.prefetch)
+        try:
+            for search_page in itertools.count(1):
+                links = await self._next_search_links(link_batch_gen)
+                if links is None:
+                    return
+                async for result in self._crawl(links, search_page):
+                    yield result
+                if self._limit_reached():
+                    return
+        finally:
+            link_batch_gen.close()
+            self._executor.shutdown(wait=False)
+            self.logger.info(f"Visited urls store - {self.visited.describe()}")
+
+    def _limit_reached(self):
+        return len(self.visited) == self.limit
+
+    async def _next_search_links(self, link_batch_gen):
+        """
+        :return: the links of the next search engine result page (possibly none), or None, if the search
+        should stop: there are no more pages, or the engine has given no links several times in a row
+        """
+        links = await self._loop.run_in_executor(self._executor, next, link_batch_gen, None)
+        if links is None:
+            return None
+        self._empty_attempts = 0 if links else self._empty_attempts + 1
+        if self._empty_attempts >= self.extractor.max_empty_attempts:
+            self.logger.warning(
+                f"Request to search engine returned an empty set of links for {self._empty_attempts} "
+                "consecutive times. \nProbably hit captcha defence. You can try a different engine. "
+                "Exiting..."
+            )
+            return None
+        return links
+
+    async def _crawl(self, links, search_page):
+        """
+        Yields the new links of a search engine result page, and then goes breadth-first under them.
+        Stops, once the limit is reached
+        :param links: links from the search engine
+        :param search_page: number of the search engine result page
+        :return: an async generator of results
+        """
+        frontier = []
+        for link in self._new_links(None, links, self.extractor.engine_names()):
+            yield self._result(link, 0, None, search_page)
+            frontier.append(link)
+            if self._limit_reached():
+                return
+        for lev in range(1, self.depth_limit):
+            next_frontier = []
+            async for result in self._crawl_level(frontier, lev, search_page, next_frontier):
+                yield result
+            if self._limit_reached():
+                return
+            frontier = next_frontier
+
+    async def _crawl_level(self, frontier, lev, search_page, next_frontier):
+        """
+        Fetches the pages of one recursion level, and yields the new links from them, in the order
+        of <frontier>. Stops, once the limit is reached
+        :param frontier: links of the previous level
+        :param lev: the recursion level of the new links
+        :param next_frontier: a list, to add the new links to, for the next level
+        :return: an async generator of results
+        """
+        level_sublinks = self._ordered_sublinks(frontier)
+        try:
+            async for parent, sublinks in level_sublinks:
+                for link in self._new_links(parent["url"], sublinks, parent["engines"]):
+                    yield self._result(link, lev, parent["url"], search_page)
+                    next_frontier.append(link)
+                    if self._limit_reached():
+                        return
+        finally:
+            await level_sublinks.aclose()  # Отменяем запросы, которые еще в полете
+
+    def _result(self, link, lev, parent_url, search_page):
+        self._index += 1
+        return {**link, "rec.depth": lev, "parent_url": parent_url, "search_page": search_page, "index": self._index}
+
+    async def _fetch_sublinks(self, link):
+        # Ждем свободного слота для хоста этой ссылки. Запросы к разным хостам не ждут друг друга,
+        # а страницы, которые будут взяты из кэша или WARC архива без запроса, слот не занимают
+        if await self._loop.run_in_executor(self._executor, page_needs_request, link["url"]):
+            await asyncio.sleep(self.scheduler.reserve(link["url"]))
+        async with self._semaphore:
+            link_contents = await self._loop.run_in_executor(self._executor, read_web_page, link["url"])
+        if not link_contents:
+            self.logger.warning("Could not read the page %s", link["url"])
+            return []
+        return await self._loop.run_in_executor(
+            self._executor, _recursive_sublinks, link_contents, self.query_words, self.search_mode, self.visited
+        )
+
+    async def _ordered_sublinks(self, frontier):
+        """
+        Fetches the pages for the links in <frontier>, keeping a bounded window of
+        requests in flight, and yields (link, sublinks) pairs in the order of <frontier>
+        """
+        pending = deque()
+        try:
+            for link in frontier:
+                if not link_is_valid_for_recursion(link):
+                    continue
+                pending.append((link, asyncio.ensure_future(self._fetch_sublinks(link))))
+                if len(pending) >= 2 * self.concurrency:
+                    head, task = pending.popleft()
+                    yield head, await task
+            while pending:
+                head, task = pending.popleft()
+                yield head, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    def _new_links(self, parent_url, links, engines):
+        for link in links:
+            link = fix_child_link(parent_url, link)
+            canonical_url = to_canonical_url(link["url"])
+            if canonical_url in self.visited:
+                continue
+            self.logger.info("Adding link: %s", canonical_url, sample="links")
+            self.visited.add(canonical_url)
+            yield {**link, "engines": link.get("engines", engines)}
+
+
+async def collect(async_gen):
+    """
+    Collects the results of an async generator into a list
+    :param async_gen: async generator
+    :return: a list
+    """
+    return [item async for item in async_gen]
+
+
+def iterate(async_gen):
+    """
+    Iterates over an async generator from synchronous code, running it in a new event loop
+    :param async_gen: async generator
+    :return: a generator of the same items
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_gen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(async_gen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
@@ -0,0 +1,222 @@
+"""
+Batch search: runs the queries of a file in a pool of worker processes, and merges their results
+into one stream, each result tagged with its query.
+
+The workers share, through a multiprocessing manager process:
+
+ - the host schedulers of the drivers (SharedSchedulers), so that the delays between requests to
+   a search engine (delay_in_seconds_between_search_requests), and to any other host, hold for all the
+   workers together, as for a single process
+ - url claims (UrlClaims), so that a page, found by several queries, is fetched once, by the first
+   worker to get to it, and the others take it from the shared ResponseCache. Without the cache
+   (--no-cache) the pages are not shared.
+"""
+import multiprocessing
+import queue
+import time
+from multiprocessing.managers import BaseManager
+import search.drivers  # noqa: F401  Need this to declare drivers in the worker processes
+from .logger import SearchLogger
+from .cache import UrlClaims
+from .scheduler import SharedSchedulers
+from .metrics import CrawlMetrics
+from .runner import get_extractor, search_results, init_process, DEFAULT_BATCH_WORKERS
+
+
+RESULTS_QUEUE_SIZE = 1000   # Results, waiting to be written. Workers wait, when the queue is full
+POLL_INTERVAL = 0.1         # Seconds
+
+
+def read_queries(path):
+    """
+    :param path: path to a text file with a query per line. Empty lines and lines starting with '#' are skipped
+    :return: a list of distinct queries, in the order of the file
+    """
+    with open(path, encoding="utf8") as f:
+        lines = [line.strip() for line in f]
+    return list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+
+
+class BatchManager(BaseManager):
+    """
+    The process, which keeps the state shared by the workers of a batch search
+    """
+
+
+BatchManager.register("SharedSchedulers", SharedSchedulers)
+BatchManager.register("UrlClaims", UrlClaims)
+
+
+_results_queue = None   # Очередь результатов рабочего процесса (см. _init_worker)
+
+
+def _init_worker(settings, log_records, schedulers, claims, results_queue):
+    """
+    Initializes a worker process (see init_process())
+    """
+    global _results_queue
+    _results_queue = results_queue
+    init_process(settings, log_records)
+    SharedSchedulers.init_shared(schedulers)
+    UrlClaims.init_claims(claims)
+
+
+def _run_query(number, query, engines, search_params):
+    """
+    Runs a search in a worker process, and puts its results to the results queue
+    :return: a dict with the summary of the search
+    """
+    CrawlMetrics.init_metrics()
+    start = time.perf_counter()
+    count = 0
+    error = None
+    try:
+        for result in search_results(get_extractor(engines), query, **search_params):
+            count += 1
+            _results_queue.put((number, result))
+    except Exception as e:
+        # Ошибка одного запроса не должна останавливать весь пакет
+        error = f"{type(e).__name__}: {e}"
+        SearchLogger.get_logger().error("Search for %r failed: %s", query, error)
+    return {
+        "number": number,
+        "query": query,
+        "results": count,
+        "seconds": time.perf_counter() - start,
+        "error": error,
+        "metrics": CrawlMetrics.get_metrics(),
+    }
+
+
+def response_counts(metrics):
+    """
+    :param metrics: CrawlMetrics of a search
+    :return: a triple (pages fetched from the network, pages taken from the cache, pages fetched by other workers)
+    """
+    counts = {"cached": 0, "shared": 0, "fetched": 0}
+    for counter in metrics.to_dict()["counters"]:
+        if counter["name"] == "responses_total":
+            status = counter["labels"]["status"]
+            counts[status if status in counts else "fetched"] += counter["value"]
+    return counts["fetched"], counts["cached"], counts["shared"]
+
+
+def summary_row(summary):
+    """
+    :param summary: summary of a search, or the totals of all the searches
+    :return: a list of the results count, seconds, pages read and error, formatted for a table
+    """
+    return [
+        summary["results"], f"{summary['seconds']:.1f}", summary["fetched"], summary["cached"], summary["shared"],
+        summary["error"] or ""
+    ]
+
+
+class BatchSearch:
+    """
+    Runs the searches for a list of queries in worker processes. Iterate over results() to run them
+    """
+
+    def __init__(self, queries, engines, settings, workers=DEFAULT_BATCH_WORKERS, **search_params):
+        """
+        :param queries: a list of queries
+        :param engines: list of names of search engines
+        :param settings: dict with the settings of the worker processes (see init_process())
+        :param workers: number of worker processes
+        :param search_params: keyword arguments of search_results(), the same for all queries
+        """
+        self.queries = queries
+        self.engines = engines
+        self.workers = min(workers, len(queries)) or 1
+        self.settings = settings
+        self.search_params = search_params
+        self.summaries = [None] * len(queries)
+        self.seconds = None
+
+    def results(self):
+        """
+        :return: a generator of the results of all the queries, as they are found, each with the
+        "query" key. The summaries of the searches are available once it is exhausted
+        """
+        logger = SearchLogger.get_logger()
+        start = time.perf_counter()
+        # Рабочие процессы запускаются заново (spawn), а не копией текущего: в нем уже работают потоки
+        context = multiprocessing.get_context("spawn")
+        results_queue = context.Queue(maxsize=RESULTS_QUEUE_SIZE)
+        with BatchManager(ctx=context) as manager, logger.worker_records(context) as log_records:
+            pool = context.Pool(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.settings, log_records, manager.SharedSchedulers(),
+                    manager.UrlClaims() if self.settings["cache"] else None, results_queue
+                )
+            )
+            try:
+                pending = [
+                    pool.apply_async(_run_query, (number, query, self.engines, self.search_params))
+                    for number, query in enumerate(self.queries)
+                ]
+                received = [0] * len(self.queries)
+                while pending or self._unreceived(received):
+                    try:
+                        number, result = results_queue.get(timeout=POLL_INTERVAL)
+                        received[number] += 1
+                        yield {"query": self.queries[number], **result}
+                    except queue.Empty:
+                        pass
+                    for task in [task for task in pending if task.ready()]:
+                        pending.remove(task)
+                        self._finish(task.get(), logger)
+            except BaseException:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        self.seconds = time.perf_counter() - start
+
+    def _unreceived(self, received):
+        """
+        Итоги поиска приходят раньше, чем из очереди прочитаны все его результаты
+        :param received: количество полученных результатов каждого запроса
+        :return: True, если есть законченные поиски, не все результаты которых получены
+        """
+        return any(
+            summary and received[number] < summary["results"] for number, summary in enumerate(self.summaries)
+        )
+
+    def _finish(self, summary, logger):
+        metrics = summary.pop("metrics")
+        summary["fetched"], summary["cached"], summary["shared"] = response_counts(metrics)
+        self.summaries[summary["number"]] = summary
+        if CrawlMetrics.get_metrics():
+            CrawlMetrics.get_metrics().merge(metrics)
+        done = sum(1 for s in self.summaries if s)
+        logger.info(
+            "Query %s of %s done: %r, %s results in %.1f seconds%s", done, len(self.queries), summary["query"],
+            summary["results"], summary["seconds"], f", error: {summary['error']}" if summary["error"] else ""
+        )
+
+    def summary(self):
+        """
+        :return: string, a table with the results count, time and pages read by each search
+        """
+        from tabulate import tabulate
+        summaries = [s for s in self.summaries if s]
+        total = {
+            key: sum(s[key] for s in summaries) for key in ("results", "seconds", "fetched", "cached", "shared")
+        }
+        rows = [
+            *([s["number"] + 1, s["query"], *summary_row(s)] for s in summaries),
+            ["", "Total", *summary_row({**total, "error": sum(1 for s in summaries if s["error"])})]
+        ]
+        return "\n\n".join([
+            f"Batch search: {len(summaries)} queries, {self.workers} worker processes, "
+            f"{self.seconds or 0:.1f} seconds ({total['seconds']:.1f} seconds of searches)",
+            tabulate(rows, headers=["#", "Query", "Results", "Seconds", "Fetched", "From cache", "Shared", "Error"])
+        ])
+
+    def log_summary(self):
+        SearchLogger.get_logger().info("\n%s\n", self.summary(), force_console_print=True)
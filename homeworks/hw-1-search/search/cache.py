@@ -0,0 +1,302 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple, OrderedDict
+from urllib.parse import urlparse, urlunparse
+from .logger import SearchLogger
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "websearch", "responses.sqlite")
+DEFAULT_CACHE_TTL = 24 * 60 * 60            # Seconds
+DEFAULT_CACHE_MAX_SIZE = 200 * 1024 * 1024  # Bytes, of compressed bodies
+DEFAULT_CLAIM_TIMEOUT = 120                 # Seconds to wait for a url, which another process is fetching
+DEFAULT_KEPT_CLAIMS = 10000                 # Released claims of urls, which gave no stored response, kept
+SIZE_CHECK_INTERVAL = 100                   # Stores, after which the total size is read from the database again
+
+
+CacheEntry = namedtuple("CacheEntry", ["text", "etag", "last_modified", "fresh"])
+
+
+def cache_key(url):
+    """
+    Converts a url into the key used by the cache. Unlike to_canonical_url(), keeps the
+    url query, since it matters for search engine result pages.
+    :param url: a string
+    :return: a string
+    """
+    parsed_url = urlparse(url)
+    return urlunparse([
+        parsed_url.scheme.lower(),
+        parsed_url.netloc.lower(),
+        parsed_url.path or "/",
+        parsed_url.params,
+        parsed_url.query,
+        ''
+    ])
+
+
+class ResponseCache:
+    """
+    Persistent cache of HTTP responses, stored in a SQLite database. Response bodies are
+    stored compressed. Entries older than <ttl> are revalidated with the server, using
+    ETag / Last-Modified headers when available. When the total size of stored bodies
+    exceeds <max_size>, the least recently used entries are evicted. Thread-safe. The database
+    may be shared by several processes (see batch.py), so the total size is read from it again
+    before evicting, and every SIZE_CHECK_INTERVAL stores.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_cache(cls):
+        """
+        :return: the shared ResponseCache instance, or None if caching is not enabled
+        """
+        return cls._instance
+
+    @classmethod
+    def init_cache(cls, *args, **kwargs):
+        """
+        Enables caching, with given settings. Takes the same arguments as the constructor
+        """
+        if cls._instance:
+            cls._instance.close()
+        cls._instance = cls(*args, **kwargs)
+
+    @classmethod
+    def disable_cache(cls):
+        if cls._instance:
+            cls._instance.close()
+        cls._instance = None
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL, max_size=DEFAULT_CACHE_MAX_SIZE,
+                 refresh=False):
+        """
+        :param path: path to the SQLite database file
+        :param ttl: number of seconds a stored response is used without revalidation
+        :param max_size: max total size (bytes) of stored response bodies
+        :param refresh: if True, all stored responses are considered stale, and are revalidated
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+            CREATE INDEX IF NOT EXISTS responses_size ON responses (size);
+        """)
+        with self._lock:
+            self._total_size = self._stored_size()
+
+    def _stored_size(self):
+        """
+        Reads the total size of stored bodies, including the ones stored by other processes. Should
+        be called with the lock held
+        :return: number of bytes
+        """
+        # Индекс по size позволяет посчитать сумму, не читая сами тела ответов
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def lookup(self, url):
+        """
+        Looks up a stored response for the url
+        :param url: string url
+        :return: CacheEntry or None
+        """
+        key = cache_key(url)
+        # Соединение общее для потоков: строка читается, и счетчики меняются, под блокировкой
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            body, etag, last_modified, stored_at = row
+            now = time.time()
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            fresh = not self.refresh and now - stored_at < self.ttl
+            if fresh:
+                self.hits += 1
+        return CacheEntry(zlib.decompress(body).decode("utf8"), etag, last_modified, fresh)
+
+    def is_fresh(self, url):
+        """
+        Checks whether lookup() would return a fresh response for the url. Unlike lookup(), it is not
+        counted as a hit or a miss, and does not change the access time of the entry
+        :param url: string url
+        :return: True or False
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT stored_at FROM responses WHERE key = ?", (cache_key(url),)
+            ).fetchone()
+        return bool(row) and not self.refresh and time.time() - row[0] < self.ttl
+
+    @staticmethod
+    def revalidation_headers(entry):
+        """
+        :param entry: CacheEntry
+        :return: a dict of conditional request headers for a stale entry
+        """
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def store(self, url, text, etag=None, last_modified=None):
+        """
+        Stores (or replaces) the response for the url, and evicts least recently used
+        entries if the cache gets too big
+        """
+        key = cache_key(url)
+        body = zlib.compress(text.encode("utf8"))
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, etag, last_modified, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, len(body), etag, last_modified, now, now)
+            )
+            self._total_size += len(body) - (row[0] if row else 0)
+            self._stores += 1
+            # Свой счётчик не видит ответов, сохранённых другими процессами - перед вытеснением
+            # и время от времени размер пересчитывается по базе
+            if self._total_size > self.max_size or self._stores % SIZE_CHECK_INTERVAL == 0:
+                self._total_size = self._stored_size()
+                if self._total_size > self.max_size:
+                    self._evict()
+
+    def mark_revalidated(self, url):
+        """
+        Marks the stored response for the url as fresh again, after the server has
+        confirmed (with 304 response) that it has not changed
+        """
+        now = time.time()
+        with self._lock:
+            self.revalidated += 1
+            self._connection.execute(
+                "UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, cache_key(url))
+            )
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the total size is under the limit. Should
+        be called with the lock held
+        """
+        to_free = self._total_size - self.max_size
+        keys = []
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if to_free <= 0:
+                break
+            keys.append((key,))
+            to_free -= size
+            self._total_size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        SearchLogger.get_logger().debug("Evicted %s responses from the cache", len(keys))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.execute("VACUUM")
+            self._total_size = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class UrlClaims:
+    """
+    Makes the processes of a batch search (see batch.py) fetch each url once: the first process
+    to claim a url fetches it, and stores the response in the shared ResponseCache, while the others
+    wait for it, and take the page from the cache. An instance lives in a multiprocessing manager
+    process, and the others use it through a proxy, enabled with init_claims(). Thread-safe. A claim
+    is discarded once the response is stored in the cache, where the other processes find it then. Claims
+    of urls, which gave no stored response (errors, not HTML pages), are kept, up to <max_kept> latest.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_claims(cls):
+        """
+        :return: proxy of the shared claims, or None if urls are not claimed
+        """
+        return cls._instance
+
+    @classmethod
+    def init_claims(cls, proxy):
+        """
+        :param proxy: a multiprocessing manager proxy of a UrlClaims instance
+        """
+        cls._instance = proxy
+
+    def __init__(self, timeout=DEFAULT_CLAIM_TIMEOUT, max_kept=DEFAULT_KEPT_CLAIMS):
+        """
+        :param timeout: max number of seconds to wait for a url claimed by another process
+        :param max_kept: max number of kept claims of urls, which gave no stored response
+        """
+        self.timeout = timeout
+        self.max_kept = max_kept
+        self._fetched = {}              # Ключ url -> threading.Event, установленный, когда url прочитан
+        self._kept = OrderedDict()      # Ключи прочитанных url, ответ которых не сохранён в кэш
+        self._lock = threading.Lock()
+
+    def claim(self, url):
+        """
+        :param url: string url
+        :return: True if the caller should fetch the url (and release() it then), or False if the url
+        has been fetched by another process. Waits while the url is being fetched
+        """
+        key = cache_key(url)
+        with self._lock:
+            fetched = self._fetched.get(key)
+            if fetched is None:
+                self._fetched[key] = threading.Event()
+                return True
+        # Если владелец не успел за timeout (завис, упал) - url читает тот, кто ждал
+        return not fetched.wait(self.timeout)
+
+    def release(self, url, stored=False):
+        """
+        Marks a claimed url as fetched
+        :param url: string url
+        :param stored: True if the response is stored in the cache. Then the claim is discarded
+        """
+        key = cache_key(url)
+        with self._lock:
+            # Ждущие держат ссылку на Event и просыпаются, даже если заявка уже удалена
+            fetched = self._fetched.pop(key, None) if stored else self._fetched.get(key)
+            if fetched:
+                fetched.set()
+            if stored:
+                self._kept.pop(key, None)
+                return
+            self._kept[key] = None
+            self._kept.move_to_end(key)
+            while len(self._kept) > self.max_kept:
+                self._fetched.pop(self._kept.popitem(last=False)[0], None)
@@ -0,0 +1,71 @@
+import os
+import pickle
+import time
+from .logger import SearchLogger
+
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "websearch", "checkpoint.pickle")
+DEFAULT_CHECKPOINT_INTERVAL = 30    # Seconds
+CHECKPOINT_VERSION = 3
+
+
+class CrawlCheckpoint:
+    """
+    Periodically saves the state of a recursive search into a local file, so that an
+    interrupted search can be resumed without reading the same pages again. The state is
+    a dict, saved with pickle; the file is replaced atomically.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        :param path: path to the checkpoint file
+        :param interval: min number of seconds between two periodic checkpoints
+        """
+        self.path = path
+        self.interval = interval
+        self._last_saved = time.monotonic()
+
+    def due(self):
+        """
+        :return: True if it's time for the next periodic checkpoint
+        """
+        return time.monotonic() - self._last_saved >= self.interval
+
+    def save(self, state):
+        """
+        :param state: a dict with the search state
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({**state, "version": CHECKPOINT_VERSION}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._last_saved = time.monotonic()
+        SearchLogger.get_logger().info(
+            f"Saved checkpoint with {len(state['results'])} results to {self.path}"
+        )
+
+    def load(self):
+        """
+        :return: the saved state (dict), or None if there is no usable checkpoint
+        """
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            SearchLogger.get_logger().warning(f"Could not read checkpoint {self.path}: {e}")
+            return None
+        if state.get("version") != CHECKPOINT_VERSION:
+            SearchLogger.get_logger().warning(f"Checkpoint {self.path} has unsupported format, ignoring it")
+            return None
+        return state
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
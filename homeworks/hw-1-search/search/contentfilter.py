@@ -0,0 +1,144 @@
+import threading
+import time
+from urllib.parse import urlparse
+from .logger import SearchLogger
+from .metrics import CrawlMetrics
+
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+DEFAULT_MAX_PAGE_SIZE = 2 * 1024 * 1024     # Bytes
+DEFAULT_MAX_NON_HTML_STREAK = 3             # Non-HTML responses in a row from a host, after which it is blocked
+DEFAULT_MAX_NON_HTML_RATIO = 0.5            # Share of non-HTML responses from a host, after which it is blocked
+DEFAULT_MIN_RATIO_RESPONSES = 10            # Responses from a host, before the share is checked
+DEFAULT_BLOCK_TTL = 60 * 60                 # Seconds a blocked host is not requested
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ContentFilter:
+    """
+    Keeps the crawler from downloading anything but reasonably sized HTML pages. Checks the
+    headers of streamed responses before the body is read, reads the body up to a size cap,
+    and remembers the hosts which keep serving non-HTML content, so that they are not
+    requested again for block_ttl seconds. Thread-safe.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_filter(cls):
+        """
+        Returns the shared filter, creating it with default settings on first use
+        :return: ContentFilter
+        """
+        if not cls._instance:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def init_filter(cls, *args, **kwargs):
+        cls._instance = cls(*args, **kwargs)
+
+    def __init__(self, max_page_size=DEFAULT_MAX_PAGE_SIZE, max_non_html_streak=DEFAULT_MAX_NON_HTML_STREAK,
+                 max_non_html_ratio=DEFAULT_MAX_NON_HTML_RATIO, min_ratio_responses=DEFAULT_MIN_RATIO_RESPONSES,
+                 block_ttl=DEFAULT_BLOCK_TTL):
+        """
+        :param max_page_size: max number of bytes to read from a response body
+        :param max_non_html_streak: number of non-HTML responses in a row from a host, after which
+        the host is considered blocked
+        :param max_non_html_ratio: share of non-HTML responses from a host, after which the host is
+        considered blocked
+        :param min_ratio_responses: number of responses from a host, before the share is checked
+        :param block_ttl: number of seconds a host stays blocked, or None to block it for good
+        """
+        self.max_page_size = max_page_size
+        self.max_non_html_streak = max_non_html_streak
+        self.max_non_html_ratio = max_non_html_ratio
+        self.min_ratio_responses = min_ratio_responses
+        self.block_ttl = block_ttl
+        # Хост -> (число ответов, число не-HTML ответов, число не-HTML ответов подряд)
+        self._responses = {}
+        self._blocked_at = {}
+        self._lock = threading.Lock()
+
+    def is_blocked_host(self, url):
+        """
+        :param url: string url
+        :return: True if the host of the url has been blocked for serving non-HTML responses,
+        less than block_ttl seconds ago
+        """
+        netloc = urlparse(url).netloc
+        blocked_at = self._blocked_at.get(netloc)
+        if blocked_at is None:
+            return False
+        if self.block_ttl is not None and time.monotonic() - blocked_at >= self.block_ttl:
+            # Блокировка истекла: хост проверяется заново, с чистой статистикой
+            with self._lock:
+                self._responses.pop(netloc, None)
+                self._blocked_at.pop(netloc, None)
+            return False
+        return True
+
+    def _register_response(self, url, html):
+        netloc = urlparse(url).netloc
+        with self._lock:
+            responses, non_html, streak = self._responses.get(netloc, (0, 0, 0))
+            responses += 1
+            non_html, streak = (non_html, 0) if html else (non_html + 1, streak + 1)
+            self._responses[netloc] = (responses, non_html, streak)
+            block = netloc not in self._blocked_at and self._too_many_non_html(responses, non_html, streak)
+            if block:
+                self._blocked_at[netloc] = time.monotonic()
+        if block:
+            SearchLogger.get_logger().info(
+                "Host %s served %s non-HTML responses of %s (%s in a row), it will not be requested for a while",
+                netloc, non_html, responses, streak
+            )
+
+    def _too_many_non_html(self, responses, non_html, streak):
+        if streak >= self.max_non_html_streak:
+            return True
+        return responses >= self.min_ratio_responses and non_html >= self.max_non_html_ratio * responses
+
+    def accepts(self, url, headers):
+        """
+        Checks response headers, before the body is read
+        :param url: string url
+        :param headers: response headers
+        :return: True if the response looks like an HTML page of acceptable size
+        """
+        content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and content_type not in HTML_CONTENT_TYPES:
+            SearchLogger.get_logger().info("Skipping non-HTML (%s) response for url %s", content_type, url)
+            self._register_response(url, html=False)
+            return False
+        self._register_response(url, html=True)
+        content_length = headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > self.max_page_size:
+            SearchLogger.get_logger().info(
+                "Skipping response of %s bytes for url %s. Limit is %s bytes", content_length, url, self.max_page_size
+            )
+            return False
+        return True
+
+    def read_text(self, url, response):
+        """
+        Reads the body of a streamed response, up to max_page_size bytes, and decodes it
+        :param url: string url
+        :param response: requests.Response, obtained with stream=True
+        :return: string
+        """
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_page_size:
+                SearchLogger.get_logger().info(
+                    "Page at %s is larger than %s bytes, the rest is skipped", url, self.max_page_size
+                )
+                break
+        metrics = CrawlMetrics.get_metrics()
+        if metrics:
+            metrics.inc("downloaded_bytes_total", size, host=urlparse(url).netloc)
+        body = b"".join(chunks)[:self.max_page_size]
+        return body.decode(response.encoding or "utf-8", errors="replace")
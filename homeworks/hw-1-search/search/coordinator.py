@@ -0,0 +1,540 @@
+"""
+Coordinator of a distributed crawl (see distributed.py): the state shared by the processes of the crawl,
+possibly on several machines. It owns the visited urls, the results (counted against the limit), the frontier
+of pages to crawl, split into shards by host, and the per-host delays between requests.
+
+Storage of the state is pluggable (see CoordinatorRegistry):
+
+ - sqlite: a SQLite database file, opened by all the processes, with no coordinator process at all. For
+   the processes of one machine
+ - socket: memory of a coordinator process, started by the search, which the workers reach through a Unix
+   socket (a path) or TCP (HOST:PORT), so that workers on other machines can join the crawl
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from multiprocessing.managers import BaseManager
+from urllib.parse import urlparse
+from .searchutils import to_canonical_url, randomize_delay
+from .scheduler import HostScheduler
+from .visited import VisitedStoreRegistry, url_fingerprint
+
+
+DEFAULT_COORDINATOR_PATH = os.path.join(os.path.expanduser("~"), ".cache", "websearch", "coordinator.sqlite")
+DEFAULT_COORDINATOR_SOCKET = os.path.join(os.path.expanduser("~"), ".cache", "websearch", "coordinator.sock")
+DEFAULT_LEASE_TIMEOUT = 120     # Seconds, after which the pages taken by a worker, which did not report back, are retaken
+
+RUNNING = "running"
+FINISHED = "finished"   # Набрано нужное число результатов
+STOPPED = "stopped"     # Поиск остановлен раньше (закончились ссылки, ошибка, Ctrl-C)
+
+
+def shard_of(url, shards):
+    """
+    :param url: string url
+    :param shards: number of shards
+    :return: number of the shard of the url's host, the same in all the processes
+    """
+    return url_fingerprint(urlparse(url).netloc) % shards
+
+
+def parse_address(address):
+    """
+    :param address: HOST:PORT, or a path of a Unix socket
+    :return: address for multiprocessing.connection: a pair (host, port), or the path
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def _crawl_records(links, depth, parent_url, search_page, engines):
+    """
+    :return: a generator of pairs (canonical url, record), where records are result objects without the index
+    """
+    for link in links:
+        yield to_canonical_url(link["url"]), {
+            **link,
+            "rec.depth": depth,
+            "parent_url": parent_url,
+            "search_page": search_page,
+            "engines": link.get("engines", engines)
+        }
+
+
+class CrawlCoordinator(ABC):
+    """
+    State of a distributed crawl. The search start()s the crawl with its settings, and adds the links
+    from the search engine; the workers take() pages of their shards, and add the links found on them.
+    Each link is a result, if it has not been visited yet, and the limit has not been reached yet; and
+    it is queued to be crawled, if the depth limit allows. The crawl is finished when the limit is reached.
+    Settings of a crawl (a dict):
+
+     - limit, depth_limit, shards
+     - query_words, search_mode - to match the links of the pages against
+     - default_interval, intervals - per-host delays between requests (see HostScheduler)
+     - visited, bloom_error_rate - visited urls store, where the storage keeps it in memory
+     - process - settings of the worker processes, which are not specific to their machine (see init_process())
+    """
+    default_address = None
+
+    @classmethod
+    @abstractmethod
+    def connect(cls, address=None, key=None):
+        """
+        :param address: where the state is kept, default_address if None
+        :param key: authentication key, if the storage needs one
+        :return: the coordinator
+        """
+        pass
+
+    @classmethod
+    @contextmanager
+    def serving(cls, address=None, key=None):
+        """
+        Opens the coordinator for the process, which runs the search, for the time of the search
+        :return: a context manager of the coordinator
+        """
+        coordinator = cls.connect(address, key)
+        try:
+            yield coordinator
+        finally:
+            coordinator.close()
+
+    @abstractmethod
+    def start(self, settings):
+        """
+        Starts a new crawl, forgetting the previous one
+        :param settings: a dict with the settings of the crawl
+        """
+        pass
+
+    @abstractmethod
+    def get_settings(self):
+        """
+        :return: the settings of the crawl, or None if no crawl has been started
+        """
+        pass
+
+    @abstractmethod
+    def add_links(self, links, depth, parent_url=None, search_page=None, engines=None):
+        """
+        Adds the links found on a page (or on a search engine result page), as results and to the frontier
+        :param links: a list of objects {"url":..., "text":...}
+        :param depth: recursion depth of the links
+        :param parent_url: url of the page, None for links from the search engine
+        :param search_page: number of the search engine result page, which the links come from
+        :param engines: names of the search engines, which the links come from
+        :return: number of new results
+        """
+        pass
+
+    @abstractmethod
+    def take(self, shard, count):
+        """
+        Takes pages to crawl from the frontier of a shard. They are given to other workers again, unless
+        finish()ed within the lease timeout
+        :param shard: number of the shard
+        :param count: max number of pages
+        :return: a list of pairs (entry id, record of the page), empty if the crawl is not running
+        """
+        pass
+
+    @abstractmethod
+    def finish(self, entry_ids):
+        """
+        Removes crawled pages from the frontier
+        :param entry_ids: ids of the entries given by take()
+        """
+        pass
+
+    @abstractmethod
+    def reserve(self, url):
+        """
+        Reserves the next free time slot for a request to the host of <url>
+        :return: number of seconds to wait before sending the request
+        """
+        pass
+
+    @abstractmethod
+    def results(self, after=0, count=None):
+        """
+        :param after: index of the last result already taken
+        :param count: max number of results
+        :return: a list of result objects, with indexes above <after>, in the order of indexes
+        """
+        pass
+
+    @abstractmethod
+    def status(self):
+        """
+        :return: a dict with the state of the crawl ("running", "finished", "stopped" or None), the numbers of
+        results, and of the pages queued and being crawled, and the list of the shards with queued pages
+        """
+        pass
+
+    @abstractmethod
+    def is_running(self):
+        """
+        :return: True while the crawl is running
+        """
+        pass
+
+    @abstractmethod
+    def stop(self):
+        """
+        Stops the crawl, if it is still running. Workers stop after the pages they are crawling
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteCoordinator(CrawlCoordinator):
+    """
+    Keeps the state of the crawl in a SQLite database file, which every process opens by itself, so
+    that no coordinator process is needed. Each operation is a transaction. Thread-safe.
+    """
+    default_address = DEFAULT_COORDINATOR_PATH
+
+    @classmethod
+    def connect(cls, address=None, key=None):
+        return cls(address or cls.default_address)
+
+    def __init__(self, path=DEFAULT_COORDINATOR_PATH):
+        """
+        :param path: path to the SQLite database file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._settings = None
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS crawl (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS visited (url TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS results (idx INTEGER PRIMARY KEY, entry TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS frontier (
+                id INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                entry TEXT NOT NULL,
+                leased_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS frontier_shard ON frontier (shard, id);
+            CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, next_slot REAL NOT NULL);
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # Блокировка на запись берется сразу, чтобы проверка и изменение состояния были атомарными
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    @staticmethod
+    def _get(connection, key):
+        row = connection.execute("SELECT value FROM crawl WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _set(connection, key, value):
+        connection.execute("INSERT OR REPLACE INTO crawl (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _crawl_settings(self):
+        if self._settings is None:
+            self._settings = self.get_settings()
+        return self._settings
+
+    def start(self, settings):
+        with self._transaction() as connection:
+            for table in ("crawl", "visited", "results", "frontier", "hosts"):
+                connection.execute(f"DELETE FROM {table}")
+            self._set(connection, "settings", settings)
+            self._set(connection, "state", RUNNING)
+        self._settings = settings
+
+    def get_settings(self):
+        with self._lock:
+            return self._get(self._connection, "settings")
+
+    def add_links(self, links, depth, parent_url=None, search_page=None, engines=None):
+        settings = self._crawl_settings()
+        added = 0
+        with self._transaction() as connection:
+            if self._get(connection, "state") != RUNNING:
+                return 0
+            results = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            for url, record in _crawl_records(links, depth, parent_url, search_page, engines):
+                if not connection.execute("INSERT OR IGNORE INTO visited (url) VALUES (?)", (url,)).rowcount:
+                    continue
+                results += 1
+                added += 1
+                connection.execute(
+                    "INSERT INTO results (idx, entry) VALUES (?, ?)", (results, json.dumps({**record, "index": results}))
+                )
+                if depth < settings["depth_limit"] - 1:
+                    connection.execute(
+                        "INSERT INTO frontier (shard, entry) VALUES (?, ?)",
+                        (shard_of(url, settings["shards"]), json.dumps(record))
+                    )
+                if results == settings["limit"]:
+                    self._set(connection, "state", FINISHED)
+                    break
+        return added
+
+    def take(self, shard, count):
+        lease_timeout = self._crawl_settings().get("lease_timeout", DEFAULT_LEASE_TIMEOUT)
+        with self._transaction() as connection:
+            if self._get(connection, "state") != RUNNING:
+                return []
+            now = time.time()
+            rows = connection.execute(
+                "SELECT id, entry FROM frontier WHERE shard = ? AND (leased_at IS NULL OR leased_at < ?) "
+                "ORDER BY id LIMIT ?",
+                (shard, now - lease_timeout, count)
+            ).fetchall()
+            connection.executemany("UPDATE frontier SET leased_at = ? WHERE id = ?", [(now, row[0]) for row in rows])
+        return [(entry_id, json.loads(entry)) for entry_id, entry in rows]
+
+    def finish(self, entry_ids):
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM frontier WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+
+    def reserve(self, url):
+        settings = self._crawl_settings()
+        netloc = urlparse(url).netloc
+        interval = settings["intervals"].get(netloc, settings["default_interval"])
+        if not interval:
+            return 0
+        with self._transaction() as connection:
+            now = time.time()
+            row = connection.execute("SELECT next_slot FROM hosts WHERE host = ?", (netloc,)).fetchone()
+            slot = max(now, row[0]) if row else now
+            connection.execute(
+                "INSERT OR REPLACE INTO hosts (host, next_slot) VALUES (?, ?)", (netloc, slot + randomize_delay(interval))
+            )
+        return slot - now
+
+    def results(self, after=0, count=None):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT entry FROM results WHERE idx > ? ORDER BY idx LIMIT ?", (after, -1 if count is None else count)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def status(self):
+        with self._lock:
+            state = self._get(self._connection, "state")
+            results = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            queued, leased = self._connection.execute(
+                "SELECT COUNT(*) - COUNT(leased_at), COUNT(leased_at) FROM frontier"
+            ).fetchone()
+            queued_shards = [row[0] for row in self._connection.execute(
+                "SELECT DISTINCT shard FROM frontier WHERE leased_at IS NULL ORDER BY shard"
+            )]
+        return {"state": state, "results": results, "queued": queued, "leased": leased, "queued_shards": queued_shards}
+
+    def is_running(self):
+        with self._lock:
+            return self._get(self._connection, "state") == RUNNING
+
+    def stop(self):
+        with self._transaction() as connection:
+            if self._get(connection, "state") == RUNNING:
+                self._set(connection, "state", STOPPED)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SocketCoordinator(CrawlCoordinator):
+    """
+    Keeps the state of the crawl in memory of a coordinator process, which the search starts with
+    a multiprocessing manager. The workers use it through proxies, connected to a Unix socket or
+    to a TCP port. The visited urls are kept in a VisitedStore of the type given in the settings. Thread-safe.
+    """
+    default_address = DEFAULT_COORDINATOR_SOCKET
+
+    @classmethod
+    def connect(cls, address=None, key=None):
+        manager = CoordinatorManager(address=parse_address(address or cls.default_address), authkey=_authkey(key))
+        manager.connect()
+        return manager.coordinator()
+
+    @classmethod
+    @contextmanager
+    def serving(cls, address=None, key=None):
+        address = parse_address(address or cls.default_address)
+        if isinstance(address, str):
+            # Файл сокета, оставшийся от прерванного поиска, помешал бы запуску
+            directory = os.path.dirname(address)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(address):
+                os.unlink(address)
+        manager = CoordinatorManager(address=address, authkey=_authkey(key), ctx=multiprocessing.get_context("spawn"))
+        manager.start()
+        try:
+            yield manager.coordinator()
+        finally:
+            manager.shutdown()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settings = None
+        self._state = None
+        self._results = []
+
+    def start(self, settings):
+        with self._lock:
+            self._settings = settings
+            self._state = RUNNING
+            self._visited = VisitedStoreRegistry.create(
+                settings["visited"], expected_items=settings["limit"],
+                **({"error_rate": settings["bloom_error_rate"]} if settings["visited"] == "bloom" else {})
+            )
+            self._results = []
+            self._queues = [deque() for _ in range(settings["shards"])]
+            self._leased = {}   # Id записи -> (шард, запись, время выдачи)
+            self._ids = count(1)
+            self._scheduler = HostScheduler(
+                default_interval=settings["default_interval"], intervals=settings["intervals"]
+            )
+
+    def get_settings(self):
+        return self._settings
+
+    def add_links(self, links, depth, parent_url=None, search_page=None, engines=None):
+        added = 0
+        with self._lock:
+            if self._state != RUNNING:
+                return 0
+            for url, record in _crawl_records(links, depth, parent_url, search_page, engines):
+                if url in self._visited:
+                    continue
+                self._visited.add(url)
+                self._results.append({**record, "index": len(self._results) + 1})
+                added += 1
+                if depth < self._settings["depth_limit"] - 1:
+                    self._queues[shard_of(url, self._settings["shards"])].append((next(self._ids), record))
+                if len(self._results) == self._settings["limit"]:
+                    self._state = FINISHED
+                    break
+        return added
+
+    def take(self, shard, count):
+        with self._lock:
+            if self._state != RUNNING:
+                return []
+            now = time.monotonic()
+            lease_timeout = self._settings.get("lease_timeout", DEFAULT_LEASE_TIMEOUT)
+            queue = self._queues[shard]
+            expired = [
+                entry_id for entry_id, (entry_shard, _, leased_at) in self._leased.items()
+                if entry_shard == shard and now - leased_at > lease_timeout
+            ]
+            for entry_id in reversed(expired):
+                queue.appendleft((entry_id, self._leased.pop(entry_id)[1]))
+            taken = []
+            while queue and len(taken) < count:
+                entry_id, record = queue.popleft()
+                self._leased[entry_id] = (shard, record, now)
+                taken.append((entry_id, record))
+            return taken
+
+    def finish(self, entry_ids):
+        with self._lock:
+            for entry_id in entry_ids:
+                self._leased.pop(entry_id, None)
+
+    def reserve(self, url):
+        return self._scheduler.reserve(url)
+
+    def results(self, after=0, count=None):
+        with self._lock:
+            return self._results[after:None if count is None else after + count]
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "results": len(self._results),
+                "queued": sum(len(queue) for queue in self._queues) if self._state else 0,
+                "leased": len(self._leased) if self._state else 0,
+                "queued_shards": [shard for shard, queue in enumerate(self._queues) if queue] if self._state else []
+            }
+
+    def is_running(self):
+        return self._state == RUNNING
+
+    def stop(self):
+        with self._lock:
+            if self._state == RUNNING:
+                self._state = STOPPED
+
+
+_hosted = None     # SocketCoordinator процесса-координатора
+
+
+def _hosted_coordinator():
+    global _hosted
+    if _hosted is None:
+        _hosted = SocketCoordinator()
+    return _hosted
+
+
+def _authkey(key):
+    """
+    :param key: authentication key string, or None to use the key of the current process, which
+    the processes it starts inherit
+    """
+    return key.encode("utf8") if key else multiprocessing.current_process().authkey
+
+
+class CoordinatorManager(BaseManager):
+    """
+    The coordinator process of SocketCoordinator
+    """
+
+
+CoordinatorManager.register("coordinator", callable=_hosted_coordinator)
+
+
+class CoordinatorRegistry:
+    """
+    A class to store available storage types of the crawl coordinator
+    """
+    _registry = {
+        "sqlite": SQLiteCoordinator,
+        "socket": SocketCoordinator,
+    }
+
+    @classmethod
+    def register(cls, name, coordinator_class):
+        cls._registry[name] = coordinator_class
+
+    @classmethod
+    def get(cls, name):
+        return cls._registry[name]
+
+    @classmethod
+    def registered_coordinators_names(cls):
+        return cls._registry.keys()
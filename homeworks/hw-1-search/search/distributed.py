@@ -0,0 +1,405 @@
+"""
+Distributed crawl: the frontier of a recursive search is split into shards by the hash of the host, and
+the pages of each shard are crawled by a worker process, on this machine or on another one. A coordinator
+(see coordinator.py) owns the visited urls, the results counted against the limit, and the per-host
+delays between requests. The search requests the search engine result pages, and adds their links to the
+coordinator; the workers take batches of pages of their shards, and add the links found on them, as results
+and as new pages to crawl. The search streams the results from the coordinator, as they are added.
+
+As with the sync crawler, the pages under a search engine result page are crawled (up to the depth limit)
+before the next result page is used. The pages of a shard are crawled in the order they were found, and the
+shards go on in parallel, so the order of the results is not deterministic.
+
+Workers on other machines join a crawl with the socket coordinator, listening on a TCP address:
+
+    python -m search QUERY --shards 4 --shard_workers 2 --coordinator socket \\
+        --coordinator_address 0.0.0.0:5800 --coordinator_key KEY
+    python -m search.distributed --coordinator socket --coordinator_address HOST:5800 --coordinator_key KEY \\
+        --shard 2 --shard 3
+"""
+import multiprocessing
+import sys
+import time
+import click
+import search.drivers  # noqa: F401  Need this to declare drivers in the worker processes
+from .logger import SearchLogger, DEFAULT_LOG_PATH, DEFAULT_LOG_SAMPLE
+from .searchutils import read_web_page, link_is_valid_for_recursion, valid_page_links
+from .scheduler import HostScheduler
+from .metrics import CrawlMetrics
+from .cache import DEFAULT_CACHE_PATH
+from .coordinator import CoordinatorRegistry, RUNNING, DEFAULT_LEASE_TIMEOUT
+from .visited import DEFAULT_VISITED_STORE, DEFAULT_BLOOM_ERROR_RATE
+from .runner import (
+    init_process, DEFAULT_MAX_RESULTS, DEFAULT_MAX_RECURSION_DEPTH, DEFAULT_SEARCH_MODE, DEFAULT_PREFETCH_FLAG,
+    DEFAULT_COORDINATOR, SUPPORTED_COORDINATORS
+)
+
+
+DEFAULT_PULL_BATCH = 8      # Pages of a shard, taken from the coordinator at once
+DEFAULT_JOIN_TIMEOUT = 60   # Seconds a worker node waits for a crawl to start
+POLL_INTERVAL = 0.1         # Seconds
+
+# Настройки рабочих процессов, общие для всех машин (остальные - пути, журнал, кэш - у каждой машины свои)
+SHARED_PROCESS_SETTINGS = ("parser", "max_page_size", "pool_size", "pool_per_host", "cache_ttl", "cache_size")
+
+
+class CoordinatorScheduler(HostScheduler):
+    """
+    HostScheduler, which reserves the time slots in the crawl coordinator, so that the delays
+    between requests to a host hold for all the workers of the crawl
+    """
+
+    def __init__(self, coordinator):
+        super().__init__()
+        self._coordinator = coordinator
+
+    def reserve(self, url):
+        return self._coordinator.reserve(url)
+
+
+def crawl_shards(coordinator, shards, batch_size=DEFAULT_PULL_BATCH):
+    """
+    Crawls the pages of the given shards, until the crawl is over
+    :param coordinator: CrawlCoordinator of a running crawl
+    :param shards: a list of numbers of shards
+    :param batch_size: number of pages of a shard taken from the coordinator at once
+    :return: a dict with the numbers of pages read and of results added
+    """
+    settings = coordinator.get_settings()
+    scheduler = CoordinatorScheduler(coordinator)
+    pages = results = 0
+    while True:
+        entries = [entry for shard in shards for entry in coordinator.take(shard, batch_size)]
+        if not entries:
+            if not coordinator.is_running():
+                return {"pages": pages, "results": results}
+            time.sleep(POLL_INTERVAL)
+            continue
+        for entry_id, link in entries:
+            # Лимит результатов мог быть достигнут другими процессами: остальные страницы не нужны
+            if not coordinator.is_running():
+                break
+            page_read, page_results = _crawl_page(coordinator, link, settings, scheduler)
+            pages += page_read
+            results += page_results
+            coordinator.finish([entry_id])
+
+
+def _crawl_page(coordinator, link, settings, scheduler):
+    """
+    Reads the page of a link, and adds the links from it to the coordinator
+    :return: a pair: number of pages read (0 or 1), and number of results added
+    """
+    if not link_is_valid_for_recursion(link):
+        return 0, 0
+    logger = SearchLogger.get_logger()
+    logger.info("Recursing (level %s). About to read the url: %s", link["rec.depth"] + 1, link["url"], sample="pages")
+    link_contents = read_web_page(link["url"], scheduler=scheduler)
+    if not link_contents:
+        logger.warning("Could not read the page %s", link["url"])
+        return 1, 0
+    sublinks = [
+        sublink
+        for sublink in valid_page_links(link_contents, settings["query_words"], settings["search_mode"])
+        if link_is_valid_for_recursion(sublink)
+    ]
+    return 1, coordinator.add_links(
+        sublinks, link["rec.depth"] + 1, parent_url=link["url"], search_page=link["search_page"],
+        engines=link["engines"]
+    )
+
+
+_coordinator = None     # Координатор рабочего процесса (см. _init_worker)
+
+
+def _init_worker(settings, log_records, coordinator_name, address, key):
+    """
+    Initializes a local worker process (see init_process())
+    """
+    global _coordinator
+    init_process(settings, log_records)
+    _coordinator = CoordinatorRegistry.get(coordinator_name).connect(address, key)
+
+
+def _crawl_shard(shard):
+    """
+    Crawls a shard in a local worker process
+    :return: a dict with the summary of the shard
+    """
+    CrawlMetrics.init_metrics()
+    summary = {"pages": 0, "results": 0}
+    error = None
+    try:
+        summary = crawl_shards(_coordinator, [shard])
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        SearchLogger.get_logger().error("Crawl of shard %s failed: %s", shard, error)
+    return {"shard": shard, **summary, "error": error, "metrics": CrawlMetrics.get_metrics()}
+
+
+class DistributedSearch:
+    """
+    Runs a recursive search, with the pages crawled by the shard workers. Iterate over results() to run it
+    """
+
+    def __init__(
+            self, extractor, query, settings, shards, shard_workers=None, coordinator=DEFAULT_COORDINATOR,
+            address=None, key=None, limit=DEFAULT_MAX_RESULTS, mode=DEFAULT_SEARCH_MODE,
+            depth_limit=DEFAULT_MAX_RECURSION_DEPTH, visited=DEFAULT_VISITED_STORE,
+            bloom_error_rate=DEFAULT_BLOOM_ERROR_RATE, prefetch=DEFAULT_PREFETCH_FLAG, stall_timeout=DEFAULT_LEASE_TIMEOUT
+    ):
+        """
+        :param extractor: driver class (see get_extractor())
+        :param query: the search query
+        :param settings: dict with the settings of the local worker processes (see init_process())
+        :param shards: number of shards
+        :param shard_workers: number of local worker processes, each crawls a shard. The rest of the shards
+        are left to the workers on other machines. Defaults to <shards>
+        :param coordinator: name of the coordinator storage (see CoordinatorRegistry)
+        :param address: address of the coordinator: path of the SQLite database, or of the Unix socket, or
+        HOST:PORT. Defaults to the default address of the storage
+        :param key: authentication key of the socket coordinator, for workers on other machines
+        :param visited: name of the visited urls store, for the socket coordinator
+        :param stall_timeout: number of seconds without any progress of the workers, while there are pages
+        to crawl, after which the crawl is stopped (e.g. no worker has joined for some of the shards)
+        """
+        self.extractor = extractor
+        self.query = query
+        self.settings = settings
+        self.shards = shards
+        self.shard_workers = shards if shard_workers is None else min(shard_workers, shards)
+        self.coordinator_class = CoordinatorRegistry.get(coordinator)
+        self.coordinator_name = coordinator
+        self.address = address or self.coordinator_class.default_address
+        self.key = key
+        self.crawl_settings = {
+            "limit": limit,
+            "depth_limit": depth_limit,
+            "shards": shards,
+            "search_mode": mode,
+            "default_interval": extractor.delay_in_seconds_between_normal_requests,
+            "intervals": extractor.host_intervals(),
+            "visited": visited,
+            "bloom_error_rate": bloom_error_rate,
+            "process": {name: settings[name] for name in SHARED_PROCESS_SETTINGS},
+        }
+        self.prefetch = prefetch
+        self.stall_timeout = stall_timeout
+        self.summaries = []
+        self.seconds = None
+
+    def results(self):
+        """
+        :return: a generator of the results, as they are found. The summaries of the local
+        shards are available once it is exhausted
+        """
+        start = time.perf_counter()
+        if self.shard_workers < self.shards:
+            SearchLogger.get_logger().warning(
+                "Shards %s are left to the workers on other machines (python -m search.distributed "
+                "--coordinator %s --coordinator_address %s --shard N). The crawl stops, if they make no progress "
+                "in %s seconds", ", ".join(map(str, range(self.shard_workers, self.shards))), self.coordinator_name,
+                self.address,
+                self.stall_timeout, force_console_print=True
+            )
+        # Рабочие процессы запускаются заново (spawn), а не копией текущего: в нем уже работают потоки
+        context = multiprocessing.get_context("spawn")
+        with self.coordinator_class.serving(self.address, self.key) as coordinator, \
+                SearchLogger.get_logger().worker_records(context) as log_records:
+            coordinator.start({**self.crawl_settings, "query_words": self.extractor.get_query_words(self.query)})
+            pool = context.Pool(
+                self.shard_workers,
+                initializer=_init_worker,
+                initargs=(self.settings, log_records, self.coordinator_name, self.address, self.key)
+            ) if self.shard_workers else None
+            tasks = [pool.apply_async(_crawl_shard, (shard,)) for shard in range(self.shard_workers)]
+            link_batch_gen = self.extractor.search_link_batches(self.query, prefetch=self.prefetch)
+            try:
+                yield from self._crawl(coordinator, link_batch_gen, tasks)
+            except BaseException:
+                coordinator.stop()
+                if pool:
+                    pool.terminate()
+                raise
+            finally:
+                coordinator.stop()
+                link_batch_gen.close()
+                if pool:
+                    pool.close()
+                    pool.join()
+            self._finish([task.get() for task in tasks])
+        self.seconds = time.perf_counter() - start
+
+    def _crawl(self, coordinator, link_batch_gen, tasks):
+        taken = 0
+        for search_page, links in self._search_pages(link_batch_gen):
+            coordinator.add_links(links, 0, search_page=search_page, engines=self.extractor.engine_names())
+            # Ждем, пока рабочие процессы обойдут страницы под этой страницей поиска, и выдаем результаты
+            for result in self._crawled_results(coordinator, tasks, taken):
+                taken += 1
+                yield result
+            if not coordinator.is_running():
+                return
+
+    def _search_pages(self, link_batch_gen):
+        """
+        :return: a generator of pairs (number of the search engine result page, its links). Stops after
+        several empty pages in a row
+        """
+        empty_attempts = 0
+        for search_page, links in enumerate(link_batch_gen, 1):
+            empty_attempts = 0 if links else empty_attempts + 1
+            if empty_attempts >= self.extractor.max_empty_attempts:
+                SearchLogger.get_logger().warning(
+                    f"Request to search engine returned an empty set of links for {empty_attempts} "
+                    "consecutive times. \nProbably hit captcha defence. You can try a different engine. "
+                    "Exiting..."
+                )
+                return
+            yield search_page, links
+
+    def _crawled_results(self, coordinator, tasks, taken):
+        """
+        Polls the coordinator for the results, until there are no pages left to crawl. Stops the crawl,
+        if a local worker has stopped, or if the workers have made no progress in stall_timeout seconds
+        :param taken: number of the results already taken
+        :return: a generator of the results
+        """
+        logger = SearchLogger.get_logger()
+        progress, progress_time = None, time.monotonic()
+        while True:
+            status = coordinator.status()
+            # Результаты читаются после состояния, так что в них есть все, добавленные до него
+            results = coordinator.results(after=taken)
+            taken += len(results)
+            yield from results
+            if status["state"] != RUNNING or not status["queued"] and not status["leased"]:
+                return
+            if (status["results"], status["queued"], status["leased"]) != progress:
+                progress, progress_time = (status["results"], status["queued"], status["leased"]), time.monotonic()
+            elif time.monotonic() - progress_time > self.stall_timeout:
+                logger.error(
+                    "No progress of the crawl in %s seconds, pages of shards %s are not taken by any worker. "
+                    "Stopping the crawl", self.stall_timeout, ", ".join(map(str, status["queued_shards"])),
+                    force_console_print=True
+                )
+                coordinator.stop()
+                return
+            if any(task.ready() for task in tasks):
+                # Шард остался без рабочего процесса - его страницы не будут обойдены
+                logger.error("A shard worker stopped before the end of the crawl. Stopping the crawl")
+                coordinator.stop()
+                return
+            time.sleep(POLL_INTERVAL)
+
+    def _finish(self, summaries):
+        for summary in summaries:
+            metrics = summary.pop("metrics")
+            if CrawlMetrics.get_metrics():
+                CrawlMetrics.get_metrics().merge(metrics)
+        self.summaries = summaries
+
+    def summary(self):
+        """
+        :return: string, a table with the pages read and results found by the local shard workers
+        """
+        from tabulate import tabulate
+        rows = [[s["shard"], s["pages"], s["results"], s["error"] or ""] for s in self.summaries]
+        rows.append([
+            "Total", sum(s["pages"] for s in self.summaries), sum(s["results"] for s in self.summaries),
+            sum(1 for s in self.summaries if s["error"]) or ""
+        ])
+        return "\n\n".join([
+            f"Distributed crawl: {self.shards} shards, {self.shard_workers} local worker processes, "
+            f"{self.seconds or 0:.1f} seconds, coordinator: {self.coordinator_name} at {self.address}",
+            tabulate(rows, headers=["Shard", "Pages", "Results", "Error"])
+        ])
+
+    def log_summary(self):
+        SearchLogger.get_logger().info("\n%s\n", self.summary(), force_console_print=True)
+
+
+@click.command()
+@click.option(
+    "--coordinator",
+    default=DEFAULT_COORDINATOR,
+    type=click.Choice(SUPPORTED_COORDINATORS),
+    help=f"Storage of the crawl coordinator, the same as in the search. Defaults to '{DEFAULT_COORDINATOR}'"
+)
+@click.option(
+    "--coordinator_address",
+    default=None,
+    help="Path of the SQLite database, or of the Unix socket, or HOST:PORT of the coordinator, the same as in the "
+         "search. Defaults to a file in ~/.cache/websearch"
+)
+@click.option("--coordinator_key", default=None, help="Authentication key of the socket coordinator")
+@click.option(
+    "--shard",
+    multiple=True,
+    required=True,
+    type=click.IntRange(min=0),
+    help="Number of the shard to crawl (from 0). Can be given several times"
+)
+@click.option(
+    "--wait",
+    default=DEFAULT_JOIN_TIMEOUT,
+    help=f"Number of seconds to wait for the crawl to start. Defaults to {DEFAULT_JOIN_TIMEOUT}"
+)
+@click.option("--cache/--no-cache", default=True, help="Whether to use the on-disk cache of HTTP responses (default)")
+@click.option("--cache_path", default=DEFAULT_CACHE_PATH, help=f"Path to the cache database. Defaults to {DEFAULT_CACHE_PATH}")
+@click.option("--logpath", default=DEFAULT_LOG_PATH, help=f"Path to log file. Defaults to {DEFAULT_LOG_PATH}")
+@click.option(
+    "--loglevel",
+    default="info",
+    type=click.Choice(SearchLogger.log_level_mappings().keys()),
+    help="Sets the log level. Defaults to 'info'"
+)
+@click.option(
+    "--log_sample",
+    default=DEFAULT_LOG_SAMPLE,
+    type=click.IntRange(min=1),
+    help=f"Log only every n-th of the per link messages. Defaults to {DEFAULT_LOG_SAMPLE}"
+)
+def main(coordinator, coordinator_address, coordinator_key, shard, wait, cache, cache_path, logpath, loglevel,
+         log_sample):
+    """
+    Worker node of a distributed crawl: crawls the given shards of a search, started with --shards
+    """
+    SearchLogger.init_logger(path=logpath, log_to_console=True, level=loglevel, sample_every=log_sample)
+    logger = SearchLogger.get_logger()
+    try:
+        crawl_coordinator = CoordinatorRegistry.get(coordinator).connect(coordinator_address, coordinator_key)
+    except (OSError, multiprocessing.AuthenticationError) as e:
+        logger.error("Can not connect to the coordinator: %r", e, force_console_print=True)
+        sys.exit(1)
+
+    deadline = time.monotonic() + wait
+    while not crawl_coordinator.is_running():
+        if time.monotonic() > deadline:
+            logger.error("No crawl started in %s seconds", wait, force_console_print=True)
+            sys.exit(1)
+        time.sleep(POLL_INTERVAL)
+    settings = crawl_coordinator.get_settings()
+    if max(shard) >= settings["shards"]:
+        logger.error("The crawl has only %s shards", settings["shards"], force_console_print=True)
+        sys.exit(1)
+
+    init_process({
+        **settings["process"],
+        "logpath": logpath,
+        "loglevel": loglevel,
+        "log_sample": log_sample,
+        "cache": cache,
+        "cache_path": cache_path,
+        "cache_refresh": False,
+        "replay_path": None
+    })
+    logger.info("Crawling shards %s", ", ".join(map(str, shard)), force_console_print=True)
+    summary = crawl_shards(crawl_coordinator, list(shard))
+    logger.info(
+        "Crawl is over: %s pages read, %s results found", summary["pages"], summary["results"], force_console_print=True
+    )
+
+
+if __name__ == "__main__":
+    main()
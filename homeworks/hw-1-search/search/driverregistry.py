@@ -0,0 +1,63 @@
+import importlib
+
+
+DRIVERS_ENTRY_POINT_GROUP = "websearch.drivers"
+
+
+class SEDriverRegistry:
+    """
+    A class to store registered search engine drivers. Drivers are declared by name, with the module
+    which registers them (see search/drivers/__init__.py), and the module is only imported when the driver
+    is requested. Drivers of other packages are declared with entry points of the group
+    DRIVERS_ENTRY_POINT_GROUP, e.g. in setup.py:
+
+        entry_points={"websearch.drivers": ["bing = mypackage.bing:BingLinkExtractor"]}
+
+    Entry points are looked up only when a driver is not found among the declared ones, or when
+    all the names are listed.
+    """
+    _registry = {}      # Имя -> класс драйвера
+    _declared = {}      # Имя -> модуль (строка) или точка входа, еще не загруженные
+    _entry_points_loaded = False
+
+    @classmethod
+    def register(cls, name, driver_class):
+        driver_class.engine_name = name
+        cls._registry[name] = driver_class
+
+    @classmethod
+    def declare(cls, name, module):
+        """
+        Declares a driver, without importing it
+        :param name: name of the driver
+        :param module: full name of the module, which registers the driver <name> when imported
+        """
+        cls._declared[name] = module
+
+    @classmethod
+    def _load_entry_points(cls):
+        if cls._entry_points_loaded:
+            return
+        cls._entry_points_loaded = True
+        from importlib.metadata import entry_points
+        for entry_point in entry_points(group=DRIVERS_ENTRY_POINT_GROUP):
+            cls._declared.setdefault(entry_point.name, entry_point)
+
+    @classmethod
+    def get_driver(cls, name):
+        if name not in cls._registry:
+            if name not in cls._declared:
+                cls._load_entry_points()
+            declared = cls._declared.get(name)
+            if declared is None:
+                return None
+            if isinstance(declared, str):
+                importlib.import_module(declared)
+            else:
+                cls.register(name, declared.load())
+        return cls._registry.get(name, None)
+
+    @classmethod
+    def registered_drivers_names(cls):
+        cls._load_entry_points()
+        return list(dict.fromkeys([*cls._registry, *cls._declared]))
@@ -1,9 +1,10 @@
 from os import listdir
 from os.path import isfile, join, dirname, splitext
-import importlib
+from ..driverregistry import SEDriverRegistry
 
-# This code loads the search engine drivers
+# This code declares the search engine drivers. The module <name>.py registers the driver <name>,
+# and is only imported when the driver is used
 drivers_dir = dirname(__file__)
-drivers = [f for f in listdir(drivers_dir) if isfile(join(drivers_dir, f)) and f != "__init__.py"]
+drivers = [f for f in listdir(drivers_dir) if isfile(join(drivers_dir, f)) and f.endswith(".py") and f != "__init__.py"]
 for f in drivers:
-    importlib.import_module(f"search.drivers.{splitext(f)[0]}")
+    SEDriverRegistry.declare(splitext(f)[0], f"search.drivers.{splitext(f)[0]}")
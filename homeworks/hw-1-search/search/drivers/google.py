@@ -1,4 +1,5 @@
 from search.linkextractor import SEDriverRegistry, AbstractLinkExtractor
+from search.parsers import xpath_has_class
 import re
 
 
@@ -8,6 +9,14 @@ class GoogleLinkExtractor(AbstractLinkExtractor):
     def get_selector(cls):
         return ".rc > div > a"
 
+    @classmethod
+    def get_xpath_selector(cls):
+        return f"//*[{xpath_has_class('rc')}]/div/a"
+
+    @classmethod
+    def get_xpath_text_extractor(cls):
+        return "string(.//h3)"
+
     @classmethod
     def get_link_extractor(cls, elem):
         href = elem.get('href')
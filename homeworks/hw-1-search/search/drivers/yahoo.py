@@ -1,6 +1,7 @@
 import re
 import urllib
 from search.linkextractor import SEDriverRegistry, AbstractLinkExtractor
+from search.parsers import xpath_has_class
 
 class YahooLinkExtractor(AbstractLinkExtractor):
 
@@ -8,6 +9,10 @@ class YahooLinkExtractor(AbstractLinkExtractor):
     def get_selector(cls):
         return "div.algo.algo-sr > div > h3 > a"
 
+    @classmethod
+    def get_xpath_selector(cls):
+        return f"//div[{xpath_has_class('algo')} and {xpath_has_class('algo-sr')}]/div/h3/a"
+
     @classmethod
     def get_link_extractor(cls, elem):
         full_link = elem.get("href")
@@ -1,6 +1,7 @@
 import re
 import urllib
 from search.linkextractor import AbstractLinkExtractor, SEDriverRegistry
+from search.parsers import xpath_has_class
 
 
 def memoize(func):
@@ -28,6 +29,14 @@ class YandexLinkExtractor(AbstractLinkExtractor):
     def get_selector(cls):
         return ".serp-item > div > h2 > a"
 
+    @classmethod
+    def get_xpath_selector(cls):
+        return f"//*[{xpath_has_class('serp-item')}]/div/h2/a"
+
+    @classmethod
+    def get_xpath_text_extractor(cls):
+        return f"string(.//*[{xpath_has_class('organic__url-text')}])"
+
     @classmethod
     def get_link_extractor(cls, elem):
         url = elem.get("href")
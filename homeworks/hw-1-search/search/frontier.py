@@ -0,0 +1,328 @@
+import heapq
+import itertools
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import deque, Counter
+from urllib.parse import urlparse
+
+
+DEFAULT_CRAWL_STRATEGY = "dfs"
+DEFAULT_FRONTIER_MEMORY = 10000     # Max number of frontier entries kept in memory
+DEFAULT_SPILL_CHUNK = 1000          # Number of entries moved to / from disk at once
+DEFAULT_DEPTH_PENALTY = 0.25        # Score penalty per recursion level, for the best-first strategy
+DEFAULT_DOMAIN_PENALTY = 0.1        # Score penalty per page already fetched from the same domain
+
+
+class DiskQueue:
+    """
+    On-disk part of the frontier: a SQLite table of pickled entries, ordered by insertion.
+    The database lives in a temporary file, which is created on first use, and removed on close().
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._path = None
+        self.count = 0
+
+    def _connect(self):
+        if not self._connection:
+            fd, self._path = tempfile.mkstemp(prefix="websearch-frontier-", suffix=".sqlite")
+            os.close(fd)
+            self._connection = sqlite3.connect(self._path, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode = OFF")
+            self._connection.execute("PRAGMA synchronous = OFF")
+            self._connection.execute(
+                "CREATE TABLE entries (id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB NOT NULL)"
+            )
+        return self._connection
+
+    def append(self, entries):
+        """
+        Appends entries, which are newer than all entries already stored
+        """
+        if entries:
+            self._connect().executemany(
+                "INSERT INTO entries (data) VALUES (?)",
+                [(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL),) for entry in entries]
+            )
+            self.count += len(entries)
+
+    def take(self, count, newest=False):
+        """
+        Removes and returns up to <count> oldest (or newest) entries
+        :return: a list of entries, in the order of insertion
+        """
+        if not self.count:
+            return []
+        order = "DESC" if newest else "ASC"
+        rows = self._connection.execute(
+            f"SELECT id, data FROM entries ORDER BY id {order} LIMIT ?", (count,)
+        ).fetchall()
+        self._connection.executemany("DELETE FROM entries WHERE id = ?", [(row[0],) for row in rows])
+        self.count -= len(rows)
+        entries = [pickle.loads(row[1]) for row in rows]
+        return entries[::-1] if newest else entries
+
+    def entries(self):
+        """
+        :return: a generator of all stored entries, in the order of insertion
+        """
+        if self.count:
+            for (data,) in self._connection.execute("SELECT data FROM entries ORDER BY id"):
+                yield pickle.loads(data)
+
+    def close(self):
+        if self._connection:
+            self._connection.close()
+            os.remove(self._path)
+            self._connection = None
+        self.count = 0
+
+
+class Frontier:
+    """
+    A queue of pages yet to be visited by the search. Each entry is a dict with the link
+    ("url", "text"), the recursion depth of the link ("rec.depth"), its "parent_url" and
+    "search_page". Keeps at most <memory_limit> entries in memory, and spills the rest
+    to a DiskQueue, so that the memory used does not depend on the size of the crawl.
+
+    This base class is a FIFO queue, which gives the breadth-first traversal.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_FRONTIER_MEMORY, spill_chunk=DEFAULT_SPILL_CHUNK, matcher=None):
+        """
+        :param memory_limit: max number of entries kept in memory
+        :param spill_chunk: number of entries moved to / from disk at once
+        :param matcher: QueryMatcher for the search query. Used only by frontiers which rank pages
+        """
+        self.memory_limit = memory_limit
+        self.spill_chunk = min(spill_chunk, max(memory_limit, 1))
+        self._disk = DiskQueue()
+        # Entries are ordered as: _head (oldest) < _disk < _tail (newest)
+        self._head = deque()
+        self._tail = []
+
+    def __len__(self):
+        return len(self._head) + self._disk.count + len(self._tail)
+
+    def push(self, entry):
+        if not self._disk.count and not self._tail and len(self._head) < self.memory_limit:
+            self._head.append(entry)
+        else:
+            self._tail.append(entry)
+            if len(self._tail) >= self.spill_chunk:
+                self._disk.append(self._tail)
+                self._tail = []
+
+    def push_children(self, entries):
+        """
+        Pushes the entries for the child links of one page, in page order
+        """
+        for entry in entries:
+            self.push(entry)
+
+    def _fill_head(self):
+        if not self._head:
+            self._head.extend(self._disk.take(self.spill_chunk))
+        if not self._head:
+            self._head.extend(self._tail)
+            self._tail = []
+
+    def peek(self):
+        """
+        :return: the entry which pop() would return next, without removing it
+        """
+        self._fill_head()
+        return self._head[0]
+
+    def pop(self):
+        self._fill_head()
+        return self._head.popleft()
+
+    def snapshot(self):
+        """
+        :return: a list of all entries, in the order they would be popped
+        """
+        return [*self._head, *self._disk.entries(), *self._tail]
+
+    def restore(self, entries):
+        """
+        Pushes entries from a snapshot(), so that they are popped in the same order
+        """
+        for entry in entries:
+            self.push(entry)
+
+    def close(self):
+        self._disk.close()
+
+
+class DepthFirstFrontier(Frontier):
+    """
+    A LIFO stack of pages, which gives the depth-first traversal. Child links of a page are
+    pushed so that they are popped in page order. The oldest entries are spilled to disk.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_FRONTIER_MEMORY, spill_chunk=DEFAULT_SPILL_CHUNK, matcher=None):
+        super().__init__(memory_limit=memory_limit, spill_chunk=spill_chunk)
+        # Entries are ordered as: _disk (oldest) < _top (newest, popped first from the end)
+        self._top = []
+
+    def __len__(self):
+        return self._disk.count + len(self._top)
+
+    def push(self, entry):
+        self._top.append(entry)
+        if len(self._top) > self.memory_limit:
+            self._disk.append(self._top[:self.spill_chunk])
+            del self._top[:self.spill_chunk]
+
+    def push_children(self, entries):
+        for entry in reversed(list(entries)):
+            self.push(entry)
+
+    def _fill_top(self):
+        if not self._top:
+            self._top.extend(self._disk.take(self.spill_chunk, newest=True))
+
+    def peek(self):
+        self._fill_top()
+        return self._top[-1]
+
+    def pop(self):
+        self._fill_top()
+        return self._top.pop()
+
+    def snapshot(self):
+        return [*reversed(self._top), *reversed(list(self._disk.entries()))]
+
+    def restore(self, entries):
+        for entry in reversed(entries):
+            self.push(entry)
+
+
+class BestFirstFrontier(Frontier):
+    """
+    A priority queue of pages, which always gives the most promising page next. The score of
+    a page is the share of query words found in its url and (separately) in its link text,
+    minus a penalty per recursion level and per page already fetched from the same domain.
+    Pages fetched from a domain lower the scores of the pending pages from that domain. Since
+    scores can only go down, they are recomputed lazily: only when a page is about to be popped.
+
+    When the queue grows above <memory_limit>, the lowest scored entries are spilled to disk, and
+    are read back (best first within each spilled chunk) once the in-memory queue is exhausted.
+    """
+
+    def __init__(
+            self, memory_limit=DEFAULT_FRONTIER_MEMORY, spill_chunk=DEFAULT_SPILL_CHUNK, matcher=None,
+            depth_penalty=DEFAULT_DEPTH_PENALTY, domain_penalty=DEFAULT_DOMAIN_PENALTY
+    ):
+        super().__init__(memory_limit=memory_limit, spill_chunk=spill_chunk)
+        self.matcher = matcher
+        self.depth_penalty = depth_penalty
+        self.domain_penalty = domain_penalty
+        # Heap of (-score, sequence number, entry). The sequence number keeps page order for equal scores
+        self._heap = []
+        self._sequence = itertools.count()
+        self._fetched_per_domain = Counter()
+
+    def __len__(self):
+        return self._disk.count + len(self._heap)
+
+    @staticmethod
+    def _domain(entry):
+        return urlparse(entry["url"]).netloc
+
+    def relevance(self, entry):
+        """
+        :param entry: frontier entry
+        :return: share of query words found in the url, plus share of query words found in the link text
+        """
+        if not self.matcher or not self.matcher.words:
+            return 0.0
+        url_count, text_count = self.matcher.match_counts([
+            {"url": entry["url"], "text": ""},
+            {"url": "", "text": entry.get("text")},
+        ])
+        return (url_count + text_count) / len(self.matcher.words)
+
+    def score(self, entry, relevance):
+        depth_penalty = self.depth_penalty * entry["rec.depth"]
+        domain_penalty = self.domain_penalty * self._fetched_per_domain[self._domain(entry)]
+        return relevance - depth_penalty - domain_penalty
+
+    def _push_scored(self, entry, relevance):
+        heapq.heappush(self._heap, (-self.score(entry, relevance), next(self._sequence), relevance, entry))
+
+    def push(self, entry):
+        self._push_scored(entry, self.relevance(entry))
+        if len(self._heap) > self.memory_limit:
+            self._spill()
+
+    def push_children(self, entries):
+        for entry in entries:
+            self.push(entry)
+
+    def _spill(self):
+        ordered = sorted(self._heap)
+        keep = max(len(ordered) - self.spill_chunk, 1)
+        self._disk.append([item[3] for item in ordered[keep:]])
+        self._heap = ordered[:keep]     # A sorted list is a valid heap
+
+    def _settle_top(self):
+        """
+        Makes sure that the top of the heap has an up to date score, and is the best entry
+        """
+        if not self._heap:
+            for entry in self._disk.take(self.spill_chunk):
+                self.push(entry)
+        heap = self._heap
+        while True:
+            negative_score, sequence, relevance, entry = heap[0]
+            score = self.score(entry, relevance)
+            if score >= -negative_score:
+                return
+            # Score went down since the entry was pushed. Put it back with the new score,
+            # and check the (possibly different) top again
+            heapq.heapreplace(heap, (-score, sequence, relevance, entry))
+
+    def peek(self):
+        self._settle_top()
+        return self._heap[0][3]
+
+    def pop(self):
+        self._settle_top()
+        entry = heapq.heappop(self._heap)[3]
+        self._fetched_per_domain[self._domain(entry)] += 1
+        return entry
+
+    def snapshot(self):
+        return [item[3] for item in sorted(self._heap)] + list(self._disk.entries())
+
+    def restore(self, entries):
+        for entry in entries:
+            self.push(entry)
+
+
+class FrontierRegistry:
+    """
+    A class to store frontier types for the supported crawl strategies
+    """
+    _registry = {
+        "dfs": DepthFirstFrontier,
+        "bfs": Frontier,
+        "best-first": BestFirstFrontier,
+    }
+
+    @classmethod
+    def register(cls, name, frontier_class):
+        cls._registry[name] = frontier_class
+
+    @classmethod
+    def create(cls, name=DEFAULT_CRAWL_STRATEGY, **kwargs):
+        return cls._registry[name](**kwargs)
+
+    @classmethod
+    def registered_strategies_names(cls):
+        return cls._registry.keys()
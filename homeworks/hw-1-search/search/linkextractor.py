@@ -1,10 +1,29 @@
 from abc import ABC, abstractmethod
-from bs4 import BeautifulSoup
+import itertools
+import threading
 import time
-from .searchutils import read_web_page, randomize_delay, with_delay, fix_child_link, to_canonical_url, \
+from collections import deque
+from urllib.parse import urlparse
+from .searchutils import read_web_page, with_delay, fix_child_link, to_canonical_url, \
     link_is_valid_for_recursion, valid_page_links
 from .stopwords import QueryStopWords
+from .asyncsearch import async_recursive_link_generator, DEFAULT_CONCURRENCY
 from .logger import SearchLogger
+from .scheduler import create_scheduler
+from .parsers import ParserRegistry, SoupParserBackend
+from .parsepool import ParsePool
+from .visited import VisitedStoreRegistry
+from .querymatcher import get_matcher
+from .prefetch import Prefetcher
+from .metrics import CrawlMetrics
+from .frontier import FrontierRegistry, DEFAULT_CRAWL_STRATEGY, DEFAULT_FRONTIER_MEMORY
+from .driverregistry import SEDriverRegistry  # noqa: F401  Drivers import it from here
+
+
+# Ключи состояния поиска, которые должны совпадать, чтобы продолжить поиск из checkpoint,
+# и ключи, которые при этом берутся из сохраненного состояния
+SEARCH_IDENTITY_KEYS = ("driver", "query", "depth_limit", "search_mode", "strategy")
+SEARCH_PROGRESS_KEYS = ("visited", "next_search_page", "search_position", "empty_attempts", "results")
 
 
 class AbstractLinkExtractor(ABC):
@@ -19,7 +38,10 @@ class AbstractLinkExtractor(ABC):
     """
     delay_in_seconds_between_search_requests = 3
     delay_in_seconds_between_normal_requests = 0.5
+    host_delays = {}        # Host-specific delays in seconds: {netloc: delay}
+    _scheduler_lock = threading.Lock()     # Schedulers of all drivers are created under it, once per class
     max_empty_attempts = 3
+    engine_name = None      # Set by SEDriverRegistry.register()
 
     @classmethod
     @abstractmethod
@@ -50,6 +72,24 @@ class AbstractLinkExtractor(ABC):
         """
         pass
 
+    @classmethod
+    def get_xpath_selector(cls):
+        """
+        Optional XPath equivalent of get_selector(), used by the fast lxml parser backend. Drivers
+        which define it, should also make sure that get_link_extractor() works with lxml elements
+        (e.g. only uses elem.get(...)), and define get_xpath_text_extractor()
+        :return: XPath expression (string) to select search result links, or None
+        """
+        return None
+
+    @classmethod
+    def get_xpath_text_extractor(cls):
+        """
+        XPath equivalent of get_link_text_extractor(), evaluated relative to the link element
+        :return: XPath expression (string), which evaluates to the link text
+        """
+        return "string(.)"
+
     @classmethod
     @abstractmethod
     def next_search_page_url_generator(cls, query):
@@ -70,6 +110,40 @@ class AbstractLinkExtractor(ABC):
         """
         return SearchLogger.get_logger()
 
+    @classmethod
+    def search_engine_host(cls):
+        """
+        :return: the host (netloc) of the search engine
+        """
+        return urlparse(next(cls.next_search_page_url_generator(""))).netloc
+
+    @classmethod
+    def host_intervals(cls):
+        """
+        Requests to the search engine host are spaced by delay_in_seconds_between_search_requests,
+        requests to hosts listed in host_delays - by their specific delays, and requests to any
+        other host - by delay_in_seconds_between_normal_requests.
+        :return: a dict {netloc: interval} of host-specific delays
+        """
+        return {cls.search_engine_host(): cls.delay_in_seconds_between_search_requests, **cls.host_delays}
+
+    @classmethod
+    def get_scheduler(cls):
+        """
+        Returns the politeness scheduler for this driver class, creating it on first use, with
+        the delays of host_intervals()
+        :return: HostScheduler
+        """
+        if "_scheduler" not in cls.__dict__:
+            with cls._scheduler_lock:
+                if "_scheduler" not in cls.__dict__:
+                    cls._scheduler = create_scheduler(
+                        cls.__name__,
+                        default_interval=cls.delay_in_seconds_between_normal_requests,
+                        intervals=cls.host_intervals()
+                    )
+        return cls._scheduler
+
     @classmethod
     def _extract_elements_from_response(cls, response_text):
         """
@@ -77,8 +151,9 @@ class AbstractLinkExtractor(ABC):
         :param response_text: Text contents of the web page
         :return: a list of Beautiful Soup objects representing "DOM nodes"
         """
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response_text, "lxml")
-        return soup.select(cls.get_selector())
+        return SoupParserBackend.compiled_selector(cls).select(soup)
 
     @classmethod
     def _get_links_info(cls, elems):
@@ -98,41 +173,148 @@ class AbstractLinkExtractor(ABC):
     @classmethod
     def get_links_info(cls, response_text):
         """
-        Gets search links from HTTP response text
+        Gets search links from HTTP response text, using the current parser backend,
+        in a worker process if ParsePool is enabled
         :param response_text:  string, HTTP response text
         :return: a generator of objects {"url":..., "text":...}
         """
-        return cls._get_links_info(cls._extract_elements_from_response(response_text))
+        parse_pool = ParsePool.get_pool()
+        if parse_pool:
+            return iter(parse_pool.search_results(cls, response_text))
+        return ParserRegistry.get_parser().search_results(cls, response_text)
+
+    @classmethod
+    def driver_name(cls):
+        """
+        :return: the name of the driver, used in its metrics and archived result pages
+        """
+        return cls.engine_name or cls.__name__
+
+    @classmethod
+    def _search_page_links(cls, response_text):
+        """
+        Parses a search engine result page, recording the parse time and the number of links, if metrics are enabled
+        :param response_text: string, HTTP response text
+        :return: a list of objects {"url":..., "text":...}
+        """
+        metrics = CrawlMetrics.get_metrics()
+        if not metrics:
+            return list(cls.get_links_info(response_text))
+        start = time.perf_counter()
+        links = list(cls.get_links_info(response_text))
+        metrics.observe("parse_seconds", time.perf_counter() - start, stage="serp", driver=cls.driver_name())
+        metrics.inc("search_pages_total", driver=cls.driver_name(), outcome="ok" if links else "empty")
+        metrics.inc("search_links_total", len(links), driver=cls.driver_name())
+        return links
 
     @classmethod
-    @with_delay(
-        lambda cls: randomize_delay(cls.delay_in_seconds_between_search_requests)
-    )
-    def search_pages_contents_generator(cls, query, postprocessor=None):
+    @with_delay(lambda cls: cls.get_scheduler())
+    def search_pages_contents_generator(cls, query, postprocessor=None, scheduler=None, start_page=0):
         """
 
         :param query: search query (string)
         :param postprocessor: A function to be applied to the HTTP response text
+        :param scheduler: HostScheduler used to space the requests to the search engine
+        :param start_page: number of the first page to request (counting from zero). Previous
+        pages are skipped without any requests
         :return: a generator of HTTP response text values (optionally wrapped in
         <postprocessor>), for search engine result pages # 1, 2, ...
         """
-        for next_search_results_page_url in cls.next_search_page_url_generator(query):
+        for page_number, next_search_results_page_url in enumerate(itertools.islice(
+                cls.next_search_page_url_generator(query), start_page, None
+        ), start_page):
             cls.logger().info(
-                "About to query the search engine, url: {}".format(
-                    next_search_results_page_url
-                )
+                "About to query the search engine, url: %s", next_search_results_page_url
+            )
+            response_text = read_web_page(
+                next_search_results_page_url, scheduler=scheduler, search_page=(cls.driver_name(), page_number)
             )
-            response_text = read_web_page(next_search_results_page_url)
             if not response_text:
+                metrics = CrawlMetrics.get_metrics()
+                if metrics:
+                    metrics.inc("search_pages_total", driver=cls.driver_name(), outcome="error")
                 cls.logger().warning(
-                    f"Unable to read url: {next_search_results_page_url}. Proceeding to the next url..."
+                    "Unable to read url: %s. Proceeding to the next url...", next_search_results_page_url
                 )
                 break
             yield response_text if not postprocessor else postprocessor(response_text)
 
+    @classmethod
+    def search_link_batches(cls, query, start_page=0, prefetch=True):
+        """
+        Source of the top level links for the search algorithm
+        :param query: search query (string)
+        :param start_page: number of the first search engine result page to request (counting from zero),
+        as returned by search_position()
+        :param prefetch: whether to request (and parse) the next result page in background
+        :return: an iterator (with close() method) of lists of objects {"url":..., "text":...}, one list
+        per search engine result page
+        """
+        link_batches = cls.search_pages_contents_generator(
+            query, postprocessor=cls._search_page_links, start_page=start_page
+        )
+        if prefetch:
+            # Следующая страница поиска запрашивается в фоне, пока идет обход ссылок с текущей
+            link_batches = Prefetcher(link_batches, max_empty=cls.max_empty_attempts)
+        return link_batches
+
+    @classmethod
+    def search_position(cls, link_batches, batches_taken):
+        """
+        Position in the search engine results, to resume a search from (see search_link_batches())
+        :param link_batches: the iterator returned by search_link_batches()
+        :param batches_taken: number of link batches taken from it, including those skipped with start_page
+        :return: the start_page argument of search_link_batches(), which gives the next batch
+        """
+        return batches_taken
+
+    @classmethod
+    def engine_names(cls):
+        """
+        :return: a list of names of the search engines, which give the links for this driver
+        """
+        return [cls.engine_name] if cls.engine_name else []
+
+    @classmethod
+    def get_query_words(cls, query):
+        """
+        Splits the query into lower case words, and removes stop words
+        :param query: search query string
+        :return: a list of query words
+        """
+        query_words = QueryStopWords.remove_stop_words(  # Расщепляем ссылку на слова, удаляем stop words
+            [s for s in query.lower().split(" ") if s]
+        )
+        cls.logger().info(f"Final query words: {query_words}")
+        return query_words
+
+    @classmethod
+    def async_recursive_link_generator(
+            cls, query, limit=100, depth_limit=5, search_mode="all", concurrency=DEFAULT_CONCURRENCY,
+            visited=None, prefetch=True
+    ):
+        """
+        Asynchronous version of recursive_link_generator(), which keeps up to <concurrency>
+        page fetches in flight at once. Produces the same result records.
+        :param query: search query string
+        :param limit: Limit on a number of results
+        :param depth_limit: recursion depth limit
+        :param search_mode: string, can be 'all' or 'any'
+        :param concurrency: max number of pages being fetched at the same time
+        :param visited: optional VisitedStore to keep visited urls in
+        :param prefetch: whether to request the next search engine result page in background
+        :return: an async generator of results
+        """
+        return async_recursive_link_generator(
+            cls, query, limit=limit, depth_limit=depth_limit, search_mode=search_mode, concurrency=concurrency,
+            visited=visited if visited is not None else VisitedStoreRegistry.create(expected_items=limit),
+            prefetch=prefetch
+        )
+
     @classmethod
     def recursive_link_generator(
-            cls, query, limit=100, depth_limit=5, search_mode="all"
+            cls, query, limit=100, depth_limit=5, search_mode="all", visited=None, checkpoint=None, resume=False,
+            strategy=DEFAULT_CRAWL_STRATEGY, frontier_memory=DEFAULT_FRONTIER_MEMORY, prefetch=True
     ):
         """
         Main method to implement the core of the search algorithm.
@@ -141,153 +323,331 @@ class AbstractLinkExtractor(ABC):
         :param depth_limit: recursion depth limit
         :param search_mode: string, can be 'all' or 'any'. Whether to require all query words
         to be contained in a link or description, or any of the query words
+        :param visited: optional VisitedStore to keep visited urls in (see VisitedStoreRegistry).
+        By default, full urls are stored
+        :param checkpoint: optional CrawlCheckpoint, to periodically save the search state to. The state
+        is also saved when the search stops before reaching the limit (e.g. because of an error, a captcha,
+        or Ctrl-C), and the checkpoint is removed when the limit is reached
+        :param resume: whether to continue the search from the state saved in <checkpoint>
+        :param strategy: order in which the pages are visited, one of FrontierRegistry strategies:
+        'dfs' (default), 'bfs', or 'best-first' (most relevant pages first)
+        :param frontier_memory: max number of pages to visit, kept in memory. The rest are kept on disk
+        :param prefetch: whether to request (and parse) the next search engine result page in background,
+        while the links from the current one are being crawled
         :return: a generator of results
         """
 
-        visited = set()         # Уже посещенные ссылки будут храниться тут
+        return RecursiveSearch(
+            cls, query, limit=limit, depth_limit=depth_limit, search_mode=search_mode, visited=visited,
+            checkpoint=checkpoint, resume=resume, strategy=strategy, frontier_memory=frontier_memory,
+            prefetch=prefetch
+        ).results()
 
-        query_words = QueryStopWords.remove_stop_words(  # Расщепляем ссылку на слова, удаляем stop words
-            [s for s in query.lower().split(" ") if s]
-        )
 
-        cls.logger().info(f"Final query words: {query_words}")
+class RecursiveSearch:
+    """
+    A recursive search of a driver, see AbstractLinkExtractor.recursive_link_generator(). Keeps the search
+    state, which is saved to the checkpoint, and the queue of pages to visit. Iterate over results() to run it
+    """
 
+    def __init__(self, extractor, query, limit, depth_limit, search_mode, visited, checkpoint, resume, strategy,
+                 frontier_memory, prefetch):
+        """
+        :param extractor: driver class
+        Other parameters are the same as of AbstractLinkExtractor.recursive_link_generator()
+        """
+        self.extractor = extractor
+        self.limit = limit
+        self.depth_limit = depth_limit
+        self.search_mode = search_mode
+        self.checkpoint = checkpoint
+        # Состояние поиска, которое сохраняется в checkpoint (вместе с содержимым frontier)
+        self.state = {
+            "driver": extractor.__name__,
+            "query": query,
+            "depth_limit": depth_limit,
+            "search_mode": search_mode,
+            "strategy": strategy,
+            # Уже посещенные ссылки будут храниться тут
+            "visited": visited if visited is not None else VisitedStoreRegistry.create(expected_items=limit),
+            # Номер (с нуля) следующей страницы поиска, которую нужно запросить у поисковика
+            "next_search_page": 0,
+            # Позиция в выдаче поисковика, с которой будет запрошена эта страница (см. search_position())
+            "search_position": 0,
+            "empty_attempts": 0,
+            # Уже выданные результаты (хранятся только если задан checkpoint)
+            "results": [],
+        }
+        # Очередь страниц, которые еще нужно прочитать. Порядок обхода определяется типом очереди
+        self.query_words = extractor.get_query_words(query)
+        self.frontier = FrontierRegistry.create(
+            strategy, memory_limit=frontier_memory, matcher=get_matcher(self.query_words, search_mode)
+        )
+        if resume and checkpoint:
+            self._restore(checkpoint.load())
+        self.visited = self.state["visited"]
+        self.results_so_far = self.state["results"]
+        # Страницы, уже прочитанные и снятые с frontier, ссылки с которых еще не обработаны: пары
+        # (ссылка, текст страницы или ParsedPage). Если включен ParsePool, обход читает следующие
+        # страницы, пока разбираются предыдущие
+        self.fetched = deque()
+        # Признак того, что состояние поиска сейчас согласовано, и его можно сохранить. Это так,
+        # пока мы ждем ответа на очередной HTTP запрос
+        self.at_safe_point = False
         # Генератор строк содержимого страниц поиска № 1, 2, ... для данного типа поисковика
-        link_batch_gen = cls.search_pages_contents_generator(
-            query, postprocessor=cls.get_links_info
+        self.link_batch_gen = extractor.search_link_batches(
+            query, start_page=self.state["search_position"], prefetch=prefetch
+        )
+
+    def _restore(self, saved_state):
+        """
+        Continues the search from a saved state, if it belongs to the same search
+        :param saved_state: the state, loaded from the checkpoint, or None
+        """
+        if not saved_state:
+            return
+        mismatched = [key for key in SEARCH_IDENTITY_KEYS if saved_state.get(key) != self.state[key]]
+        if mismatched:
+            self.extractor.logger().warning(
+                f"Checkpoint was saved for a different search ({', '.join(mismatched)} differ). Starting from scratch"
+            )
+            return
+        self.state.update({key: saved_state[key] for key in SEARCH_PROGRESS_KEYS})
+        self.frontier.restore(saved_state["frontier"])
+        self.extractor.logger().info(
+            f"Resuming the search from checkpoint {self.checkpoint.path}, with {len(self.state['results'])} results"
+        )
+
+    def _save_checkpoint(self):
+        # Прочитанные, но еще не обработанные страницы при возобновлении будут прочитаны снова, первыми
+        self.checkpoint.save(
+            {**self.state, "frontier": [*(link for link, _ in self.fetched), *self.frontier.snapshot()]}
         )
 
-        def gen(parent_url, links, lev, search_page):
-            """
-            Основной рекурсивный генератор
-            :param parent_url:  Родительская ссылка - для рекурсивного прохода, None для ссылок верхнего уровня.
-            Параметр нужен для отчета и чтобы работать с относительными ссылками (превращать в абсолютные для
-            дальнейшего прохода по ним)
-            :param links:   Список объектов вида {"url":..., "text":...}. Это дочерние ссылки, по которым нужно
-            будет пройти. В случае верхнего уровня, это будут результаты из поисковика, со страницы N (1, 2, ...) -
-            в этом случае, parent_url = None. В случае рекурсии, это будут ссылки со страницы parent_url.
-            :param lev: Текущая глубина рекурсии
-            :param search_page: Номер страницы поиска. Нужен для отчета
-            :return: генератор результатов - объектов вида
-                {"url":..., "text":..., "rec.depth": lev, "parent_url":...}
-            """
-            newlinks = []  # Здесь будут храниться новые ссылки - т.е. те, по которым еще не проходили
-            for link in links:
-                link = fix_child_link(parent_url, link)  # Восстанавливаем абсолютную ссылку
-                canonical_url = to_canonical_url(link["url"])  # Приводим url к "каноническому" виду для хранения
-                if canonical_url in visited:
-                    # Уже были по этой ссылке - пропускаем
-                    continue
-                else:
-                    cls.logger().info(f"Adding link: {canonical_url}")
-                    visited.add(canonical_url)
-                    newlinks.append(link)
-                    yield {
-                        **link,
-                        "rec.depth": lev,
-                        "parent_url": parent_url
-                    }
-                    if len(visited) == limit:  # Note that len is O(1)
-                        # Набрали достаточно результатов - выходим
-                        return
-            if lev == depth_limit - 1:
-                # Cлишком большая глубина рекурсии - выходим
+    def _save_checkpoint_if_due(self):
+        if self.checkpoint and self.checkpoint.due():
+            self._save_checkpoint()
+
+    def _limit_reached(self):
+        return len(self.visited) == self.limit  # Note that len is O(1)
+
+    def _new_links(self, parent_url, links, lev, search_page, engines):
+        """
+        Первый проход по ссылкам: выдаем еще не посещенные ссылки как результаты, и ставим их
+        в очередь frontier, чтобы потом пройти по ним рекурсивно
+        :param parent_url:  Родительская ссылка - для рекурсивного прохода, None для ссылок верхнего уровня.
+        Параметр нужен для отчета и чтобы работать с относительными ссылками (превращать в абсолютные для
+        дальнейшего прохода по ним)
+        :param links:   Итерируемый набор объектов вида {"url":..., "text":...}. Это дочерние ссылки, по которым нужно
+        будет пройти. В случае верхнего уровня, это будут результаты из поисковика, со страницы N (1, 2, ...) -
+        в этом случае, parent_url = None. В случае рекурсии, это будут ссылки со страницы parent_url.
+        :param lev: Текущая глубина рекурсии
+        :param search_page: Номер страницы поиска. Нужен для отчета
+        :param engines: Список поисковиков, которые привели к этим ссылкам. Нужен для отчета. Ссылки
+        от поисковика могут нести свой список (при поиске по нескольким поисковикам)
+        :return: генератор результатов - объектов вида
+            {"url":..., "text":..., "rec.depth": lev, "parent_url":..., "search_page":..., "engines":...}
+        """
+        newlinks = []  # Здесь будут храниться новые ссылки - т.е. те, по которым еще не проходили
+        for link in links:
+            link = fix_child_link(parent_url, link)  # Восстанавливаем абсолютную ссылку
+            canonical_url = to_canonical_url(link["url"])  # Приводим url к "каноническому" виду для хранения
+            if canonical_url in self.visited:
+                # Уже были по этой ссылке - пропускаем
+                continue
+            self.extractor.logger().info("Adding link: %s", canonical_url, sample="links")
+            self.visited.add(canonical_url)
+            result = {
+                **link,
+                "rec.depth": lev,
+                "parent_url": parent_url,
+                "search_page": search_page,
+                "engines": link.get("engines", engines)
+            }
+            newlinks.append(result)
+            yield result
+            if self._limit_reached():
+                # Набрали достаточно результатов - выходим
                 return
-            # Второй проход по новым ссылкам. Сами ссылки уже добавили, теперь будем
-            # проходить рекурсивно по каждой. Это реализация поиска в ширину.
-            for link in newlinks:
-                if not link_is_valid_for_recursion(link):
-                    # Ссылка определена как негодная для рекурсивного прохода - пропускаем
-                    continue
-                if lev > 0:
-                    cls.logger().info(f"Recursing (level {lev}). About to read the url: {link['url']}")
-                # Отправлеяем HTTP запрос по ссылке, получаем содержимое в виде строки
-                link_contents = read_web_page(link["url"])
-                if not link_contents:
-                    # Что-то пошло не так с этой ссылкой. Пропускаем
-                    cls.logger().warning("Could not read the page {}".format(link["url"]))
-                    continue
-                # Находим годные дочерние ссылки
-                sublinks = [
-                    link
-                    for link in valid_page_links(
-                        link_contents, query_words, mode=search_mode
-                    )
-                    if link_is_valid_for_recursion(link)
-                ]
+        if lev < self.depth_limit - 1:
+            # Если глубина рекурсии позволяет, ставим новые ссылки в очередь для рекурсивного прохода
+            self.frontier.push_children(newlinks)
 
-                # Рекурсивный вызов: перенаправляем генератор результатов от дочерних ссылок.
-                yield from gen(link["url"], sublinks, lev + 1, search_page)
+    def _crawl_frontier(self):
+        """
+        Второй проход: читаем страницы из очереди frontier, и вызываем _new_links() для ссылок с них.
+        Новые ссылки снова попадают в очередь. При обходе в глубину (dfs) порядок тот же, что
+        и при рекурсивном проходе: сначала выдаются все ссылки страницы, а затем обходятся
+        страницы по каждой из них. Страница удаляется из очереди только после того, как
+        она прочитана, так что состояние поиска на время запроса можно сохранить.
+        Если включен ParsePool, до ParsePool.window страниц читаются вперед, пока предыдущие
+        разбираются в рабочих процессах. Ссылки с них обрабатываются в порядке чтения страниц,
+        так что порядок обхода зависит от размера окна, но не от скорости разбора.
+        :return: генератор результатов
+        """
+        parse_pool = ParsePool.get_pool()
+        window = parse_pool.window if parse_pool else 1
+        while self.frontier or self.fetched:
+            while self.frontier and len(self.fetched) < window:
+                self._fetch_next_page(parse_pool)
+            if not self.fetched:
+                continue
+            link, page = self.fetched.popleft()
+            yield from self._new_links(
+                link["url"], self._sublinks(page, parse_pool), link["rec.depth"] + 1, link["search_page"],
+                link["engines"]
+            )
+            if self._limit_reached():
+                self._drop_fetched(parse_pool)
+                return
 
-                # Небольшая случайная задержка между запросами - предосторожность на всякий случай
-                time.sleep(
-                    randomize_delay(cls.delay_in_seconds_between_normal_requests)
-                )
+    def _sublinks(self, page, parse_pool):
+        """
+        Находит годные дочерние ссылки. Это ленивый генератор: ссылки разбираются и
+        проверяются по мере надобности, уже посещенные отбрасываются сразу, а если
+        лимит будет достигнут, остаток страницы вообще не будет обработан
+        :param page: текст страницы, или ParsedPage, если включен ParsePool
+        :param parse_pool: ParsePool или None
+        :return: генератор ссылок
+        """
+        if parse_pool:
+            page_links = page.links(exclude=self.visited)
+        else:
+            page_links = valid_page_links(page, self.query_words, mode=self.search_mode, exclude=self.visited)
+        return (sublink for sublink in page_links if link_is_valid_for_recursion(sublink))
 
-        def full_gen(link_batch_generator):
-            """
-            Этот генератор соединяет рекурсивный проход, реализованный в gen(),
-            с поставщиком списков ссылок от поисковика (<link_batch_generator>),
-            и реализует полный генератор результатов. Таким образом, если рекурсивный
-            проход не дал нужного количества результатов, мы автоматически запрашиваем
-            следующую порцию результатов от поисковика, и вызываем gen() уже на них.
-            В случае если параметр depth_limit=1, поиск вырождается в плоский
-            (нерекурсивный) автоматически, так как gen() не будет вызывать себя
-            снова.
-            :param link_batch_generator: генератор списков ссылок от поисковика
-            :return: генератор результатов - объектов вида
-                {"url":..., "text":..., "rec.depth": lev, "parent_url":...}
-            """
-            empty_attempts = 0
-            for index, links_batch in enumerate(link_batch_generator):
-                # Получаем список ссылок от поисковика. index (+1) - это номер страницы результатов поиска
-                links = list(links_batch)
-                if not links:
-                    empty_attempts += 1  # Пустой список ссылок может означать что мы наткнулись на защиту поисковика
-                else:
-                    empty_attempts = 0
-                if empty_attempts >= cls.max_empty_attempts:
-                    # Пустой список результатов несколько раз подряд. Похоже на защиту поисковика. Выходим.
-                    cls.logger().warning(
-                        f"Request to search engine returned an empty set of links for {empty_attempts} "
-                        "consecutive times. \nProbably hit captcha defence. You can try a different engine. "
-                        "Exiting..."
-                    )
-                    return
-                # Вызываем (рекурсивный) проход по списку ссылок
-                for link in gen(None, links, 0, index):
-                    yield {**link, "search_page": index + 1}
-                    if len(visited) == limit:
-                        return
-
-        def enumerated_gen(gen):
-            """
-            Добавляем индекс (порядковый номер) результата в объектам передаваемого генератора
-            :param gen:
-            :return:
-            """
-            for index, item in enumerate(gen):
-                yield {**item, "index": index + 1}
-
-        # Возвращаем окончательный генератор
-        return enumerated_gen(full_gen(link_batch_gen))
-
-
-class SEDriverRegistry:
-    """
-    A class to store registered search engine drivers. In principle, a simple dict
-    could've been used, but this code could incorporate some extra future logic.
-    """
-    _registry = {}
+    def _drop_fetched(self, parse_pool):
+        """
+        Отбрасывает прочитанные страницы, ссылки с которых уже не нужны, отменяя их разбор
+        :param parse_pool: ParsePool или None
+        """
+        if parse_pool:
+            for _, page in self.fetched:
+                page.cancel()
+        self.fetched.clear()
 
-    @classmethod
-    def register(cls, name, driver_class):
-        cls._registry[name] = driver_class
+    def _fetch_next_page(self, parse_pool):
+        """
+        Читает следующую страницу из очереди frontier, и добавляет ее в очередь fetched. Если
+        включен ParsePool, страница сразу отдается на разбор в рабочий процесс
+        :param parse_pool: ParsePool или None
+        """
+        link = self.frontier.peek()
+        if not link_is_valid_for_recursion(link):
+            # Ссылка определена как негодная для рекурсивного прохода - пропускаем
+            self.frontier.pop()
+            return
+        self._save_checkpoint_if_due()
+        if link["rec.depth"] > 0:
+            self.extractor.logger().info(
+                "Recursing (level %s). About to read the url: %s", link["rec.depth"], link["url"], sample="pages"
+            )
+        # Отправлеяем HTTP запрос по ссылке, получаем содержимое в виде строки.
+        # Планировщик выдерживает паузу только между запросами к одному и тому же хосту
+        self.at_safe_point = True
+        link_contents = read_web_page(link["url"], scheduler=self.extractor.get_scheduler())
+        self.at_safe_point = False
+        self.frontier.pop()
+        if not link_contents:
+            # Что-то пошло не так с этой ссылкой. Пропускаем
+            self.extractor.logger().warning("Could not read the page %s", link["url"])
+            return
+        if parse_pool:
+            link_contents = parse_pool.submit_page(link_contents, self.query_words, mode=self.search_mode)
+        self.fetched.append((link, link_contents))
 
-    @classmethod
-    def get_driver(cls, name):
-        return cls._registry.get(name, None)
+    def _next_search_links(self, index):
+        """
+        Получает список ссылок от поисковика, и обновляет состояние поиска
+        :param index: номер (с нуля) страницы результатов поиска
+        :return: список ссылок (возможно, пустой), или None, если поиск нужно закончить: страницы
+        поиска закончились, или поисковик несколько раз подряд не дал ссылок
+        """
+        state = self.state
+        self._save_checkpoint_if_due()
+        self.at_safe_point = True
+        links_batch = next(self.link_batch_gen, None)
+        if links_batch is None:
+            return None
+        links = list(links_batch)
+        self.at_safe_point = False
+        if not links:
+            # Пустой список ссылок может означать что мы наткнулись на защиту поисковика
+            state["empty_attempts"] += 1
+        else:
+            state["empty_attempts"] = 0
+            state["next_search_page"] = index + 1
+            state["search_position"] = self.extractor.search_position(self.link_batch_gen, index + 1)
+        if state["empty_attempts"] >= self.extractor.max_empty_attempts:
+            # Пустой список результатов несколько раз подряд. Похоже на защиту поисковика. Выходим.
+            self.extractor.logger().warning(
+                f"Request to search engine returned an empty set of links for {state['empty_attempts']} "
+                "consecutive times. \nProbably hit captcha defence. You can try a different engine. "
+                "Exiting..."
+            )
+            state["empty_attempts"] = 0
+            return None
+        return links
 
-    @classmethod
-    def registered_drivers_names(cls):
-        return cls._registry.keys()
+    def _full_gen(self):
+        """
+        Этот генератор соединяет проход по очереди страниц, реализованный в _crawl_frontier(),
+        с поставщиком списков ссылок от поисковика (link_batch_gen),
+        и реализует полный генератор результатов. Таким образом, если рекурсивный
+        проход не дал нужного количества результатов, мы автоматически запрашиваем
+        следующую порцию результатов от поисковика, и обходим уже ее.
+        В случае если параметр depth_limit=1, поиск вырождается в плоский
+        (нерекурсивный) автоматически, так как _new_links() не будет ставить ссылки в очередь.
+        :return: генератор результатов - объектов вида
+            {"url":..., "text":..., "rec.depth": lev, "parent_url":..., "search_page":...}
+        """
+        # При возобновлении поиска из checkpoint, сначала проходим по сохраненной очереди
+        yield from self._crawl_frontier()
+        if self._limit_reached():
+            return
+        for index in itertools.count(self.state["next_search_page"]):
+            # index (+1) - это номер страницы результатов поиска
+            links = self._next_search_links(index)
+            if links is None:
+                return
+            # Выдаем ссылки от поисковика, и затем проходим по ним
+            yield from self._new_links(None, links, 0, index + 1, self.extractor.engine_names())
+            if self._limit_reached():
+                return
+            yield from self._crawl_frontier()
+            if self._limit_reached():
+                return
+
+    def results(self):
+        """
+        Добавляем индекс (порядковый номер) результата к результатам поиска.
+        Здесь же сохраняем состояние поиска в checkpoint, если поиск остановился раньше, чем
+        набралось нужное количество результатов
+        :return: генератор результатов
+        """
+        checkpoint = self.checkpoint
+        results = self.results_so_far
+        yield from list(results)  # Результаты, выданные до возобновления поиска
+        count = len(results)
+        try:
+            for item in self._full_gen():
+                count += 1
+                item = {**item, "index": count}
+                if checkpoint:
+                    results.append(item)
+                yield item
+        except GeneratorExit:
+            raise
+        except BaseException:
+            if checkpoint and self.at_safe_point:
+                self._save_checkpoint()
+            raise
+        else:
+            if checkpoint and len(self.visited) >= self.limit:
+                checkpoint.remove()
+            elif checkpoint:
+                self._save_checkpoint()
+        finally:
+            self.link_batch_gen.close()
+            self.frontier.close()
+            self.extractor.logger().info(f"Visited urls store - {self.visited.describe()}")
@@ -1,34 +1,49 @@
+import atexit
+import itertools
 import logging
+import logging.handlers
 import os.path
+import queue
+from contextlib import contextmanager
 
-DEFAULT_LOG_PATH = None
-DEFAULT_LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-if not os.path.exists(DEFAULT_LOG_DIR):
-    try:
-        os.mkdir(DEFAULT_LOG_DIR)
-    except OSError:
-        DEFAULT_LOG_DIR = None
-if DEFAULT_LOG_DIR:
-    DEFAULT_LOG_PATH = os.path.join(DEFAULT_LOG_DIR, "search.log")
+DEFAULT_LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")     # Created when the logger is initialized
+DEFAULT_LOG_PATH = os.path.join(DEFAULT_LOG_DIR, "search.log")
+
+DEFAULT_LOG_SAMPLE = 1      # Log every n-th of the frequent (e.g. per link) messages. 1 - log all of them
+
+LOG_LEVELS = {
+    "info": logging.INFO,
+    "error": logging.ERROR,
+    "warning": logging.WARNING,
+    "debug": logging.DEBUG,
+    "critical": logging.CRITICAL
+}
 
 
 def with_logging_methods(methods):
     """
-    Class decorator to add logging methods like info(), warning(), ... to logger class
+    Class decorator to add logging methods like info(), warning(), ... to logger class.
+    The methods take a message with optional %-style arguments, like the methods of logging.Logger:
+    the message is only formatted if it is actually logged.
+    Messages passed with sample=<key> are sampled: only every n-th message with the same key is logged
+    (see SearchLogger.__init__())
     :param methods: A list of string method names
     :return: Class decorator
     """
     def logger_decorator(clazz):
         def create_log_method(name):
-            def inner(self, msg, force_console_print=False):
-                if logging.root.isEnabledFor(self.log_level_mappings()[name]):
-                    getattr(logging, name)(msg)
+            level = clazz.log_level_mappings()[name]
+
+            def inner(self, msg, *args, force_console_print=False, sample=None):
+                if level >= self.level:
+                    if sample is None or self.sampled(sample):
+                        self._logger.log(level, msg, *args)
                 elif force_console_print:
-                    print(msg)
+                    print(msg % args if args else msg)
             return inner
 
-        for level in methods:
-            setattr(clazz, level, create_log_method(level))
+        for level_name in methods:
+            setattr(clazz, level_name, create_log_method(level_name))
 
         return clazz
     return logger_decorator
@@ -36,6 +51,14 @@ def with_logging_methods(methods):
 
 @with_logging_methods(("info", "error", "warning", "debug", "critical"))
 class SearchLogger:
+    """
+    Records are written to the file and console by a background thread (logging.handlers.QueueListener),
+    so that the crawl never waits for the log I/O. The records left in the queue are written at exit,
+    or by SearchLogger.shutdown()
+
+    Worker processes (batch search, distributed crawl) do not open the log file: they send their records
+    to the logger of the parent process through a multiprocessing queue (see worker_records())
+    """
 
     _instance = None
 
@@ -52,30 +75,99 @@ class SearchLogger:
         if not cls._instance:
             cls._instance = cls(*args, **kwargs)
 
+    @classmethod
+    def shutdown(cls):
+        """
+        Writes out the queued records, and stops the background thread
+        """
+        if cls._instance:
+            cls._instance.stop()
+
     @classmethod
     def log_level_mappings(cls):
-        return {
-            "info": logging.INFO,
-            "error": logging.ERROR,
-            "warning": logging.WARNING,
-            "debug": logging.DEBUG,
-            "critical": logging.CRITICAL
-        }
+        return LOG_LEVELS
 
     @classmethod
     def get_actual_log_level(cls, level):
         return cls.log_level_mappings().get(level, logging.INFO)
 
-    def __init__(self, path=DEFAULT_LOG_PATH, log_to_console=True, level="info"):
-        log_level = self.__class__.get_actual_log_level(level)
+    def __init__(
+            self, path=DEFAULT_LOG_PATH, log_to_console=True, level="info", sample_every=DEFAULT_LOG_SAMPLE,
+            records=None
+    ):
+        """
+        :param path: path to the log file, or None
+        :param log_to_console: whether to log to console (always on, if there is no log file)
+        :param level: name of the log level
+        :param sample_every: for the frequent messages, logged with sample=<key>, log only
+        the 1st, (n+1)-th, (2n+1)-th, ... message with the key
+        :param records: in a worker process, the queue from worker_records() of the logger of the parent
+        process. The records are sent there, and <path> and <log_to_console> are ignored
+        """
+        self.level = self.__class__.get_actual_log_level(level)
+        self.sample_every = max(1, sample_every)
+        self._samples = {}
+        self._logger = logging.root
+        self._handlers = []
+        self._listener = None
+        if records is None:
+            self._handlers = self._create_handlers(path, log_to_console)
+            records = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(records, *self._handlers)
+            self._listener.start()
+            atexit.register(self.stop)
+        logging.root.handlers = [logging.handlers.QueueHandler(records)]
+        logging.root.setLevel(self.level)
+
+    @staticmethod
+    def _create_handlers(path, log_to_console):
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
         handlers = []
         if path:
-            handlers.append(logging.FileHandler(path, mode='w'))
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handlers.append(logging.FileHandler(path, mode='w'))
+            except OSError as e:
+                print(f"Could not open the log file {path}: {e}. Logging to console")
+                path = None
         if log_to_console or not path:
             handlers.append(logging.StreamHandler())
-        logging.root.handlers = []
-        logging.basicConfig(
-            level=log_level,
-            format="%(asctime)s [%(levelname)s] %(message)s",
-            handlers=handlers
-        )
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        return handlers
+
+    @contextmanager
+    def worker_records(self, context):
+        """
+        A context manager, which gives a queue for the records of worker processes. The records are written
+        by the handlers of this logger, in a separate background thread, until the context exits. Should be
+        exited after the workers have stopped, so that all their records are written
+        :param context: multiprocessing context of the worker processes
+        :return: a multiprocessing queue, to be passed to the workers (see the <records> constructor parameter)
+        """
+        records = context.Queue()
+        listener = logging.handlers.QueueListener(records, *self._handlers)
+        listener.start()
+        try:
+            yield records
+        finally:
+            listener.stop()
+            records.close()
+
+    def sampled(self, key):
+        """
+        :param key: key of a group of similar messages
+        :return: whether the next message of the group should be logged
+        """
+        if self.sample_every == 1:
+            return True
+        counter = self._samples.get(key)
+        if counter is None:
+            counter = self._samples.setdefault(key, itertools.count())
+        return next(counter) % self.sample_every == 0
+
+    def stop(self):
+        if self._listener and self._listener._thread:
+            self._listener.stop()
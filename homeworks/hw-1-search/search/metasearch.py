@@ -0,0 +1,157 @@
+import itertools
+import queue
+from .linkextractor import AbstractLinkExtractor, SEDriverRegistry
+from .prefetch import Prefetcher, merge_prefetched
+from .searchutils import to_canonical_url
+
+
+class MetaSearchLinkExtractor(AbstractLinkExtractor):
+    """
+    A driver which queries several search engines at once, and crawls their merged results.
+    The result pages of each engine are requested in the background, each engine with its own
+    delays, and the links are merged as the pages arrive. So an engine which is slow, or has
+    stopped giving results (e.g. because of a captcha), does not hold back the others.
+
+    Links returned by several engines are crawled once. The "engines" list of such a link
+    (shared by the results found through it) has the names of the engines which returned it on
+    the result pages merged into one batch with it. The engines which return it later are not added,
+    so that all the results found through the link are recorded with the same list.
+
+    Use for_engines() to create a driver for a specific set of engines.
+    """
+    engines = ()
+    _drivers = {}   # Кортеж имен поисковиков -> класс драйвера
+
+    @classmethod
+    def for_engines(cls, names):
+        """
+        :param names: names of registered search engine drivers
+        :return: a driver class, which queries all these engines. The same class is returned for
+        the same names, so that the searches in one process (e.g. in the search service) share its scheduler
+        """
+        key = (cls, tuple(names))
+        if key not in cls._drivers:
+            engines = tuple(SEDriverRegistry.get_driver(name) for name in names)
+            cls._drivers.setdefault(key, type(
+                f"{cls.__name__}[{','.join(names)}]",
+                (cls,),
+                {"engines": engines, "engine_name": "+".join(names)}
+            ))
+        return cls._drivers[key]
+
+    @classmethod
+    def engine_names(cls):
+        return [engine.engine_name for engine in cls.engines]
+
+    @classmethod
+    def host_intervals(cls):
+        """
+        The delays for crawled pages keep the search specific delays for the hosts of all the engines.
+        The requests for result pages go through the schedulers of the engines.
+        :return: a dict {netloc: interval}
+        """
+        return {
+            **{
+                engine.search_engine_host(): engine.delay_in_seconds_between_search_requests
+                for engine in cls.engines
+            },
+            **cls.host_delays
+        }
+
+    @classmethod
+    def search_link_batches(cls, query, start_page=0, prefetch=True):
+        """
+        Merged top level links of all the engines. Result pages are always requested in background,
+        one page ahead for each engine, so <prefetch> is ignored.
+        :param start_page: a dict {engine name: number of the first result page to request}, as returned
+        by search_position(), or 0 to start from the first pages
+        :return: MergedLinkBatches - an iterator of lists of objects {"url":..., "text":..., "engines": [...]}
+        """
+        next_pages = {engine.engine_name: (start_page or {}).get(engine.engine_name, 0) for engine in cls.engines}
+        items = queue.Queue()
+        prefetchers = {
+            Prefetcher(
+                engine.search_link_batches(query, start_page=next_pages[engine.engine_name], prefetch=False),
+                max_empty=engine.max_empty_attempts,
+                items=items
+            ): engine
+            for engine in cls.engines
+        }
+        return MergedLinkBatches(cls._merged_link_batches(prefetchers, items, next_pages), next_pages)
+
+    @classmethod
+    def search_position(cls, link_batches, batches_taken):
+        """
+        A merged batch is made of the result pages, which were ready at the moment, so the position is
+        the number of the next result page of each engine
+        :param link_batches: MergedLinkBatches
+        :return: a dict {engine name: number of the next result page}
+        """
+        return dict(link_batches.next_pages)
+
+    @classmethod
+    def _merged_link_batches(cls, prefetchers, items, next_pages):
+        """
+        :param next_pages: a dict {engine name: number of the next result page}. Updated as the pages are merged
+        """
+        merged_urls = set()     # Канонические url ссылок, уже выданных в предыдущих порциях
+        order = {engine: position for position, engine in enumerate(cls.engines)}
+        for ready in merge_prefetched(list(prefetchers), items):
+            # Страницы, готовые к этому моменту, упорядочиваем по поисковикам, и чередуем ссылки
+            # с них по позиции в выдаче: первая ссылка каждого поисковика, затем вторая, и т.д.
+            ready.sort(key=lambda pair: order[prefetchers[pair[0]]])
+            engine_links = [(prefetchers[prefetcher].engine_name, links) for prefetcher, links in ready]
+            for name, _ in engine_links:
+                next_pages[name] += 1
+            batch = cls._merged_batch(engine_links, merged_urls)
+            merged_urls.update(batch)
+            if batch:
+                yield list(batch.values())
+            else:
+                cls.logger().info("No new links on the result pages received")
+
+    @staticmethod
+    def _merged_batch(engine_links, merged_urls):
+        """
+        :param engine_links: a list of pairs (engine name, links of its result page)
+        :param merged_urls: canonical urls of the links in the previous batches, which are skipped
+        :return: a dict {canonical url: link, with the list of engines, which returned it}, in the order of
+        the positions of the links: the first link of each engine, then the second, and so on
+        """
+        ranked = itertools.zip_longest(*[[(name, link) for link in links] for name, links in engine_links])
+        batch = {}
+        for name, link in (pair for rank in ranked for pair in rank if pair):
+            canonical_url = to_canonical_url(link["url"])
+            if canonical_url in merged_urls:
+                # Ссылка уже выдана (и, возможно, записана в результаты) - ее список поисковиков не меняем
+                continue
+            if canonical_url not in batch:
+                batch[canonical_url] = {**link, "engines": []}
+            if name not in batch[canonical_url]["engines"]:
+                batch[canonical_url]["engines"].append(name)
+        return batch
+
+
+class MergedLinkBatches:
+    """
+    Iterator of the merged link batches of several search engines (see MetaSearchLinkExtractor).
+    Keeps the number of the next result page of each engine, which has not been merged into the
+    batches given so far
+    """
+
+    def __init__(self, batches, next_pages):
+        """
+        :param batches: a generator of merged link batches
+        :param next_pages: a dict {engine name: number of the next result page}, updated by <batches>
+        """
+        self._batches = batches
+        self.next_pages = next_pages
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._batches)
+
+    def close(self):
+        self._batches.close()
@@ -0,0 +1,388 @@
+import bisect
+import json
+import threading
+import time
+from .logger import SearchLogger
+
+
+METRICS_PREFIX = "websearch_"
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)    # Seconds
+SUMMARY_MAX_ROWS = 10   # Rows per metric in the summary (e.g. the slowest hosts). The rest are summed up
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, as in Prometheus
+    """
+
+    def __init__(self, buckets):
+        """
+        :param buckets: sorted upper bounds of the buckets. The last (+Inf) bucket is implied
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulative_counts(self):
+        """
+        :return: a list of pairs (upper bound, number of values not greater than it),
+        the last upper bound being float("inf")
+        """
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Estimates a quantile, interpolating linearly within the bucket, where it falls
+        :param q: number between 0 and 1
+        :return: the estimated value, or None if there are no values
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower, seen = 0, 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            lower, seen = bound, seen + count
+        return self.buckets[-1]     # Значение в последнем, неограниченном, интервале
+
+
+class CrawlMetrics:
+    """
+    Counters and histograms of the crawl, labeled by stage, host, driver, etc. Thread-safe.
+
+    Metrics are collected only when enabled with init_metrics(). Instrumented code gets
+    the instance with get_metrics(), and skips all the bookkeeping (including time measurements)
+    when it returns None, so disabled metrics cost one class attribute lookup per call site.
+
+    Collected metrics (without the METRICS_PREFIX):
+        fetch_seconds{host}                 - HTTP requests, from sending to reading the body
+        sleep_seconds{host}                 - politeness delays before the requests
+        parse_seconds{stage="page"}         - parsing of crawled pages into anchors
+        filter_seconds{stage="page"}        - matching page links against the query, per batch of links
+        parse_seconds{stage="serp",driver}  - parsing of search engine result pages
+        responses_total{host,status}        - responses by HTTP status, or "cached", "error", "skipped",
+                                              "replayed", "not_archived", "shared" (fetched by another
+                                              process of a batch search)
+        downloaded_bytes_total{host}        - response bytes read
+        search_pages_total{driver,outcome}  - search engine result pages, "ok", "empty" or "error"
+        search_links_total{driver}          - links found on search engine result pages
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_metrics(cls):
+        """
+        :return: the shared CrawlMetrics instance, or None if metrics are not enabled
+        """
+        return cls._instance
+
+    @classmethod
+    def init_metrics(cls, *args, **kwargs):
+        """
+        Enables metrics. Takes the same arguments as the constructor
+        """
+        cls._instance = cls(*args, **kwargs)
+
+    @classmethod
+    def disable_metrics(cls):
+        cls._instance = None
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        :param buckets: upper bounds of histogram buckets, in seconds
+        """
+        self.buckets = tuple(buckets)
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._counters = {}     # (name, labels) -> value, где labels - кортеж пар (ключ, значение)
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments a counter
+        :param name: counter name
+        :param value: increment
+        :param labels: labels of the counter, e.g. host="example.com"
+        """
+        key = (name, label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds a value (usually a duration in seconds) to a histogram
+        :param name: histogram name
+        :param value: the observed value
+        :param labels: labels of the histogram, e.g. host="example.com"
+        """
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timed(self, iterable, name, **labels):
+        """
+        Wraps an iterator, adding the time spent in producing each of its items to a histogram
+        (as one observation, when the iterator is exhausted or closed). The time the consumer spends
+        between the items is not counted.
+        :param iterable: iterable, e.g. a lazy generator of parsed elements
+        :param name: histogram name
+        :param labels: labels of the histogram
+        :return: a generator of the same items
+        """
+        elapsed = 0
+        iterator = iter(iterable)
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += clock() - start
+                    return
+                elapsed += clock() - start
+                yield item
+        finally:
+            self.observe(name, elapsed, **labels)
+
+    def merge(self, other):
+        """
+        Adds the counters and histograms of other metrics (e.g. collected in another process) to these
+        :param other: CrawlMetrics with the same histogram buckets
+        """
+        counters, histograms = other._snapshot()
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, histogram in histograms.items():
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(self.buckets)
+                self._histograms[key].merge(histogram)
+
+    def __getstate__(self):
+        # Метрики передаются между процессами (пакетный поиск) - без блокировки, которая не сериализуется
+        state = dict(self.__dict__)
+        state["_counters"], state["_histograms"] = self._snapshot()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        """
+        :return: number of seconds since the metrics were enabled
+        """
+        return time.perf_counter() - self._started
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: Histogram(self.buckets) for key in self._histograms}
+            for key, histogram in histograms.items():
+                histogram.merge(self._histograms[key])
+        return counters, histograms
+
+    def to_dict(self):
+        """
+        :return: JSON-serializable dict with all the metrics
+        """
+        counters, histograms = self._snapshot()
+        return {
+            "started_at": self.started_at,
+            "elapsed_seconds": self.elapsed(),
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": [
+                        ["+Inf" if bound == float("inf") else bound, count]
+                        for bound, count in histogram.cumulative_counts()
+                    ]
+                }
+                for (name, labels), histogram in sorted(histograms.items())
+            ]
+        }
+
+    def to_prometheus(self):
+        """
+        :return: string with all the metrics in Prometheus text exposition format
+        """
+        counters, histograms = self._snapshot()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{METRICS_PREFIX}{name}{format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name == name:
+                    lines.extend(prometheus_histogram_lines(name, labels, histogram))
+        lines.append(f"# TYPE {METRICS_PREFIX}elapsed_seconds gauge")
+        lines.append(f"{METRICS_PREFIX}elapsed_seconds {self.elapsed()}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """
+        Writes the metrics to a file: JSON, if the path ends with '.json', or Prometheus text format otherwise
+        :param path: path to the file
+        :return: True if the file was written
+        """
+        try:
+            with open(path, mode="w", encoding="utf8") as f:
+                if path.endswith(".json"):
+                    json.dump(self.to_dict(), f, indent=4, ensure_ascii=False)
+                else:
+                    f.write(self.to_prometheus())
+        except OSError as e:
+            SearchLogger.get_logger().error("Error writing metrics to %s: %s", path, e)
+            return False
+        SearchLogger.get_logger().info("Metrics written to %s", path)
+        return True
+
+    def summary(self):
+        """
+        :return: string, human-readable tables of the histograms and counters. For each metric,
+        only SUMMARY_MAX_ROWS label sets with the largest totals are shown, the rest are summed up
+        """
+        from tabulate import tabulate
+        counters, histograms = self._snapshot()
+        return "\n\n".join([
+            f"Crawl metrics, {self.elapsed():.1f} seconds:",
+            tabulate(
+                self._timing_rows(histograms),
+                headers=["Timing", "Labels", "Count", "Total, s", "Mean, ms", "p50, ms", "p95, ms"]
+            ),
+            tabulate(self._counter_rows(counters), headers=["Counter", "Labels", "Value"])
+        ])
+
+    def _timing_rows(self, histograms):
+        rows = []
+        for name in sorted({name for name, _ in histograms}):
+            series = sorted(
+                ((labels, histogram) for (hname, labels), histogram in histograms.items() if hname == name),
+                key=lambda pair: -pair[1].sum
+            )
+            for labels, histogram in top_series(series, self._merged_histogram):
+                rows.append([name, format_labels(labels, braces=False), *histogram_row(histogram)])
+        return rows
+
+    def _merged_histogram(self, histograms):
+        merged = Histogram(self.buckets)
+        for histogram in histograms:
+            merged.merge(histogram)
+        return merged
+
+    @staticmethod
+    def _counter_rows(counters):
+        rows = []
+        for name in sorted({name for name, _ in counters}):
+            series = sorted(
+                ((labels, value) for (cname, labels), value in counters.items() if cname == name),
+                key=lambda pair: -pair[1]
+            )
+            rows.extend([name, format_labels(labels, braces=False), value] for labels, value in top_series(series, sum))
+        return rows
+
+    def log_summary(self):
+        SearchLogger.get_logger().info("\n%s\n", self.summary(), force_console_print=True)
+
+
+def top_series(series, merge):
+    """
+    Keeps the first SUMMARY_MAX_ROWS - 1 series of a metric, and merges the rest into one "other" series
+    :param series: a list of pairs (labels, value), largest first
+    :param merge: a function, which merges a list of values into one
+    :return: a list of at most SUMMARY_MAX_ROWS pairs
+    """
+    if len(series) <= SUMMARY_MAX_ROWS:
+        return series
+    rest = merge([value for _, value in series[SUMMARY_MAX_ROWS - 1:]])
+    return series[:SUMMARY_MAX_ROWS - 1] + [((("other", f"{len(series) - SUMMARY_MAX_ROWS + 1} more"),), rest)]
+
+
+def histogram_row(histogram):
+    """
+    :param histogram: Histogram of durations in seconds
+    :return: a list of the count, total seconds, and mean, p50 and p95 milliseconds, formatted for a table
+    """
+    p50, p95 = histogram.quantile(0.5), histogram.quantile(0.95)
+    return [
+        histogram.count, f"{histogram.sum:.3f}",
+        f"{histogram.sum / histogram.count * 1000:.1f}" if histogram.count else "",
+        f"{p50 * 1000:.1f}" if p50 is not None else "",
+        f"{p95 * 1000:.1f}" if p95 is not None else ""
+    ]
+
+
+def prometheus_histogram_lines(name, labels, histogram):
+    """
+    :param name: name of the metric, without METRICS_PREFIX
+    :param labels: tuple of (name, value) pairs
+    :param histogram: Histogram
+    :return: a list of the bucket, sum and count lines of the histogram in Prometheus text format
+    """
+    lines = []
+    for bound, count in histogram.cumulative_counts():
+        le = "+Inf" if bound == float("inf") else repr(float(bound))
+        lines.append(f"{METRICS_PREFIX}{name}_bucket{format_labels(labels + (('le', le),))} {count}")
+    lines.append(f"{METRICS_PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}")
+    lines.append(f"{METRICS_PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+    return lines
+
+
+def label_key(labels):
+    """
+    :param labels: dict of labels
+    :return: a tuple of pairs (name, value as string), sorted by name
+    """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels, braces=True):
+    """
+    :param labels: a tuple of pairs (name, value)
+    :param braces: whether to format the labels as in Prometheus: {name="value",...}, or just name=value, ...
+    :return: string
+    """
+    if not braces:
+        return ", ".join(f"{name}={value}" for name, value in labels)
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
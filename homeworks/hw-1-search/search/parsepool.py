@@ -0,0 +1,169 @@
+"""
+Parsing of the pages in a pool of worker processes, so that the HTML parsing does not hold up the
+fetches (which go on in the crawling thread, the prefetch thread, or the threads of the async crawler),
+and uses more than one CPU core.
+
+A worker gets the text of a page, and returns a compact list of (url, text) pairs of its links:
+canonical, without duplicates, already matched against the query, in the order of the page. Unlike the
+lazy parsing in the crawling thread, a page is always parsed as a whole.
+
+The sync crawler does not wait for a page to be parsed before it fetches the next one: it keeps up to
+ParsePool.window pages fetched ahead (see ParsePool.submit_page()), and takes their links in the order
+the pages were fetched, so the results of a search do not depend on the timing of the workers.
+"""
+import time
+from .driverregistry import SEDriverRegistry
+from .parsers import ParserRegistry, DEFAULT_PARSER
+
+
+DEFAULT_PARSE_WORKERS = 0   # 0 - страницы разбираются в потоке обхода, без пула процессов
+
+
+def _init_worker(parser):
+    import search.drivers  # noqa: F401  Need this to declare drivers in the worker processes
+    ParserRegistry.set_default(parser)
+
+
+def _page_links(page_contents, query_words, mode):
+    """
+    Runs in a worker process
+    :return: a pair (list of pairs (url, text) of the valid links of the page, seconds spent)
+    """
+    from .searchutils import valid_page_links
+    start = time.perf_counter()
+    links = [(link["url"], link["text"]) for link in valid_page_links(page_contents, query_words, mode=mode)]
+    return links, time.perf_counter() - start
+
+
+def _search_results(engine_name, response_text):
+    """
+    Runs in a worker process
+    :return: a list of pairs (url, text) of the links of a search engine result page, or None if
+    the driver is not known in the worker process
+    """
+    driver = SEDriverRegistry.get_driver(engine_name)
+    if driver is None:
+        return None
+    return [(link["url"], link["text"]) for link in driver.get_links_info(response_text)]
+
+
+class ParsePool:
+    """
+    A shared pool of processes for HTML parsing. Used by valid_page_links() and
+    AbstractLinkExtractor.get_links_info(), when enabled
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_pool(cls):
+        """
+        :return: the shared ParsePool instance, or None if the pages are parsed in the crawling thread
+        """
+        return cls._instance
+
+    @classmethod
+    def init_pool(cls, *args, **kwargs):
+        """
+        Enables the pool. Takes the same arguments as the constructor
+        """
+        cls.close_pool()
+        cls._instance = cls(*args, **kwargs)
+
+    @classmethod
+    def close_pool(cls):
+        if cls._instance:
+            cls._instance.close()
+        cls._instance = None
+
+    def __init__(self, workers, parser=DEFAULT_PARSER):
+        """
+        :param workers: number of worker processes
+        :param parser: name of the parser backend used by the workers (see ParserRegistry)
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self.workers = workers
+        # Сколько страниц обход может прочитать вперед, пока разбираются предыдущие: по одной на процесс,
+        # и еще одна, которую обход читает сейчас
+        self.window = workers + 1
+        # Рабочие процессы запускаются заново (spawn), а не копией текущего: в нем уже работают потоки
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(parser,)
+        )
+        # Процессы стартуют сразу, пока идет запрос к поисковику, а не на первой странице
+        for _ in range(workers):
+            self._executor.submit(int)
+
+    def submit_page(self, page_contents, query_words, mode="all"):
+        """
+        Hands a page to a worker process, without waiting for it to be parsed
+        :param page_contents: string, web page contents as text
+        :param query_words: a list of query words (strings). Assumed to be in lower case
+        :param mode: "any" or "all"
+        :return: ParsedPage
+        """
+        return ParsedPage(self._executor.submit(_page_links, page_contents, list(query_words), mode))
+
+    def valid_page_links(self, page_contents, query_words, mode="all", exclude=None):
+        """
+        Same as searchutils.valid_page_links(), with the page parsed in a worker process. Waits
+        for the worker
+        :return: a generator of objects {'url':..., 'text':...}. Links in <exclude> are skipped
+        at the time the generator gets to them
+        """
+        return self.submit_page(page_contents, query_words, mode=mode).links(exclude=exclude)
+
+    def search_results(self, extractor, response_text):
+        """
+        Parses a search engine result page in a worker process, and waits for it. The result pages
+        are parsed as they are read, which is in the prefetch thread (see Prefetcher), unless the
+        prefetch is disabled. Only registered drivers are known in the workers, the others
+        (e.g. created on the fly) are parsed here
+        :param extractor: search engine driver class
+        :param response_text: search engine result page contents
+        :return: a list of objects {"url":..., "text":...}
+        """
+        links = None
+        if extractor.engine_name and SEDriverRegistry.get_driver(extractor.engine_name) is extractor:
+            links = self._executor.submit(_search_results, extractor.engine_name, response_text).result()
+        if links is None:
+            return list(ParserRegistry.get_parser().search_results(extractor, response_text))
+        return [{"url": url, "text": text} for url, text in links]
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ParsedPage:
+    """
+    A page, handed to a worker process by ParsePool.submit_page()
+    """
+
+    def __init__(self, future):
+        self._future = future
+
+    def links(self, exclude=None):
+        """
+        Waits for the worker to parse the page, and records its parse time, if metrics are enabled
+        :param exclude: optional container of canonical urls to skip (e.g. already visited ones)
+        :return: a generator of objects {'url':..., 'text':...}. Links in <exclude> are skipped
+        at the time the generator gets to them
+        """
+        from .metrics import CrawlMetrics
+        links, seconds = self._future.result()
+        metrics = CrawlMetrics.get_metrics()
+        if metrics:
+            metrics.observe("parse_seconds", seconds, stage="page")
+        return (
+            {'url': url, 'text': text}
+            for url, text in links
+            if exclude is None or url not in exclude
+        )
+
+    def cancel(self):
+        """
+        Drops the page, if the worker has not started parsing it yet
+        """
+        self._future.cancel()
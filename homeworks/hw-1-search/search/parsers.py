@@ -0,0 +1,178 @@
+from abc import ABC, abstractmethod
+
+
+FEED_CHUNK_SIZE = 64 * 1024
+
+
+def xpath_has_class(name):
+    """
+    XPath condition equivalent to the CSS class selector .<name>
+    :param name: CSS class name
+    :return: string, XPath predicate expression
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class ParserBackend(ABC):
+    """
+    An abstract HTML parser backend. Provides anchors of regular web pages, and search
+    result links of search engine result pages. Backends import their parser libraries
+    on first use, to keep the CLI startup fast.
+    """
+
+    @abstractmethod
+    def anchors(self, page_contents):
+        """
+        :param page_contents: text (string)
+        :return: a generator of anchor elements, which support elem.get("href")
+        """
+        pass
+
+    @abstractmethod
+    def text(self, elem):
+        """
+        :param elem: anchor element, produced by anchors()
+        :return: text content of the element
+        """
+        pass
+
+    @abstractmethod
+    def search_results(self, extractor, response_text):
+        """
+        :param extractor: search engine driver class
+        :param response_text: search engine result page contents
+        :return: a generator of objects {"url":..., "text":...}
+        """
+        pass
+
+
+class SoupParserBackend(ParserBackend):
+    """
+    Beautiful Soup based backend. Works with CSS selectors and extractors of any driver.
+    """
+
+    def anchors(self, page_contents):
+        from bs4 import BeautifulSoup, SoupStrainer
+        soup = BeautifulSoup(page_contents, 'lxml', parse_only=SoupStrainer("a", href=True))
+        for link_elem in soup.find_all("a"):
+            yield link_elem
+
+    def text(self, elem):
+        return elem.getText()
+
+    def search_results(self, extractor, response_text):
+        return extractor._get_links_info(extractor._extract_elements_from_response(response_text))
+
+    @staticmethod
+    def compiled_selector(extractor):
+        """
+        Compiles the CSS selector of a driver class once, on first use
+        :param extractor: search engine driver class
+        :return: compiled soupsieve selector
+        """
+        if "_compiled_css_selector" not in extractor.__dict__:
+            import soupsieve
+            extractor._compiled_css_selector = soupsieve.compile(extractor.get_selector())
+        return extractor._compiled_css_selector
+
+
+class LxmlParserBackend(ParserBackend):
+    """
+    Fast backend using lxml directly. Anchors are produced by an incremental parser, as
+    the page is being parsed, so a consumer which stops early saves the rest of the parsing
+    as well. Search results are extracted with compiled XPath expressions, for drivers which
+    declare them (see AbstractLinkExtractor.get_xpath_selector()). For other drivers, falls
+    back to Beautiful Soup.
+    """
+
+    def __init__(self):
+        self._fallback = SoupParserBackend()
+        self._string_xpath = None
+
+    def anchors(self, page_contents):
+        from lxml import etree
+        if self._string_xpath is None:
+            self._string_xpath = etree.XPath("string()")
+        parser = etree.HTMLPullParser(events=("end",), tag="a")
+        for start in range(0, len(page_contents), FEED_CHUNK_SIZE):
+            parser.feed(page_contents[start:start + FEED_CHUNK_SIZE])
+            for _, link_elem in parser.read_events():
+                if link_elem.get("href") is not None:
+                    yield link_elem
+        parser.close()
+        for _, link_elem in parser.read_events():
+            if link_elem.get("href") is not None:
+                yield link_elem
+
+    def text(self, elem):
+        return self._string_xpath(elem)
+
+    def search_results(self, extractor, response_text):
+        xpaths = self.compiled_xpaths(extractor)
+        if not xpaths:
+            return self._fallback.search_results(extractor, response_text)
+        return self._search_results(extractor, response_text, *xpaths)
+
+    @staticmethod
+    def _search_results(extractor, response_text, selector, text_xpath):
+        if not response_text.strip():
+            return
+        from lxml import etree
+        parser = etree.HTMLParser()
+        parser.feed(response_text)  # Unlike etree.fromstring(), accepts text with an encoding declaration
+        tree = parser.close()
+        if tree is None:
+            return
+        for elem in selector(tree):
+            linkinfo = {
+                "url": extractor.get_link_extractor(elem),
+                "text": text_xpath(elem),
+            }
+            if linkinfo["url"]:
+                yield linkinfo
+
+    @staticmethod
+    def compiled_xpaths(extractor):
+        """
+        Compiles XPath expressions of a driver class once, on first use
+        :param extractor: search engine driver class
+        :return: a tuple (selector, text extractor) of compiled XPath objects, or None if
+        the driver does not declare XPath expressions
+        """
+        if "_compiled_xpaths" not in extractor.__dict__:
+            from lxml import etree
+            selector = extractor.get_xpath_selector()
+            extractor._compiled_xpaths = (
+                etree.XPath(selector), etree.XPath(extractor.get_xpath_text_extractor())
+            ) if selector else None
+        return extractor._compiled_xpaths
+
+
+DEFAULT_PARSER = "lxml"
+
+
+class ParserRegistry:
+    """
+    A class to store available parser backends, and the one currently used
+    """
+    _registry = {
+        "lxml": LxmlParserBackend(),
+        "soup": SoupParserBackend(),
+    }
+    _default = DEFAULT_PARSER
+
+    @classmethod
+    def register(cls, name, backend):
+        cls._registry[name] = backend
+
+    @classmethod
+    def set_default(cls, name):
+        cls._default = name
+
+    @classmethod
+    def get_parser(cls, name=None):
+        return cls._registry[name or cls._default]
+
+    @classmethod
+    def registered_parsers_names(cls):
+        return cls._registry.keys()
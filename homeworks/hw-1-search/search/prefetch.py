@@ -0,0 +1,156 @@
+import queue
+import threading
+from .logger import SearchLogger
+
+
+DEFAULT_PREFETCH_DEPTH = 1     # Number of items produced ahead of the consumer
+
+
+class Prefetcher:
+    """
+    Iterator, which takes items from another (blocking) iterator in a background daemon thread,
+    staying at most <depth> items ahead of the consumer. Used for search engine result pages:
+    the next page is requested and parsed while the crawl under the current page is running,
+    so it is ready by the time it is needed. The requests are still spaced by the host
+    scheduler of the wrapped generator.
+
+    The background thread is started on the first next() call. It stops after the consumer
+    calls close(), and also by itself after <max_empty> consecutive empty items (which for
+    search pages means the engine stopped giving results, e.g. showed a captcha), so that
+    no more requests are made in vain.
+
+    Several prefetchers can share one queue of items, to be consumed together, in the order
+    the items become ready (see merge_prefetched()).
+    """
+
+    _done = object()    # Marks the end of the wrapped iterator
+
+    def __init__(self, iterable, depth=DEFAULT_PREFETCH_DEPTH, max_empty=None, items=None):
+        """
+        :param iterable: iterable to take the items from. Its iterator is used (and closed,
+        if it's a generator) in the background thread only
+        :param depth: max number of items taken ahead of the consumer
+        :param max_empty: number of consecutive empty (falsy) items, after which no more
+        items are taken. None means no limit
+        :param items: optional queue.Queue, shared with other prefetchers, to put the items to
+        """
+        self._iterable = iterable
+        self._max_empty = max_empty
+        self._items = items if items is not None else queue.Queue()
+        self._slots = threading.Semaphore(depth)
+        self._stopped = threading.Event()
+        self._finished = False
+        self._thread = None
+
+    def start(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="search-page-prefetcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        iterator = iter(self._iterable)
+        empty_count = 0
+        try:
+            while True:
+                self._slots.acquire()
+                if self._stopped.is_set():
+                    break
+                item = next(iterator, self._done)
+                self._items.put((self, item, None))
+                if item is self._done:
+                    return
+                empty_count = 0 if item else empty_count + 1
+                if self._max_empty is not None and empty_count >= self._max_empty:
+                    SearchLogger.get_logger().info(
+                        "Got %s empty items in a row, stopping the prefetch", empty_count
+                    )
+                    break
+        except BaseException as e:    # Passed to the consumer, to be raised in its thread
+            self._items.put((self, None, e))
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+        self._items.put((self, self._done, None))
+
+    def accept(self, item, error):
+        """
+        Processes an entry taken from the queue of items by the consumer
+        :return: the item. Raises the error from the background thread, if any,
+        or StopIteration at the end of items
+        """
+        if error is not None:
+            self._finished = True
+            raise error
+        if item is self._done:
+            self._finished = True
+            raise StopIteration
+        self._slots.release()   # Let the background thread take the next item
+        return item
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        self.start()
+        _, item, error = self._items.get()
+        return self.accept(item, error)
+
+    def close(self):
+        """
+        Stops the background thread. A request already in progress is not interrupted, but
+        its result is discarded
+        """
+        self._finished = True
+        self._stopped.set()
+        self._slots.release()
+
+
+def merge_prefetched(prefetchers, items):
+    """
+    Consumes several prefetchers together, as their items become ready. A prefetcher which
+    fails is logged and dropped, so that the others go on.
+    :param prefetchers: a list of Prefetcher objects, sharing the queue <items>
+    :param items: queue.Queue
+    :return: a generator of lists of pairs (prefetcher, item). Each list has all items which
+    were ready at the moment, at least one
+    """
+    active = set(prefetchers)
+    for prefetcher in prefetchers:
+        prefetcher.start()
+    try:
+        while active:
+            ready = _ready_items(items, active)
+            if ready:
+                yield ready
+    finally:
+        for prefetcher in prefetchers:
+            prefetcher.close()
+
+
+def _ready_items(items, active):
+    """
+    Waits for the first item in the queue, and takes the ones ready by then
+    :param items: queue.Queue of the prefetchers
+    :param active: a set of the prefetchers, which are not exhausted. The exhausted and failed ones are removed
+    :return: a list of pairs (prefetcher, item), possibly empty
+    """
+    ready = []
+    entry = items.get()
+    while entry:
+        prefetcher, item, error = entry
+        try:
+            ready.append((prefetcher, prefetcher.accept(item, error)))
+        except StopIteration:
+            active.discard(prefetcher)
+        except Exception as e:
+            SearchLogger.get_logger().error("Prefetch failed: %r", e)
+            active.discard(prefetcher)
+        try:
+            entry = items.get_nowait()
+        except queue.Empty:
+            entry = None
+    return ready
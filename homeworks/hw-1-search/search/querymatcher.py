@@ -0,0 +1,119 @@
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+
+# Separators between url and text of a link, and between links in a batch. Query words
+# are split by spaces, and are not expected to contain these characters
+FIELD_SEPARATOR = "\x00"
+LINK_SEPARATOR = "\x01"
+
+
+class QueryMatcher:
+    """
+    Query words compiled into a single regular expression, to find which of the words
+    occur in a link's url or (lower case) text. A whole batch of links is scanned in one
+    pass. The number of matched words per link is used both for filtering (in 'all' or
+    'any' mode), and can be reused for ranking.
+    """
+
+    def __init__(self, query_words, mode="all"):
+        """
+        :param query_words: a list of query words (strings). Assumed to be in lower case
+        :param mode: "all" (default), or "any"
+        """
+        self.words = list(dict.fromkeys(w for w in query_words if w))
+        self.mode = mode
+        self.required = 1 if mode == "any" else len(self.words)
+        self._pattern = None
+        if self.words:
+            # Longest words go first, so that at each position the longest word is matched.
+            # Shorter words matched at the same position are its substrings, and are accounted
+            # for through self._implied. The lookahead makes matches overlap
+            alternatives = "|".join(re.escape(w) for w in sorted(self.words, key=len, reverse=True))
+            self._pattern = re.compile(f"(?=({alternatives}))")
+        self._implied = {
+            word: frozenset(other for other in self.words if other in word)
+            for word in self.words
+        }
+
+    @staticmethod
+    def _haystack(link_info):
+        return f"{link_info['url']}{FIELD_SEPARATOR}{(link_info['text'] or '').lower()}"
+
+    def _found_words(self, haystack):
+        found = set()
+        for match in self._pattern.finditer(haystack):
+            found |= self._implied[match.group(1)]
+        return found
+
+    def match_count(self, link_info):
+        """
+        :param link_info: a dict with keys "url" and "text"
+        :return: number of distinct query words present in either url or text
+        """
+        if not self._pattern:
+            return 0
+        return len(self._found_words(self._haystack(link_info)))
+
+    def match_counts(self, links):
+        """
+        Counts matched query words for a batch of links, in one pass over the batch
+        :param links: a list of dicts with keys "url" and "text"
+        :return: a list of numbers of distinct query words present in either url or text, per link
+        """
+        if not self._pattern or not links:
+            return [0] * len(links)
+        starts = []
+        position = 0
+        haystacks = []
+        for link_info in links:
+            haystack = self._haystack(link_info)
+            starts.append(position)
+            haystacks.append(haystack)
+            position += len(haystack) + len(LINK_SEPARATOR)
+        found = [set() for _ in links]
+        for match in self._pattern.finditer(LINK_SEPARATOR.join(haystacks)):
+            found[bisect_right(starts, match.start()) - 1] |= self._implied[match.group(1)]
+        return [len(words) for words in found]
+
+    def is_match(self, count):
+        """
+        :param count: number of matched query words
+        :return: True if this number of matched words satisfies the search mode
+        """
+        return count >= self.required
+
+    def is_valid(self, link_info):
+        """
+        Same check as searchutils.link_is_valid()
+        :param link_info: a dict with keys "url" and "text"
+        :return: True or False
+        """
+        return link_info["url"].startswith("http") and self.is_match(self.match_count(link_info))
+
+    def scored_links(self, links):
+        """
+        Filters a batch of links
+        :param links: a list of dicts with keys "url" and "text"
+        :return: a generator of pairs (link_info, number of matched words), for valid links only
+        """
+        for link_info, count in zip(links, self.match_counts(links)):
+            if link_info["url"].startswith("http") and self.is_match(count):
+                yield link_info, count
+
+
+@lru_cache(maxsize=32)
+def _get_matcher(query_words, mode):
+    return QueryMatcher(query_words, mode)
+
+
+def get_matcher(query_words, mode="all"):
+    """
+    Returns a compiled matcher for the query words. Matchers are cached, so that a query
+    is compiled once per search
+    :param query_words: a list of query words (strings). Assumed to be in lower case
+    :param mode: "all" (default), or "any"
+    :return: QueryMatcher
+    """
+    return _get_matcher(tuple(query_words), mode)
@@ -1,6 +1,8 @@
-from tabulate import tabulate
 import csv
+import gzip
+import importlib
 import json
+import sys
 from .logger import SearchLogger
 
 
@@ -9,62 +11,318 @@ HEADERS_TRANSLATION = {
     'text': 'Текст',
     'index': '№',
     'rec.depth': 'Глубина рекурсии',
-    'parent_url': 'Родительская ссылка'
+    'parent_url': 'Родительская ссылка',
+    'engines': 'Поисковики',
+    'query': 'Запрос'
 }
 
 MAX_LINK_LENGTH_FOR_TABLE = 80
+GZIP_FLUSH_EVERY = 100      # Records. Flushing a gzip stream after every record would hurt compression
+
+
+class ResultWriter:
+    """
+    Base class for incremental writers of search results. Results are written one by one,
+    as the search yields them, so that they don't have to be kept in memory, and the results
+    found before a crash are not lost. Use as a context manager, or call close() at the end.
+    """
+
+    keeps_runs = False      # Whether the results of each search are kept apart, with the search parameters
+
+    def __init__(self, headers):
+        """
+        :param headers: keys of the result objects to write
+        """
+        self.headers = headers
+        self.count = 0
+
+    def write(self, row):
+        self._write(row)
+        self.count += 1
+
+    def _write(self, row):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FileResultWriter(ResultWriter):
+    """
+    Base class for writers to a file. If the path ends with '.gz', the file is gzip-compressed.
+    Each record is flushed to the file once written (for compressed files - every
+    GZIP_FLUSH_EVERY records).
+    """
+
+    compressible = True
+
+    @classmethod
+    def open(cls, path, headers, run_info=None):
+        """
+        :param path: path to the file
+        :param headers: keys of the result objects to write
+        :param run_info: optional dict with the search parameters ("query", "engines", ...). Not
+        used by text formats
+        :return: the writer, or None if the file could not be opened
+        """
+        f = ResultsHandler.openwrite(path)
+        return cls(f, path, headers) if f else None
+
+    def __init__(self, f, path, headers):
+        """
+        :param f: file, opened for writing in text mode (see ResultsHandler.openwrite())
+        :param path: path to the file
+        :param headers: keys of the result objects to write
+        """
+        super().__init__(headers)
+        self.path = path
+        self._file = f
+        self._flush_every = GZIP_FLUSH_EVERY if path.endswith(".gz") else 1
+        self._start()
+
+    def _start(self):
+        pass
+
+    def _finish(self):
+        pass
+
+    def write(self, row):
+        super().write(row)
+        if self.count % self._flush_every == 0:
+            self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._finish()
+        self._file.close()
+        SearchLogger.get_logger().info(
+            f"{self.count} search results written to {self.path}", force_console_print=True
+        )
+
+
+class CsvResultWriter(FileResultWriter):
+
+    def _start(self):
+        self._writer = csv.writer(self._file, delimiter=',', quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
+        self._writer.writerow(self.headers)
+
+    def _write(self, row):
+        self._writer.writerow(ResultsHandler.get_row_values(row, self.headers))
+
+
+class JsonResultWriter(FileResultWriter):
+    """
+    Writes a JSON array of result objects, in the same format as json.dump(..., indent=4).
+    The array is closed in close(), so an interrupted search leaves the file without the closing bracket.
+    """
+
+    def _start(self):
+        self._file.write("[")
+
+    def _write(self, row):
+        item = json.dumps({key: row[key] for key in self.headers}, indent=4, ensure_ascii=False)
+        self._file.write(("," if self.count else "") + "\n    " + item.replace("\n", "\n    "))
+
+    def _finish(self):
+        self._file.write("\n]" if self.count else "]")
+
+
+class JsonLinesResultWriter(FileResultWriter):
+    """
+    Writes one JSON object per line
+    """
+
+    def _write(self, row):
+        self._file.write(json.dumps({key: row[key] for key in self.headers}, ensure_ascii=False) + "\n")
+
+
+class ConsoleTableWriter(ResultWriter):
+    """
+    Prints all the results as a table, once they are all available. Keeps the results in memory,
+    since column widths depend on all the rows.
+    """
+
+    def __init__(self, headers):
+        super().__init__(headers)
+        self._rows = []
+
+    def _write(self, row):
+        self._rows.append(row)
+
+    def close(self):
+        ResultsHandler._console_print(self._rows, self.headers)
+        self._rows = []
+
+
+class ConsoleStreamWriter(ResultWriter):
+    """
+    Prints each result to console as soon as it is found
+    """
+
+    def __init__(self, headers):
+        super().__init__(headers)
+        ResultsHandler._print_results_header()
+
+    def _write(self, row):
+        ResultsHandler._print_row(row, self.headers)
+        sys.stdout.flush()
+
+    def close(self):
+        if not self.count:
+            ResultsHandler._print_no_results()
+        ResultsHandler._print_results_footer()
+
+
+class QueryRunsWriter(ResultWriter):
+    """
+    Writes the results of a batch search (tagged with "query") to a store, which keeps the searches
+    apart (like SQLiteResultWriter), with a separate writer - a separate run - per query
+    """
+
+    def __init__(self, headers, open_writer):
+        """
+        :param headers: keys of the result objects to write
+        :param open_writer: a function, which takes a query, and returns a ResultWriter for its results, or None
+        """
+        super().__init__(headers)
+        self._open_writer = open_writer
+        self._writers = {}
+
+    def _write(self, row):
+        if row["query"] not in self._writers:
+            self._writers[row["query"]] = self._open_writer(row["query"])
+        writer = self._writers[row["query"]]
+        if writer:
+            writer.write(row)
+
+    def close(self):
+        for writer in self._writers.values():
+            if writer:
+                writer.close()
+        self._writers = {}
 
 
 class ResultsHandler:
+    """
+    Writers of the result files are registered by the file extension. A writer can also be declared with
+    the module, which registers it: the module is only imported when a file with its extension is written
+    (e.g. the SQLite result store, which pulls the sqlite3 module and the command line interface to query it)
+    """
+
+    file_writers = {
+        ".csv": CsvResultWriter,
+        ".json": JsonResultWriter,
+        ".jsonl": JsonLinesResultWriter
+    }
+    declared_file_writers = {       # Расширение -> модуль, еще не загруженный
+        ".sqlite": "search.resultstore",
+        ".db": "search.resultstore",
+    }
 
     @classmethod
-    def get_headers(cls, verbose=False):
+    def get_headers(cls, verbose=False, tagged=False):
+        """
+        :param verbose: whether to include extended search information
+        :param tagged: whether to include the query of the result (for batch searches)
+        :return: a tuple of keys of the result objects
+        """
+        query = ("query",) if tagged else ()
         if verbose:
-            return "index", "url", "text", "rec.depth", "parent_url"
+            return (*query, "index", "url", "text", "rec.depth", "parent_url", "engines")
         else:
-            return "index", "url", "text"
+            return (*query, "index", "url", "text")
+
+    @classmethod
+    def _format_value(cls, value):
+        return ", ".join(value) if isinstance(value, list) else value
+
+    @classmethod
+    def get_row_values(cls, row, headers):
+        return [cls._format_value(row[prop]) for prop in headers]
 
     @classmethod
     def _get_tabular_data(cls, search_data, headers):
         return {
             'headers': headers,
-            'data': [[row[prop] for prop in headers] for row in search_data]
+            'data': [cls.get_row_values(row, headers) for row in search_data]
         }
 
     @classmethod
-    def _console_print(cls, search_data, headers):
+    def _print_results_header(cls):
         print("\n\n*************                THE RESULTS                     *************\n\n")
 
+    @classmethod
+    def _print_results_footer(cls):
+        print("\n******************************************************************************\n")
+
+    @classmethod
+    def _print_no_results(cls):
+        print("\n                             NO RESULTS FOUND                    \n")
+
+    @classmethod
+    def _print_row(cls, row, headers):
+        prefix = f"[{row['query']}] " if "query" in headers else ""
+        print(f"{prefix}{row['index']}. {row['url']}")
+        print(f"\t{row['text']}")
+        if 'parent_url' in headers and "rec.depth" in headers:
+            rec_depth = row['rec.depth']
+            print(f"\tRecursion depth: {rec_depth}")
+            if rec_depth:
+                print(f"\tParent URL: {row['parent_url']}")
+        if 'engines' in headers:
+            print(f"\tSearch engines: {cls._format_value(row['engines'])}")
+
+    @classmethod
+    def _console_print(cls, search_data, headers):
+        cls._print_results_header()
+
         if not search_data:
-            print("\n                             NO RESULTS FOUND                    \n")
+            cls._print_no_results()
         else:
             max_url_length = max([len(row['url']) for row in search_data])
             if max_url_length <= MAX_LINK_LENGTH_FOR_TABLE:
+                from tabulate import tabulate
                 print(tabulate(
                     cls._get_tabular_data(search_data, headers)["data"],
                     headers=[HEADERS_TRANSLATION[h] for h in headers]
                 ))
             else:
                 for row in search_data:
-                    print(f"{row['index']}. {row['url']}")
-                    print(f"\t{row['text']}")
-                    if 'parent_url' in headers and "rec.depth" in headers:
-                        rec_depth = row['rec.depth']
-                        print(f"\tRecursion depth: {rec_depth}")
-                        if rec_depth:
-                            print(f"\tParent URL: {row['parent_url']}")
+                    cls._print_row(row, headers)
 
-        print("\n******************************************************************************\n")
+        cls._print_results_footer()
 
     @classmethod
     def console_print(cls, search_data, verbose=False):
         headers = cls.get_headers(verbose=verbose)
         cls._console_print(search_data, headers)
 
+    @classmethod
+    def console_writer(cls, verbose=False, stream=False, tagged=False):
+        """
+        :param verbose: whether to print extended search information
+        :param stream: whether to print each result as soon as it is found, or all results
+        in a table at the end
+        :param tagged: whether to print the query of each result (for batch searches)
+        :return: ResultWriter, printing to console
+        """
+        headers = cls.get_headers(verbose=verbose, tagged=tagged)
+        return ConsoleStreamWriter(headers) if stream else ConsoleTableWriter(headers)
+
     @classmethod
     def openwrite(cls, path):
         try:
-            f = open(path, mode='w', encoding='utf8')
+            if path.endswith(".gz"):
+                f = gzip.open(path, mode='wt', encoding='utf8')
+            else:
+                f = open(path, mode='w', encoding='utf8')
         except OSError:
             SearchLogger.get_logger().error(
                 f"Error opening file {path} for writing. Search results could not be saved"
@@ -73,43 +331,97 @@ class ResultsHandler:
         return f
 
     @classmethod
-    def save_to_csv(cls, search_data, path, verbose=False):
-        f = cls.openwrite(path)
-        if not f:
-            return
-        headers = cls.get_headers(verbose=verbose)
-        with f:
-            writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_NONNUMERIC)
-            writer.writerow(headers)
-            for row in cls._get_tabular_data(search_data, headers)['data']:
-                writer.writerow(row)
-        SearchLogger.get_logger().info(f"Search results written to {path}", force_console_print=True)
+    def register_file_writer(cls, ext, writer_class):
+        """
+        :param ext: file extension, e.g. ".csv"
+        :param writer_class: a class with the same open() class method as FileResultWriter
+        """
+        cls.file_writers[ext] = writer_class
+        cls.declared_file_writers.pop(ext, None)
+
+    @classmethod
+    def declare_file_writer(cls, ext, module):
+        """
+        Declares a writer, without importing it
+        :param ext: file extension, e.g. ".sqlite"
+        :param module: full name of the module, which registers the writer for <ext> when imported
+        """
+        cls.declared_file_writers[ext] = module
+
+    @classmethod
+    def _load_declared_writer(cls, path):
+        """
+        Imports the module of the declared writer for the path, if any
+        """
+        for ext, module in list(cls.declared_file_writers.items()):
+            if path.endswith(ext) or path.endswith(f"{ext}.gz"):
+                importlib.import_module(module)
+
+    @classmethod
+    def supported_extensions(cls):
+        return [
+            f"{ext}{compression}"
+            for ext, writer_class in cls.file_writers.items()
+            for compression in (("", ".gz") if writer_class.compressible else ("",))
+        ] + list(cls.declared_file_writers)
+
+    @classmethod
+    def file_writer(cls, path, verbose=False, writer_class=None, run_info=None, tagged=False):
+        """
+        :param path: path to the file. The format is defined by the extension: .csv, .json
+        or .jsonl, optionally followed by .gz for a gzip-compressed file, or .sqlite / .db
+        for a database of results of many searches (see resultstore.py)
+        :param verbose: whether to write extended search information
+        :param writer_class: FileResultWriter subclass to use, regardless of the extension
+        :param run_info: optional dict with the search parameters, stored by writers which support it
+        :param tagged: whether the results are tagged with their queries (for batch searches). Writers
+        which keep the searches apart (keeps_runs) get a separate run per query, others - the "query" column
+        :return: ResultWriter, or None if the format is not supported or the file could not be opened
+        """
+        if not writer_class:
+            cls._load_declared_writer(path)
+            writer_class = next(
+                (
+                    writer for ext, writer in cls.file_writers.items()
+                    if path.endswith(ext) or (writer.compressible and path.endswith(f"{ext}.gz"))
+                ),
+                None
+            )
+        if not writer_class:
+            SearchLogger.get_logger().error(
+                f"Unsupported results file format: {path}. "
+                f"Supported extensions: {', '.join(cls.supported_extensions())}"
+            )
+            return None
+        if tagged and writer_class.keeps_runs:
+            return QueryRunsWriter(
+                cls.get_headers(verbose=verbose, tagged=True),
+                lambda query: writer_class.open(path, cls.get_headers(verbose=verbose), run_info={
+                    **(run_info or {}), "query": query
+                })
+            )
+        return writer_class.open(path, cls.get_headers(verbose=verbose, tagged=tagged), run_info=run_info)
+
+    @classmethod
+    def _save(cls, search_data, path, verbose=False, writer_class=None, run_info=None):
+        writer = cls.file_writer(path, verbose=verbose, writer_class=writer_class, run_info=run_info)
+        if not writer:
+            return None
+        with writer:
+            for row in search_data:
+                writer.write(row)
         return True
 
+    @classmethod
+    def save_to_csv(cls, search_data, path, verbose=False):
+        return cls._save(search_data, path, verbose=verbose, writer_class=CsvResultWriter)
+
     @classmethod
     def save_to_json(cls, search_data, path, verbose=False):
-        f = cls.openwrite(path)
-        if not f:
-            return
-        headers = cls.get_headers(verbose=verbose)
-        filtered_data = [
-            {key: row[key] for key in headers}
-            for row in search_data
-        ]
-        with f:
-            json.dump(filtered_data, f, indent=4, ensure_ascii=False)
-        SearchLogger.get_logger().info(f"Search results written to {path}", force_console_print=True)
-        return True
+        return cls._save(search_data, path, verbose=verbose, writer_class=JsonResultWriter)
 
     @classmethod
-    def save_results(cls, search_data, path, verbose=False):
+    def save_results(cls, search_data, path, verbose=False, run_info=None):
         if not path:
             return None
-        methods = {
-            ".csv": cls.save_to_csv,
-            ".json": cls.save_to_json
-        }
-        for ext, method in methods.items():
-            if path.endswith(ext):
-                return method(search_data, path, verbose=verbose)
-        return None
+        return cls._save(search_data, path, verbose=verbose, run_info=run_info)
@@ -0,0 +1,351 @@
+import datetime
+import json
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+import click
+from tabulate import tabulate
+from .logger import SearchLogger
+from .results import ResultWriter, ResultsHandler
+
+
+INSERT_BATCH_SIZE = 500     # Max number of results inserted in one transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    query_id INTEGER NOT NULL REFERENCES queries (id),
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    engines TEXT,
+    parameters TEXT,
+    results_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    text TEXT,
+    depth INTEGER,
+    parent_url TEXT,
+    engines TEXT,
+    search_page INTEGER,
+    PRIMARY KEY (run_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_query ON runs (query_id, started_at);
+CREATE INDEX IF NOT EXISTS results_url ON results (url);
+"""
+
+
+def normalize_query(query):
+    """
+    Queries which differ only in case and spacing are stored as one query
+    :param query: search query string
+    :return: a string
+    """
+    return " ".join(query.lower().split())
+
+
+def connect(path):
+    """
+    Opens (creating, if needed) a result store database
+    :param path: path to the database file
+    :return: sqlite3.Connection
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def connect_read_only(path):
+    """
+    Opens an existing result store database for queries. Unlike connect(), neither creates
+    the file, nor changes it
+    :param path: path to the database file
+    :return: sqlite3.Connection
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Result store database {path} does not exist")
+    # Режим ro задаётся только через URI; as_uri() экранирует спецсимволы пути
+    connection = sqlite3.connect(
+        f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False
+    )
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not {"queries", "runs", "results"} <= tables:
+        connection.close()
+        raise ValueError(f"{path} is not a result store database")
+    return connection
+
+
+class SQLiteResultWriter(ResultWriter):
+    """
+    Writes search results into a SQLite database, which keeps the results of many searches
+    (runs), and allows to query them (see ResultStore). All fields of the results are stored,
+    regardless of the verbose mode.
+
+    The results are inserted by a background thread, in batches of up to INSERT_BATCH_SIZE
+    results per transaction, so that the search never waits for the database.
+    """
+
+    compressible = False
+    keeps_runs = True
+
+    @classmethod
+    def open(cls, path, headers, run_info=None):
+        """
+        :param path: path to the database file
+        :param headers: keys of the result objects to write. Not used: all keys are stored
+        :param run_info: optional dict with the search parameters: "query", "engines", and any others
+        :return: the writer, or None if the database could not be opened
+        """
+        try:
+            connection = connect(path)
+        except sqlite3.Error as e:
+            SearchLogger.get_logger().error(
+                f"Error opening database {path}: {e}. Search results could not be saved"
+            )
+            return None
+        return cls(connection, path, headers, run_info=run_info)
+
+    def __init__(self, connection, path, headers, run_info=None):
+        super().__init__(headers)
+        self.path = path
+        self._connection = connection
+        self._rows = queue.Queue()
+        self._failed = False
+        self.run_id = self._start_run(dict(run_info or {}))
+        self._thread = threading.Thread(target=self._run, name="result-store-writer", daemon=True)
+        self._thread.start()
+
+    def _start_run(self, run_info):
+        query = normalize_query(run_info.pop("query", ""))
+        engines = run_info.pop("engines", [])
+        with self._connection:
+            self._connection.execute("INSERT OR IGNORE INTO queries (text) VALUES (?)", (query,))
+            cursor = self._connection.execute(
+                "INSERT INTO runs (query_id, started_at, engines, parameters) "
+                "VALUES ((SELECT id FROM queries WHERE text = ?), ?, ?, ?)",
+                (query, time.time(), ",".join(engines), json.dumps(run_info, ensure_ascii=False))
+            )
+        return cursor.lastrowid
+
+    def _write(self, row):
+        self._rows.put(row)
+
+    def _run(self):
+        batch = []
+        while True:
+            row = self._rows.get()
+            if row is not None:
+                batch.append(row)
+            # Пишем накопленное, когда очередь опустела, или набралась полная порция
+            if batch and (row is None or len(batch) >= INSERT_BATCH_SIZE or self._rows.empty()):
+                self._insert(batch)
+                batch = []
+            if row is None:
+                break
+
+    def _insert(self, batch):
+        if self._failed:
+            return
+        try:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO results "
+                    "(run_id, position, url, text, depth, parent_url, engines, search_page) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            self.run_id, row["index"], row["url"], row.get("text"), row.get("rec.depth"),
+                            row.get("parent_url"), ",".join(row.get("engines") or []), row.get("search_page")
+                        )
+                        for row in batch
+                    ]
+                )
+        except sqlite3.Error as e:
+            # Поиск не должен останавливаться из-за ошибки записи в базу
+            self._failed = True
+            SearchLogger.get_logger().error(f"Error writing search results to {self.path}: {e}")
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        self._rows.put(None)
+        self._thread.join()
+        with self._connection:
+            self._connection.execute(
+                "UPDATE runs SET finished_at = ?, results_count = ? WHERE id = ?",
+                (time.time(), self.count, self.run_id)
+            )
+        self._connection.close()
+        SearchLogger.get_logger().info(
+            f"{self.count} search results written to {self.path} (run {self.run_id})", force_console_print=True
+        )
+
+
+ResultsHandler.register_file_writer(".sqlite", SQLiteResultWriter)
+ResultsHandler.register_file_writer(".db", SQLiteResultWriter)
+
+
+class ResultStore:
+    """
+    Read access to a database written by SQLiteResultWriter. The database is opened read-only,
+    so the file must exist
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the database file
+        :raises FileNotFoundError: if there is no such file
+        :raises ValueError: if the file is not a result store database
+        """
+        self.path = path
+        self._connection = connect_read_only(path)
+        self._connection.row_factory = sqlite3.Row
+
+    def runs(self, query=None):
+        """
+        :param query: optional query, to list the runs of this query only
+        :return: a list of dicts, describing the runs, latest first
+        """
+        sql = (
+            "SELECT runs.id, queries.text AS query, runs.started_at, runs.finished_at, runs.engines, "
+            "runs.results_count, runs.parameters FROM runs JOIN queries ON queries.id = runs.query_id"
+        )
+        params = ()
+        if query is not None:
+            sql += " WHERE queries.text = ?"
+            params = (normalize_query(query),)
+        return [dict(row) for row in self._connection.execute(f"{sql} ORDER BY runs.id DESC", params)]
+
+    def query_urls(self, query, since=None):
+        """
+        :param query: search query
+        :param since: optional unix time, to only look at runs started after it
+        :return: a list of dicts, describing the urls found for the query, by number of runs
+        which found them
+        """
+        return [dict(row) for row in self._connection.execute(
+            "SELECT results.url, COUNT(DISTINCT runs.id) AS runs, MIN(runs.started_at) AS first_seen, "
+            "MAX(runs.started_at) AS last_seen, MIN(results.depth) AS min_depth "
+            "FROM queries JOIN runs ON runs.query_id = queries.id JOIN results ON results.run_id = runs.id "
+            "WHERE queries.text = ? AND runs.started_at >= ? "
+            "GROUP BY results.url ORDER BY runs DESC, first_seen, results.url",
+            (normalize_query(query), since or 0)
+        )]
+
+    def run_results(self, run_id):
+        """
+        :param run_id: id of the run
+        :return: a generator of the results of the run, in the same format as returned by the search
+        """
+        for row in self._connection.execute(
+                "SELECT * FROM results WHERE run_id = ? ORDER BY position", (run_id,)
+        ):
+            yield {
+                "index": row["position"],
+                "url": row["url"],
+                "text": row["text"],
+                "rec.depth": row["depth"],
+                "parent_url": row["parent_url"],
+                "search_page": row["search_page"],
+                "engines": row["engines"].split(",") if row["engines"] else []
+            }
+
+    def close(self):
+        self._connection.close()
+
+
+def open_store(database):
+    """
+    Opens the result store for a CLI command, reporting the errors as click errors
+    :param database: path to the database file
+    :return: ResultStore
+    """
+    try:
+        return ResultStore(database)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        raise click.ClickException(str(e))
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else ""
+
+
+@click.group()
+def cli():
+    """
+    Queries and exports the search results, saved to a .sqlite / .db file (with --resultpath)
+    """
+    SearchLogger.init_logger(path=None, log_to_console=True, level="warning")
+
+
+@cli.command()
+@click.argument("database", type=click.Path(exists=True, dir_okay=False))
+@click.option("--query", default=None, help="Only list the runs of this query")
+def runs(database, query):
+    """
+    Lists the saved search runs
+    """
+    store = open_store(database)
+    rows = [
+        [
+            run["id"], run["query"], format_time(run["started_at"]), format_time(run["finished_at"]),
+            run["engines"], run["results_count"]
+        ]
+        for run in store.runs(query=query)
+    ]
+    store.close()
+    print(tabulate(rows, headers=["Run", "Query", "Started", "Finished", "Engines", "Results"]))
+
+
+@cli.command()
+@click.argument("database", type=click.Path(exists=True, dir_okay=False))
+@click.argument("query")
+@click.option("--days", default=None, type=float, help="Only look at the runs of the last <days> days")
+def urls(database, query, days):
+    """
+    Lists the urls already found for QUERY
+    """
+    store = open_store(database)
+    since = time.time() - days * 24 * 60 * 60 if days is not None else None
+    rows = [
+        [row["url"], row["runs"], format_time(row["first_seen"]), format_time(row["last_seen"]), row["min_depth"]]
+        for row in store.query_urls(query, since=since)
+    ]
+    store.close()
+    print(tabulate(rows, headers=["url", "Runs", "First seen", "Last seen", "Min depth"]))
+
+
+@cli.command()
+@click.argument("database", type=click.Path(exists=True, dir_okay=False))
+@click.argument("run_id", type=int)
+@click.argument("path")
+@click.option(
+    "--verbose/--brief",
+    default=False,
+    help="Whether or not (default) to export extended search information"
+)
+def export(database, run_id, path, verbose):
+    """
+    Exports the results of the run RUN_ID to PATH (.csv, .json, .jsonl, optionally with .gz)
+    """
+    store = open_store(database)
+    ResultsHandler.save_results(store.run_results(run_id), path, verbose=verbose)
+    store.close()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,129 @@
+"""
+Starting a search: the parts shared by the command line interface and the search service
+"""
+from .driverregistry import SEDriverRegistry
+from .logger import SearchLogger
+from .parsers import ParserRegistry
+from .contentfilter import ContentFilter
+from .sessions import HttpSessionPool
+from .cache import ResponseCache
+from .warc import WarcReplay
+from .visited import VisitedStoreRegistry, DEFAULT_VISITED_STORE, DEFAULT_BLOOM_ERROR_RATE
+from .frontier import DEFAULT_CRAWL_STRATEGY, DEFAULT_FRONTIER_MEMORY
+from .sessions import DEFAULT_CONCURRENCY
+
+
+DEFAULT_MAX_RESULTS = 30
+DEFAULT_MAX_RECURSION_DEPTH = 5
+DEFAULT_SEARCH_ENGINE = "google"
+DEFAULT_SEARCH_MODE = "all"
+DEFAULT_CRAWLER = "sync"
+DEFAULT_PREFETCH_FLAG = True
+DEFAULT_BATCH_WORKERS = 4         # Worker processes of a batch search (see batch.py)
+DEFAULT_SHARDS = 0                # Shards of a distributed crawl (see distributed.py). 0 - crawl in one process
+DEFAULT_COORDINATOR = "sqlite"
+
+ALL_ENGINES = "all"
+SUPPORTED_SEARCH_MODES = ('any', 'all')
+SUPPORTED_CRAWLERS = ('sync', 'async')
+SUPPORTED_COORDINATORS = ('sqlite', 'socket')     # See CoordinatorRegistry
+
+
+def engine_names(engines):
+    """
+    :param engines: names of search engines, possibly with ALL_ENGINES among them
+    :return: a list of distinct names of registered search engine drivers
+    """
+    if ALL_ENGINES in engines:
+        return SEDriverRegistry.registered_drivers_names()
+    return list(dict.fromkeys(engines))
+
+
+def get_extractor(engines):
+    """
+    :param engines: a list of names of registered search engine drivers
+    :return: the driver class of the engine, if only one is given, or a driver, which queries all of them
+    """
+    if len(engines) == 1:
+        return SEDriverRegistry.get_driver(engines[0])
+    from .metasearch import MetaSearchLinkExtractor
+    return MetaSearchLinkExtractor.for_engines(engines)
+
+
+def init_process(settings, log_records=None):
+    """
+    Applies the settings, given in the command line, to a new worker process. The workers are started
+    fresh (spawn), so the settings have to be applied again
+    :param settings: a dict with logpath, loglevel, log_sample, parser, max_page_size, pool_size, pool_per_host,
+    cache, cache_path, cache_ttl, cache_size, cache_refresh and replay_path
+    :param log_records: queue from SearchLogger.worker_records() of the parent process, to send the log
+    records to. Without it, the process writes its own log to logpath
+    """
+    SearchLogger.init_logger(
+        path=settings["logpath"], log_to_console=False, level=settings["loglevel"], sample_every=settings["log_sample"],
+        records=log_records
+    )
+    ParserRegistry.set_default(settings["parser"])
+    ContentFilter.init_filter(max_page_size=settings["max_page_size"])
+    HttpSessionPool.init_pool(pool_size=settings["pool_size"], pool_per_host=settings["pool_per_host"])
+    if settings["cache"]:
+        ResponseCache.init_cache(
+            path=settings["cache_path"], ttl=settings["cache_ttl"], max_size=settings["cache_size"],
+            refresh=settings["cache_refresh"]
+        )
+    if settings["replay_path"]:
+        WarcReplay.init_replay(settings["replay_path"])
+
+
+def search_results(
+        extractor,
+        query,
+        limit=DEFAULT_MAX_RESULTS,
+        mode=DEFAULT_SEARCH_MODE,
+        depth_limit=DEFAULT_MAX_RECURSION_DEPTH,
+        crawler=DEFAULT_CRAWLER,
+        concurrency=DEFAULT_CONCURRENCY,
+        strategy=DEFAULT_CRAWL_STRATEGY,
+        frontier_memory=DEFAULT_FRONTIER_MEMORY,
+        visited=DEFAULT_VISITED_STORE,
+        bloom_error_rate=DEFAULT_BLOOM_ERROR_RATE,
+        prefetch=DEFAULT_PREFETCH_FLAG,
+        checkpoint=None,
+        resume=False
+):
+    """
+    Starts the recursive search with the given crawler. Each search gets its own visited urls store,
+    while the connection pool, response cache and the schedulers of the drivers are shared
+    :param extractor: driver class (see get_extractor())
+    :param query: the search query
+    :param visited: name of the visited urls store
+    :param checkpoint: CrawlCheckpoint, or None. Only used by the sync crawler
+    :param resume: whether to continue the search from the checkpoint
+    :return: a generator of the results
+    """
+    visited_store = VisitedStoreRegistry.create(
+        visited, expected_items=limit, **({"error_rate": bloom_error_rate} if visited == "bloom" else {})
+    )
+    if crawler == "async":
+        from .asyncsearch import iterate
+        return iterate(extractor.async_recursive_link_generator(
+            query,
+            limit=limit,
+            search_mode=mode,
+            depth_limit=depth_limit,
+            concurrency=concurrency,
+            visited=visited_store,
+            prefetch=prefetch
+        ))
+    return extractor.recursive_link_generator(
+        query,
+        limit=limit,
+        search_mode=mode,
+        depth_limit=depth_limit,
+        visited=visited_store,
+        checkpoint=checkpoint,
+        resume=resume,
+        strategy=strategy,
+        frontier_memory=frontier_memory,
+        prefetch=prefetch
+    )
@@ -0,0 +1,137 @@
+import threading
+import time
+from urllib.parse import urlparse
+from .logger import SearchLogger
+from .searchutils import randomize_delay
+from .metrics import CrawlMetrics
+
+
+class HostScheduler:
+    """
+    Politeness scheduler, which keeps a minimal (randomized) interval between two
+    consecutive requests to the same host (netloc). Requests to different hosts
+    are not delayed with respect to each other. Thread-safe.
+    """
+
+    def __init__(self, default_interval=0, intervals=None):
+        """
+        :param default_interval: base interval in seconds between requests to the same host
+        :param intervals: a dict {netloc: interval}, with host-specific intervals
+        """
+        self.default_interval = default_interval
+        self._intervals = dict(intervals or {})
+        self._next_slots = {}
+        self._lock = threading.Lock()
+
+    def set_interval(self, netloc, interval):
+        with self._lock:
+            self._intervals[netloc] = interval
+
+    def get_interval(self, netloc):
+        return self._intervals.get(netloc, self.default_interval)
+
+    def reserve(self, url):
+        """
+        Reserves the next free time slot for a request to the host of <url>
+        :param url: string url
+        :return: number of seconds to wait before sending the request
+        """
+        netloc = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slots.get(netloc, now))
+            self._next_slots[netloc] = slot + randomize_delay(self.get_interval(netloc))
+        return slot - now
+
+    def wait(self, url):
+        """
+        Blocks until a request to the host of <url> can be sent
+        :param url: string url
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            SearchLogger.get_logger().info("Going to sleep for %s seconds...", delay, sample="sleeps")
+            time.sleep(delay)
+            metrics = CrawlMetrics.get_metrics()
+            if metrics:
+                metrics.observe("sleep_seconds", delay, host=urlparse(url).netloc)
+
+
+class SharedSchedulers:
+    """
+    Host schedulers shared by several processes, e.g. by the workers of a batch search (see batch.py).
+    An instance lives in a multiprocessing manager process, and keeps a HostScheduler per name
+    (driver class). The other processes use it through a proxy, enabled with init_shared(): then
+    create_scheduler() returns schedulers, which reserve their time slots here, so that the delays
+    between requests to a host hold for all the processes together. Thread-safe.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_shared(cls):
+        """
+        :return: proxy of the shared schedulers, or None if the schedulers are not shared
+        """
+        return cls._instance
+
+    @classmethod
+    def init_shared(cls, proxy):
+        """
+        :param proxy: a multiprocessing manager proxy of a SharedSchedulers instance
+        """
+        cls._instance = proxy
+
+    def __init__(self):
+        self._schedulers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, name, default_interval=0, intervals=None):
+        """
+        Creates the scheduler <name>, unless it has already been created by another process
+        """
+        with self._lock:
+            if name not in self._schedulers:
+                self._schedulers[name] = HostScheduler(default_interval=default_interval, intervals=intervals)
+
+    def set_interval(self, name, netloc, interval):
+        self._schedulers[name].set_interval(netloc, interval)
+
+    def reserve(self, name, url):
+        return self._schedulers[name].reserve(url)
+
+
+class SharedHostScheduler(HostScheduler):
+    """
+    HostScheduler, which reserves the time slots in SharedSchedulers (through a proxy)
+    """
+
+    def __init__(self, shared, name, default_interval=0, intervals=None):
+        """
+        :param shared: proxy of SharedSchedulers
+        :param name: name of the scheduler, the same in all the processes
+        """
+        super().__init__(default_interval=default_interval, intervals=intervals)
+        self.name = name
+        self._shared = shared
+        shared.configure(name, default_interval, self._intervals)
+
+    def set_interval(self, netloc, interval):
+        super().set_interval(netloc, interval)
+        self._shared.set_interval(self.name, netloc, interval)
+
+    def reserve(self, url):
+        return self._shared.reserve(self.name, url)
+
+
+def create_scheduler(name, default_interval=0, intervals=None):
+    """
+    :param name: name of the scheduler, e.g. of the driver class, which uses it
+    :param default_interval: base interval in seconds between requests to the same host
+    :param intervals: a dict {netloc: interval}, with host-specific intervals
+    :return: HostScheduler, shared with other processes if SharedSchedulers is enabled
+    """
+    shared = SharedSchedulers.get_shared()
+    if shared:
+        return SharedHostScheduler(shared, name, default_interval=default_interval, intervals=intervals)
+    return HostScheduler(default_interval=default_interval, intervals=intervals)
@@ -1,32 +1,148 @@
-import requests.exceptions
 from urllib.parse import urlparse, urlunparse
-from bs4 import BeautifulSoup
 import random
 import time
 from .logger import SearchLogger
+from .sessions import HttpSessionPool
+from .cache import ResponseCache, UrlClaims
+from .parsers import ParserRegistry
+from .parsepool import ParsePool
+from .contentfilter import ContentFilter
+from .querymatcher import get_matcher
+from .metrics import CrawlMetrics
+from .warc import WarcWriter, WarcReplay
 
 
-def read_web_page(url):
+NON_HTML_EXTENSIONS = (
+    ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".rar", ".7z", ".tar", ".exe", ".msi", ".dmg", ".iso", ".apk",
+    ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".ico", ".mp3", ".mp4", ".avi", ".mov", ".mkv", ".webm",
+    ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".csv", ".json", ".xml", ".css", ".js",
+)
+MATCH_BATCH_SIZE = 32   # Number of page links matched against the query in one pass
+
+
+def read_web_page(url, scheduler=None, search_page=None):
     """
-    Sends an HTTP request given the url, and returns the body of the response as a text (string), or None
+    Sends an HTTP request given the url, and returns the body of the response as a text (string), or None.
+    The request goes through the shared HttpSessionPool. If the ResponseCache is enabled, fresh cached
+    responses are returned without any network request (and without waiting on the scheduler), and
+    stale ones are revalidated with a conditional request. If UrlClaims is enabled (batch search), a url
+    fetched by another process is taken from the cache. The response is streamed, and only HTML
+    pages are read, up to the size limit of the ContentFilter. Hosts blocked by the ContentFilter are not
+    requested, except for search engine result pages.
+    If WarcWriter is enabled, the pages read are archived. If WarcReplay is enabled, pages are only
+    taken from the archive, without any requests.
     :param url: string url
+    :param scheduler: optional HostScheduler, to wait for a free slot for the url's host before the request
+    :param search_page: for search engine result pages, a pair (engine name, page number)
     :return: string or None
     """
-    headers = {
-        "User-Agent":
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0.2526.106 Safari/537.36"
-    }
-    try:
-        response = requests.get(url, headers=headers)
-    except (requests.exceptions.RequestException, requests.ConnectionError):
-        SearchLogger.get_logger().warning(f"Error reading the url: {url}. \n")
+    metrics = CrawlMetrics.get_metrics()
+    replay = WarcReplay.get_replay()
+    if replay:
+        text = replay.lookup(url, search_page=search_page)
+        if metrics:
+            metrics.inc("responses_total", host=urlparse(url).netloc, status="replayed" if text else "not_archived")
+    else:
+        text = _fetch_web_page(url, scheduler, metrics, search_page)
+    archive = WarcWriter.get_writer()
+    if archive and text:
+        archive.write_response(url, text, search_page=search_page)
+    return text
+
+
+def page_needs_request(url):
+    """
+    Checks whether read_web_page() would send a request for the url. It does not, if WarcReplay is
+    enabled, if the ResponseCache has a fresh response, or if the host is blocked. Used by the async
+    crawler, to wait for the host's time slot only for the pages, which are actually requested
+    :param url: string url
+    :return: True or False
+    """
+    if WarcReplay.get_replay():
+        return False
+    if ContentFilter.get_filter().is_blocked_host(url):
+        return False
+    cache = ResponseCache.get_cache()
+    return not (cache and cache.is_fresh(url))
+
+
+def _fetch_web_page(url, scheduler, metrics, search_page):
+    content_filter = ContentFilter.get_filter()
+    # Страницы поиска запрашиваются всегда: хост поисковика не блокируется из-за ссылок на нем на не-HTML файлы
+    if not search_page and content_filter.is_blocked_host(url):
         return None
-    if response.status_code != 200:
-        SearchLogger.get_logger().warning(
-            f"Bad response from the server for url {url}. Response code: {response.status_code}"
+    cache = ResponseCache.get_cache()
+    cached = cache.lookup(url) if cache else None
+    if cached and cached.fresh:
+        if metrics:
+            metrics.inc("responses_total", host=urlparse(url).netloc, status="cached")
+        return cached.text
+    claims = UrlClaims.get_claims() if cache else None
+    if not claims:
+        return _request_web_page(url, scheduler, metrics, content_filter, cache, cached)
+    if not claims.claim(url):
+        # Страницу уже прочитал другой процесс пакетного поиска: она в общем кэше, если это была HTML страница
+        return _shared_web_page(url, cache, metrics)
+    try:
+        if cache.is_fresh(url):
+            # Другой процесс сохранил страницу и снял заявку между поиском в кэше и claim()
+            return _shared_web_page(url, cache, metrics)
+        return _request_web_page(url, scheduler, metrics, content_filter, cache, cached)
+    finally:
+        claims.release(url, stored=cache.is_fresh(url))
+
+
+def _shared_web_page(url, cache, metrics):
+    if metrics:
+        metrics.inc("responses_total", host=urlparse(url).netloc, status="shared")
+    cached = cache.lookup(url)
+    return cached.text if cached else None
+
+
+def _request_web_page(url, scheduler, metrics, content_filter, cache, cached):
+    import requests     # Imported on first use, to keep the CLI startup fast
+    if scheduler:
+        scheduler.wait(url)
+    status = "error"
+    start = time.perf_counter() if metrics else None
+    try:
+        response = HttpSessionPool.get_pool().get(
+            url, headers=ResponseCache.revalidation_headers(cached) if cached else None, stream=True
         )
+        status = response.status_code
+        with response:
+            if response.status_code == 304 and cached:
+                cache.mark_revalidated(url)
+                return cached.text
+            if response.status_code != 200:
+                SearchLogger.get_logger().warning(
+                    "Bad response from the server for url %s. Response code: %s", url, response.status_code
+                )
+                return None
+            if not content_filter.accepts(url, response.headers):
+                status = "skipped"
+                return None
+            text = content_filter.read_text(url, response)
+    except (requests.exceptions.RequestException, requests.ConnectionError):
+        SearchLogger.get_logger().warning("Error reading the url: %s. \n", url)
         return None
-    return response.text
+    finally:
+        if metrics:
+            _record_fetch(metrics, url, start, status)
+    if cache:
+        _store_response(cache, url, text, response)
+    return text
+
+
+def _record_fetch(metrics, url, start, status):
+    host = urlparse(url).netloc
+    metrics.observe("fetch_seconds", time.perf_counter() - start, host=host)
+    metrics.inc("responses_total", host=host, status=status)
+
+
+def _store_response(cache, url, text, response):
+    if "no-store" not in response.headers.get("Cache-Control", ""):
+        cache.store(url, text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
 
 
 def link_is_valid(link_info, query_words, mode="all"):
@@ -40,34 +156,19 @@ def link_is_valid(link_info, query_words, mode="all"):
     either url or text. If <mode> is "any", will return True if any of the query
     words are be present in either url or text.
     """
-    if not link_info["url"].startswith("http"):
-        return False
-    if mode == "all":
-        combiner = all
-    elif mode == "any":
-        combiner = any
-    else:
-        combiner = all
-
-    result = combiner(
-        [
-            word in link_info["url"] or link_info["text"] and word in link_info["text"].lower()
-            for word in query_words
-        ]
-    )
-    return result
+    return get_matcher(query_words, mode).is_valid(link_info)
 
 
 def link_is_valid_for_recursion(link_info):
     """
-    Make sure we don't try to read files like .pdf, etc
+    Make sure we don't try to read files like .pdf, etc, or pages on hosts which are known
+    to serve non-HTML content. Responses are also checked by their Content-Type, when read
     :param link_info:
     :return: True or False
     """
-    # TODO: improve this check to make it more robust
-    if link_info["url"].endswith(".pdf") or link_info["url"].endswith(".zip"):
+    if urlparse(link_info["url"]).path.lower().endswith(NON_HTML_EXTENSIONS):
         return False
-    return True
+    return not ContentFilter.get_filter().is_blocked_host(link_info["url"])
 
 
 def to_canonical_url(url):
@@ -92,31 +193,74 @@ def page_links(page_contents):
     """
     Collects links from parsed web page
     :param page_contents: text (string)
-    :return: a list of dicts with keys 'url' and 'text'
+    :return: a generator of dicts with keys 'url' and 'text'
     """
-    soup = BeautifulSoup(page_contents, 'lxml')
-    return [
-        {
+    parser = ParserRegistry.get_parser()
+    for link_elem in parser.anchors(page_contents):
+        yield {
             'url': to_canonical_url(link_elem.get("href")),
-            'text': link_elem.getText()
-        } for link_elem in soup.select("a")
-    ]
+            'text': parser.text(link_elem)
+        }
 
 
-def valid_page_links(page_contents, query_words, mode="all"):
+def valid_page_links(page_contents, query_words, mode="all", exclude=None):
     """
-    Collect valid links from a web page
+    Collect valid links from a web page. This is a lazy pipeline: every anchor is
+    canonicalized, checked against <exclude> and duplicates, and only then gets its
+    text extracted and validated against the query, at the time the caller asks for
+    the next link. So the caller which stops iterating early does not pay for the rest.
     :param page_contents: string, web page contents as text
     :param query_words: a list of query words (strings). Assumed to be in lower case
     :param mode: "any" or "all"
-    :return: filtered list of objects {'url':..., 'text':...}, which are considered
+    :param exclude: optional container of canonical urls to skip (e.g. already visited ones)
+    If ParsePool is enabled, the page is parsed in a worker process instead, as a whole.
+    :return: a generator of objects {'url':..., 'text':...}, which are considered
     valid as search results.
     """
-    return [
-        linfo
-        for linfo in page_links(page_contents)
-        if type(linfo["url"]) == str and link_is_valid(linfo, query_words, mode=mode)
-    ]
+    parse_pool = ParsePool.get_pool()
+    if parse_pool:
+        return parse_pool.valid_page_links(page_contents, query_words, mode=mode, exclude=exclude)
+    return (linfo for linfo, _ in scored_page_links(page_contents, query_words, mode=mode, exclude=exclude))
+
+
+def scored_page_links(page_contents, query_words, mode="all", exclude=None):
+    """
+    Same as valid_page_links(), but also provides the number of query words matched
+    by each link, for ranking. Links are matched against the query in small batches,
+    with the query compiled once per search (see QueryMatcher)
+    :param page_contents: string, web page contents as text
+    :param query_words: a list of query words (strings). Assumed to be in lower case
+    :param mode: "any" or "all"
+    :param exclude: optional container of canonical urls to skip (e.g. already visited ones)
+    :return: a generator of pairs ({'url':..., 'text':...}, number of matched query words)
+    """
+    matcher = get_matcher(query_words, mode)
+    parser = ParserRegistry.get_parser()
+    metrics = CrawlMetrics.get_metrics()
+    anchors = parser.anchors(page_contents)
+    if metrics:
+        anchors = metrics.timed(anchors, "parse_seconds", stage="page")
+    seen = set()
+    batch = []
+    for link_elem in anchors:
+        href = link_elem.get("href")
+        if type(href) != str or not href.startswith("http"):
+            continue
+        url = to_canonical_url(href)
+        if url in seen or (exclude is not None and url in exclude):
+            continue
+        seen.add(url)
+        batch.append({'url': url, 'text': parser.text(link_elem)})
+        if len(batch) == MATCH_BATCH_SIZE:
+            yield from _scored_links(matcher, batch, metrics)
+            batch = []
+    yield from _scored_links(matcher, batch, metrics)
+
+
+def _scored_links(matcher, batch, metrics):
+    if not metrics:
+        return matcher.scored_links(batch)
+    return metrics.timed(matcher.scored_links(batch), "filter_seconds", stage="page")
 
 
 def fix_child_link(parent_url, link):
@@ -145,23 +289,16 @@ def randomize_delay(delay):
     return delay * (1 + random.randrange(10) / 10)
 
 
-def with_delay(delay_func):
+def with_delay(scheduler_func):
     """
-    A decorator for class methods which return generators. Add delays in between
-    calls to yield in a generator, based on a delay function
-    :param delay_func: a function which takes class as a parameter and returns delay value
+    A decorator for class methods which return generators. Passes the host scheduler,
+    returned by <scheduler_func>, to the generator as the <scheduler> keyword argument,
+    so that the requests it makes are spaced according to per-host intervals
+    :param scheduler_func: a function which takes class as a parameter and returns HostScheduler
     :return: generator wrapper
     """
     def inner(generator):
         def generator_wrapper(cls, *args, **kwargs):
-            for item in generator(cls, *args, **kwargs):
-                next_delay = delay_func(cls)
-                start = time.time()
-                yield item
-                end = time.time()
-                time_left = next_delay - (end - start)
-                if time_left > 0:
-                    SearchLogger.get_logger().info(f"Going to sleep for {time_left} seconds...")
-                    time.sleep(time_left)
+            return generator(cls, *args, scheduler=scheduler_func(cls), **kwargs)
         return generator_wrapper
     return inner
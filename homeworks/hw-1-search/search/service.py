@@ -0,0 +1,505 @@
+"""
+Search service: a long running process, which runs searches for other programs over a local HTTP API,
+on a TCP port or a Unix socket. All the searches share the connection pool, the response cache, the
+content filter and the politeness schedulers of the drivers, so the delays between requests to a search
+engine hold for all the clients together, and the drivers, parsers and stop words are loaded only once.
+Each search has its own visited urls.
+
+Start with:
+
+    python -m search.service [--port 8765 | --socket /tmp/websearch.sock]      (or websearch-service)
+
+API:
+
+    POST /search    - runs a search with the parameters from a JSON object in the body:
+                      {"query": ..., "engine": [...], "limit": ..., "mode": ..., ...} (the names of
+                      the command line options). Results are streamed as they are found, as JSON Lines
+                      (application/x-ndjson), or as server-sent events if the request accepts
+                      text/event-stream. The last record is {"done": true, "count": N}, or
+                      {"error": "..."} if the search failed
+    GET  /search?query=...&engine=...&limit=...
+                    - the same, with the parameters in the url
+    GET  /health    - {"status": "ok", "active": <searches running>, "served": <searches finished>}
+    GET  /metrics   - crawl metrics in Prometheus text format (with --metrics)
+
+The command line interface runs its search in the service with --service=http://HOST:PORT
+or --service=unix:PATH (see remote_search()).
+"""
+import http.client
+import itertools
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import click
+import search.drivers  # noqa: F401  Need this to declare drivers
+from .driverregistry import SEDriverRegistry
+from .logger import SearchLogger, DEFAULT_LOG_PATH, DEFAULT_LOG_SAMPLE
+from .sessions import HttpSessionPool, DEFAULT_POOL_SIZE, DEFAULT_POOL_PER_HOST
+from .parsers import ParserRegistry, DEFAULT_PARSER
+from .parsepool import ParsePool, DEFAULT_PARSE_WORKERS
+from .frontier import FrontierRegistry
+from .visited import VisitedStoreRegistry
+from .contentfilter import ContentFilter, DEFAULT_MAX_PAGE_SIZE, DEFAULT_BLOCK_TTL
+from .metrics import CrawlMetrics
+from .cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_SIZE
+from .runner import (
+    engine_names, get_extractor, search_results, DEFAULT_SEARCH_ENGINE, SUPPORTED_SEARCH_MODES, SUPPORTED_CRAWLERS
+)
+
+
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8765
+DEFAULT_MAX_SEARCHES = 16       # Searches running at the same time. Others wait for their turn
+DEFAULT_SERVICE_TIMEOUT = 600   # Seconds without a result, after which the client gives up
+
+JSON_LINES_TYPE = "application/x-ndjson"
+EVENT_STREAM_TYPE = "text/event-stream"
+
+
+def parse_flag(value):
+    if isinstance(value, str):
+        if value.lower() not in ("true", "false", "1", "0", "yes", "no"):
+            raise ValueError(f"invalid boolean value {value!r}")
+        return value.lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+# Параметры поиска, которые может задать клиент, и их типы. Значения по умолчанию - как у search_results()
+SEARCH_PARAMS = {
+    "limit": int,
+    "mode": str,
+    "recursive": parse_flag,
+    "depth_limit": int,
+    "crawler": str,
+    "concurrency": int,
+    "strategy": str,
+    "frontier_memory": int,
+    "visited": str,
+    "bloom_error_rate": float,
+    "prefetch": parse_flag,
+}
+CHOICES = {
+    "mode": lambda: SUPPORTED_SEARCH_MODES,
+    "crawler": lambda: SUPPORTED_CRAWLERS,
+    "strategy": FrontierRegistry.registered_strategies_names,
+    "visited": VisitedStoreRegistry.registered_stores_names,
+}
+# Параметры, значения которых - доли: строго больше 0 и меньше 1
+FRACTIONS = ("bloom_error_rate",)
+
+
+def _single(value):
+    # В параметрах из url каждое значение - список строк, берем последнее
+    return value[-1] if isinstance(value, list) else value
+
+
+def parse_search_request(params):
+    """
+    :param params: dict of the search parameters, from the JSON body or the url of a request. Values
+    from the url are lists of strings
+    :return: a triple (query, list of engine names, dict of keyword arguments of search_results())
+    :raise ValueError: if the parameters are not valid
+    """
+    unknown = set(params) - {"query", "engine", *SEARCH_PARAMS}
+    if unknown:
+        raise ValueError(f"unknown parameters: {', '.join(sorted(unknown))}")
+    query = _single(params.get("query"))
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("query is required")
+    engines = parse_engines(params.get("engine"))
+    kwargs = {name: parse_search_param(name, _single(params[name])) for name in SEARCH_PARAMS if name in params}
+    if not kwargs.pop("recursive", True):
+        kwargs["depth_limit"] = 1
+    return query, engines, kwargs
+
+
+def parse_engines(engine):
+    """
+    :param engine: a name of a search engine, or a list of names, or None for the default engine
+    :return: a list of engine names
+    :raise ValueError: if some of the engines are not registered
+    """
+    engine = engine or [DEFAULT_SEARCH_ENGINE]
+    engines = engine_names(engine if isinstance(engine, list) else [engine])
+    for name in engines:
+        if not isinstance(name, str) or SEDriverRegistry.get_driver(name) is None:
+            raise ValueError(f"unknown search engine {name!r}")
+    return engines
+
+
+def parse_search_param(name, value):
+    """
+    :param name: name of a parameter from SEARCH_PARAMS
+    :param value: the value given in the request
+    :return: the value, converted to the type of the parameter
+    :raise ValueError: if the value is not valid
+    """
+    convert = SEARCH_PARAMS[name]
+    try:
+        converted = convert(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid value of {name}: {value!r}")
+    if name in CHOICES and converted not in CHOICES[name]():
+        raise ValueError(f"{name} should be one of: {', '.join(CHOICES[name]())}")
+    if convert is int and converted < 1:
+        raise ValueError(f"{name} should be positive")
+    if name in FRACTIONS and not 0 < converted < 1:
+        raise ValueError(f"{name} should be between 0 and 1")
+    return converted
+
+
+class SearchService:
+    """
+    Runs the searches of the clients, at most max_searches at a time, and keeps their counts
+    """
+
+    def __init__(self, max_searches=DEFAULT_MAX_SEARCHES):
+        self._slots = threading.BoundedSemaphore(max_searches)
+        self._lock = threading.Lock()
+        self._numbers = itertools.count(1)
+        self.active = 0
+        self.served = 0
+
+    def status(self):
+        with self._lock:
+            return {"status": "ok", "active": self.active, "served": self.served}
+
+    def run_search(self, query, engines, client, **kwargs):
+        """
+        Runs a search, when there is a free slot for it
+        :param query: the search query
+        :param engines: list of names of search engines
+        :param client: address of the client, for the log
+        :param kwargs: keyword arguments of search_results()
+        :return: a generator of the results, followed by {"done": True, "count": N},
+        or {"error": "..."} if the search fails
+        """
+        logger = SearchLogger.get_logger()
+        with self._slots:
+            with self._lock:
+                self.active += 1
+                number = next(self._numbers)
+            logger.info("Search #%s from %s: %r, engines: %s, %s", number, client, query, ", ".join(engines), kwargs)
+            start = time.perf_counter()
+            count = 0
+            results = search_results(get_extractor(engines), query, **kwargs)
+            try:
+                for result in results:
+                    count += 1
+                    yield result
+                yield {"done": True, "count": count}
+            except GeneratorExit:
+                logger.info("Search #%s: client %s disconnected after %s results", number, client, count)
+                raise
+            except Exception as e:
+                logger.error("Search #%s failed: %s", number, e)
+                yield {"error": f"{type(e).__name__}: {e}"}
+            finally:
+                results.close()
+                with self._lock:
+                    self.active -= 1
+                    self.served += 1
+                logger.info("Search #%s finished: %s results in %.1f s", number, count, time.perf_counter() - start)
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep-alive, for clients which run many searches
+    disable_nagle_algorithm = True  # Results are small, and should reach the client right away
+
+    def address_string(self):
+        # У клиентов Unix сокета нет адреса
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix socket"
+
+    def log_message(self, format, *args):
+        SearchLogger.get_logger().debug("%s - " + format, self.address_string(), *args)
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = (json.dumps(body) + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _stream(self, records, event_stream=False):
+        """
+        Sends the records with chunked transfer encoding, one record per chunk, as soon as it is available
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", EVENT_STREAM_TYPE if event_stream else JSON_LINES_TYPE)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False)
+                self._write_chunk(f"data: {line}\n\n".encode("utf-8") if event_stream else f"{line}\n".encode("utf-8"))
+            self.wfile.write(b"0\r\n\r\n")
+        except ConnectionError:
+            self.close_connection = True
+        finally:
+            records.close()
+
+    def _search(self, params):
+        try:
+            query, engines, kwargs = parse_search_request(params)
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        event_stream = EVENT_STREAM_TYPE in self.headers.get("Accept", "")
+        self._stream(self.server.service.run_search(query, engines, self.address_string(), **kwargs), event_stream)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/search":
+            self._search(parse_qs(url.query))
+        elif url.path == "/health":
+            self._send(200, self.server.service.status())
+        elif url.path == "/metrics" and CrawlMetrics.get_metrics():
+            self._send(200, CrawlMetrics.get_metrics().to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": f"not found: {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/search":
+            self._send(404, {"error": f"not found: {self.path}"})
+            return
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": f"invalid JSON: {e}"})
+            return
+        if not isinstance(params, dict):
+            self._send(400, {"error": "a JSON object is expected"})
+            return
+        self._search(params)
+
+
+class UnixSearchRequestHandler(SearchRequestHandler):
+    disable_nagle_algorithm = False     # TCP_NODELAY is not supported by Unix sockets
+
+
+class SearchHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class SearchUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Сокет, оставшийся от предыдущего запуска, мешает bind()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def create_server(service, host=DEFAULT_SERVICE_HOST, port=DEFAULT_SERVICE_PORT, socket_path=None):
+    """
+    :param service: SearchService
+    :param socket_path: path to a Unix socket to listen on, instead of the host and port
+    :return: the server, not yet started
+    """
+    if socket_path:
+        server = SearchUnixServer(socket_path, UnixSearchRequestHandler)
+    else:
+        server = SearchHTTPServer((host, port), SearchRequestHandler)
+    server.service = service
+    return server
+
+
+def _connection(service_url, timeout):
+    """
+    :param service_url: http://HOST:PORT, or unix:PATH
+    :return: http.client.HTTPConnection to the service
+    """
+    if service_url.startswith("unix:"):
+        path = service_url[len("unix:"):]
+        path = path[2:] if path.startswith("//") else path
+
+        class UnixHTTPConnection(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(timeout)
+                self.sock.connect(path)
+
+        return UnixHTTPConnection("localhost", timeout=timeout)
+    url = urlparse(service_url if "//" in service_url else f"http://{service_url}")
+    return http.client.HTTPConnection(url.hostname, url.port or DEFAULT_SERVICE_PORT, timeout=timeout)
+
+
+def remote_search(service_url, query, engines, timeout=DEFAULT_SERVICE_TIMEOUT, **kwargs):
+    """
+    Runs a search in the search service. Errors are logged, and end the results
+    :param service_url: address of the service: http://HOST:PORT, or unix:PATH
+    :param query: the search query
+    :param engines: list of names of search engines
+    :param timeout: max number of seconds to wait for the next result
+    :param kwargs: other search parameters (see SEARCH_PARAMS)
+    :return: a generator of the results, as they are streamed by the service
+    """
+    logger = SearchLogger.get_logger()
+    connection = _connection(service_url, timeout)
+    try:
+        connection.request(
+            "POST", "/search", body=json.dumps({"query": query, "engine": engines, **kwargs}).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Accept": JSON_LINES_TYPE}
+        )
+        response = connection.getresponse()
+        if response.status != 200:
+            body = response.read().decode("utf-8", errors="replace")
+            try:
+                body = json.loads(body)["error"]
+            except (ValueError, KeyError, TypeError):
+                pass
+            logger.error("Search service %s responded with %s: %s", service_url, response.status, body)
+            return
+        for line in response:
+            record = json.loads(line)
+            if "error" in record:
+                logger.error("The search failed in the service: %s", record["error"])
+                return
+            if record.get("done"):
+                return
+            yield record
+        logger.error("The search service %s closed the connection before the search was finished", service_url)
+    except (OSError, http.client.HTTPException) as e:
+        logger.error("Can not get the results from the search service %s: %s", service_url, e)
+    finally:
+        connection.close()
+
+
+@click.command()
+@click.option("--host", default=DEFAULT_SERVICE_HOST, help=f"Host to listen on. Defaults to {DEFAULT_SERVICE_HOST}")
+@click.option("--port", default=DEFAULT_SERVICE_PORT, help=f"Port to listen on. Defaults to {DEFAULT_SERVICE_PORT}")
+@click.option("--socket", "socket_path", default=None, help="Listen on this Unix socket, instead of the host and port")
+@click.option(
+    "--max_searches",
+    default=DEFAULT_MAX_SEARCHES,
+    type=click.IntRange(min=1),
+    help=f"Max number of searches running at the same time, others wait. Defaults to {DEFAULT_MAX_SEARCHES}"
+)
+@click.option(
+    "--pool_size",
+    default=DEFAULT_POOL_SIZE,
+    help=f"Number of hosts to keep open HTTP connections to. Defaults to {DEFAULT_POOL_SIZE}"
+)
+@click.option(
+    "--pool_per_host",
+    default=DEFAULT_POOL_PER_HOST,
+    help=f"Max number of open HTTP connections per host. Defaults to {DEFAULT_POOL_PER_HOST}"
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Whether to use the on-disk cache of HTTP responses (default) or bypass it"
+)
+@click.option(
+    "--cache_path",
+    default=DEFAULT_CACHE_PATH,
+    help=f"Path to the cache database. Defaults to {DEFAULT_CACHE_PATH}"
+)
+@click.option(
+    "--cache_ttl",
+    default=DEFAULT_CACHE_TTL,
+    help=f"Number of seconds cached responses are used without revalidation. Defaults to {DEFAULT_CACHE_TTL}"
+)
+@click.option(
+    "--cache_size",
+    default=DEFAULT_CACHE_MAX_SIZE // (1024 * 1024),
+    help=f"Max size of the cache in megabytes. Defaults to {DEFAULT_CACHE_MAX_SIZE // (1024 * 1024)}"
+)
+@click.option(
+    "--parser",
+    default=DEFAULT_PARSER,
+    type=click.Choice(ParserRegistry.registered_parsers_names()),
+    help=f"HTML parser backend. Defaults to '{DEFAULT_PARSER}'"
+)
+@click.option(
+    "--parse_workers",
+    default=DEFAULT_PARSE_WORKERS,
+    type=click.IntRange(min=0),
+    help="Number of worker processes to parse the pages in, shared by all searches. "
+         f"Defaults to {DEFAULT_PARSE_WORKERS} - parse in the searching threads"
+)
+@click.option(
+    "--max_page_size",
+    default=DEFAULT_MAX_PAGE_SIZE // 1024,
+    help=f"Max number of kilobytes read from a single page. Defaults to {DEFAULT_MAX_PAGE_SIZE // 1024}"
+)
+@click.option(
+    "--block_ttl",
+    default=DEFAULT_BLOCK_TTL,
+    type=float,
+    help="Number of seconds a host, which keeps serving non-HTML content, is not requested. "
+         f"Defaults to {DEFAULT_BLOCK_TTL}"
+)
+@click.option(
+    "--metrics",
+    is_flag=True,
+    default=False,
+    help="Collect the crawl metrics of all searches, and serve them at /metrics"
+)
+@click.option("--logpath", default=DEFAULT_LOG_PATH, help=f"Path to log file. Defaults to {DEFAULT_LOG_PATH}")
+@click.option(
+    "--loglevel",
+    default="info",
+    type=click.Choice(SearchLogger.log_level_mappings().keys()),
+    help="Sets the log level. Defaults to 'info'"
+)
+@click.option(
+    "--log_sample",
+    default=DEFAULT_LOG_SAMPLE,
+    type=click.IntRange(min=1),
+    help=f"Log only every n-th of the per link messages. Defaults to {DEFAULT_LOG_SAMPLE}"
+)
+def main(host, port, socket_path, max_searches, pool_size, pool_per_host, cache, cache_path, cache_ttl, cache_size,
+         parser, parse_workers, max_page_size, block_ttl, metrics, logpath, loglevel, log_sample):
+    SearchLogger.init_logger(path=logpath, log_to_console=True, level=loglevel, sample_every=log_sample)
+    logger = SearchLogger.get_logger()
+
+    ParserRegistry.set_default(parser)
+    ContentFilter.init_filter(max_page_size=max_page_size * 1024, block_ttl=block_ttl)
+    HttpSessionPool.init_pool(pool_size=pool_size, pool_per_host=pool_per_host)
+    if metrics:
+        CrawlMetrics.init_metrics()
+    if cache:
+        ResponseCache.init_cache(path=cache_path, ttl=cache_ttl, max_size=cache_size * 1024 * 1024)
+    if parse_workers:
+        ParsePool.init_pool(parse_workers, parser=parser)
+
+    try:
+        server = create_server(SearchService(max_searches), host=host, port=port, socket_path=socket_path)
+    except OSError as e:
+        logger.error("Can not start the search service: %s", e, force_console_print=True)
+        sys.exit(1)
+    logger.info(
+        "Search service is listening on %s", f"unix:{socket_path}" if socket_path else f"http://{host}:{port}",
+        force_console_print=True
+    )
+    # Остановка по SIGTERM (как обычно останавливают сервисы) - так же, как по Ctrl+C, с закрытием сокета
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ParsePool.close_pool()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logger.info("Search service stopped", force_console_print=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import threading
+from .logger import SearchLogger
+
+
+DEFAULT_POOL_SIZE = 20          # Number of per-host connection pools to keep
+DEFAULT_POOL_PER_HOST = 10      # Max number of keep-alive connections per host
+DEFAULT_CONCURRENCY = 8         # Max number of pages fetched at the same time by the async crawler
+
+DEFAULT_HEADERS = {
+    "User-Agent":
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0.2526.106 Safari/537.36",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+
+class HttpSessionPool:
+    """
+    A shared HTTP session, with a pool of keep-alive connections per host. Used for
+    all requests - both to search engines and to the pages visited recursively, so
+    that repeated requests to the same host reuse open connections.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls):
+        """
+        Returns the shared pool, creating it with default settings on first use
+        :return: HttpSessionPool
+        """
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def init_pool(cls, *args, **kwargs):
+        """
+        (Re)creates the shared pool with given settings. Takes the same arguments as the constructor
+        """
+        with cls._lock:
+            if cls._instance:
+                cls._instance.close()
+            cls._instance = cls(*args, **kwargs)
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_per_host=DEFAULT_POOL_PER_HOST, headers=None):
+        """
+        :param pool_size: number of hosts to keep connection pools for
+        :param pool_per_host: max number of connections per host. Requests above this
+        limit wait for a free connection
+        :param headers: a dict of extra default headers
+        """
+        self.pool_size = pool_size
+        self.pool_per_host = pool_per_host
+        import requests     # Imported on first use, to keep the CLI startup fast
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers.update({**DEFAULT_HEADERS, **(headers or {})})
+        self._closed_pools_stats = {}
+        self._stats_lock = threading.Lock()
+        for prefix in ("http://", "https://"):
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_per_host, pool_block=True)
+            self._track_evicted_pools(adapter)
+            self.session.mount(prefix, adapter)
+
+    def _track_evicted_pools(self, adapter):
+        """
+        Keeps the statistics of per-host pools, which are closed when evicted from the adapter
+        """
+        pools = adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def dispose_and_record(pool):
+            self._add_pool_stats(self._closed_pools_stats, pool)
+            if dispose:
+                dispose(pool)
+
+        pools.dispose_func = dispose_and_record
+
+    def _add_pool_stats(self, stats, pool):
+        with self._stats_lock:
+            host_stats = stats.setdefault(pool.host, {"requests": 0, "connections": 0})
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+
+    def get(self, url, **kwargs):
+        """
+        Sends a GET request through the shared session
+        :param url: string url
+        :return: requests.Response
+        """
+        return self.session.get(url, **kwargs)
+
+    def stats(self):
+        """
+        Connection reuse statistics.
+        :return: a dict {host: {"requests":..., "connections":..., "reused":...}}, where
+        "connections" is the number of connections opened to the host, and "reused" is the
+        number of requests sent through an already open connection
+        """
+        stats = {host: dict(host_stats) for host, host_stats in self._closed_pools_stats.items()}
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool:
+                    self._add_pool_stats(stats, pool)
+        for host_stats in stats.values():
+            host_stats["reused"] = max(host_stats["requests"] - host_stats["connections"], 0)
+        return stats
+
+    def log_stats(self):
+        """
+        Logs the connection reuse statistics, per host and in total
+        """
+        stats = self.stats()
+        total_requests = sum(s["requests"] for s in stats.values())
+        total_connections = sum(s["connections"] for s in stats.values())
+        lines = [
+            f"{host}: {s['requests']} requests, {s['connections']} connections, {s['reused']} reused"
+            for host, s in sorted(stats.items(), key=lambda item: -item[1]["requests"])
+        ]
+        SearchLogger.get_logger().info(
+            "\n".join([
+                f"HTTP connection pool: {total_requests} requests over {total_connections} connections "
+                f"to {len(stats)} hosts",
+                *lines
+            ]),
+            force_console_print=True
+        )
+
+    def close(self):
+        self.session.close()
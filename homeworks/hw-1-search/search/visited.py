@@ -0,0 +1,229 @@
+import math
+import sys
+from abc import ABC, abstractmethod
+from array import array
+from hashlib import blake2b
+
+
+DEFAULT_VISITED_STORE = "exact"
+DEFAULT_BLOOM_ERROR_RATE = 0.001
+DEFAULT_EXPECTED_ITEMS = 1000
+
+
+def url_fingerprint(url, size=8):
+    """
+    :param url: string
+    :param size: number of bytes in the fingerprint
+    :return: integer hash of the url, of <size> bytes
+    """
+    return int.from_bytes(blake2b(url.encode("utf8"), digest_size=size).digest(), "little")
+
+
+class VisitedStore(ABC):
+    """
+    An abstract store of visited urls. Supports the same operations the search algorithm
+    uses with a set: <url> in store, store.add(url) and len(store). The length is the exact
+    number of urls added, even for stores where the membership test is approximate.
+    """
+
+    def __init__(self):
+        self._count = 0
+
+    @abstractmethod
+    def __contains__(self, url):
+        pass
+
+    @abstractmethod
+    def _insert(self, url):
+        """
+        Inserts the url into the store
+        :return: True if the url was not already present
+        """
+        pass
+
+    @abstractmethod
+    def memory_usage(self):
+        """
+        :return: approximate memory used by the store, in bytes
+        """
+        pass
+
+    def add(self, url):
+        if self._insert(url):
+            self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def describe(self):
+        return f"{self.__class__.__name__}: {len(self)} urls, {self.memory_usage() / 1024:.1f} KB"
+
+
+class ExactVisitedStore(VisitedStore):
+    """
+    Stores full url strings in a set
+    """
+
+    def __init__(self, expected_items=DEFAULT_EXPECTED_ITEMS):
+        super().__init__()
+        self._urls = set()
+        self._strings_size = 0
+
+    def __contains__(self, url):
+        return url in self._urls
+
+    def _insert(self, url):
+        if url in self._urls:
+            return False
+        self._urls.add(url)
+        self._strings_size += sys.getsizeof(url)
+        return True
+
+    def memory_usage(self):
+        return sys.getsizeof(self._urls) + self._strings_size
+
+
+class FingerprintVisitedStore(VisitedStore):
+    """
+    Compact store, which keeps 64-bit url fingerprints in an open addressing hash set,
+    backed by an array. Distinct urls are confused only on a fingerprint collision,
+    which is extremely unlikely for realistic crawl sizes.
+
+    Urls are added by one thread, but can be looked up by others at the same time (the async
+    crawler filters the links of pages in its worker threads): a grown table is filled before
+    it replaces the old one, together with its mask, in a single assignment.
+    """
+
+    _max_load = 0.5
+
+    def __init__(self, expected_items=DEFAULT_EXPECTED_ITEMS):
+        super().__init__()
+        size = 16
+        while size * self._max_load < expected_items:
+            size *= 2
+        self._state = (array("Q", bytes(8 * size)), size - 1)   # Таблица и маска индекса слота
+        self._used = 0
+
+    @staticmethod
+    def _fingerprint(url):
+        return url_fingerprint(url) or 1  # 0 marks an empty slot
+
+    @staticmethod
+    def _slot(table, mask, fingerprint):
+        """
+        :return: index of the slot which contains the fingerprint, or of the empty slot where it should go
+        """
+        index = fingerprint & mask
+        while table[index] and table[index] != fingerprint:
+            index = (index + 1) & mask
+        return index
+
+    def __contains__(self, url):
+        table, mask = self._state
+        return table[self._slot(table, mask, self._fingerprint(url))] != 0
+
+    def _insert(self, url):
+        fingerprint = self._fingerprint(url)
+        table, mask = self._state
+        index = self._slot(table, mask, fingerprint)
+        if table[index]:
+            return False
+        table[index] = fingerprint
+        self._used += 1
+        if self._used > len(table) * self._max_load:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old_table = self._state[0]
+        table = array("Q", bytes(8 * 2 * len(old_table)))
+        mask = len(table) - 1
+        for fingerprint in old_table:
+            if fingerprint:
+                table[self._slot(table, mask, fingerprint)] = fingerprint
+        self._state = (table, mask)
+
+    def memory_usage(self):
+        return sys.getsizeof(self._state[0])
+
+
+class BloomVisitedStore(VisitedStore):
+    """
+    Bloom filter store. Uses a fixed amount of memory, computed from the expected number
+    of urls and the acceptable false positive rate. A false positive makes the search skip
+    a url which was not visited yet. Beyond <expected_items> urls, the false positive rate
+    grows above the configured one.
+    """
+
+    def __init__(self, expected_items=DEFAULT_EXPECTED_ITEMS, error_rate=DEFAULT_BLOOM_ERROR_RATE):
+        """
+        :param expected_items: the number of urls the filter is sized for
+        :param error_rate: the acceptable false positive rate, between 0 and 1
+        :raise ValueError: if the error rate is not between 0 and 1
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError(f"error rate of the Bloom filter should be between 0 and 1, got {error_rate}")
+        super().__init__()
+        expected_items = max(expected_items, 1)
+        self.error_rate = error_rate
+        self._bits_count = max(8, int(math.ceil(-expected_items * math.log(error_rate) / math.log(2) ** 2)))
+        self._hashes_count = max(1, int(round(self._bits_count / expected_items * math.log(2))))
+        self._bits = bytearray((self._bits_count + 7) // 8)
+
+    def _positions(self, url):
+        # Double hashing: k positions out of two independent 64-bit hashes
+        digest = url_fingerprint(url, size=16)
+        h1, h2 = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+        return [(h1 + i * h2) % self._bits_count for i in range(self._hashes_count)]
+
+    def __contains__(self, url):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(url))
+
+    def _insert(self, url):
+        bits = self._bits
+        new = False
+        for p in self._positions(url):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                new = True
+        return new
+
+    def add(self, url):
+        # The caller has already checked that the url is (most likely) not in the store, so
+        # it is counted even if all its bits happen to be set, to keep the count exact
+        self._insert(url)
+        self._count += 1
+
+    def memory_usage(self):
+        return sys.getsizeof(self._bits)
+
+
+class VisitedStoreRegistry:
+    """
+    A class to store available visited url store types
+    """
+    _registry = {
+        "exact": ExactVisitedStore,
+        "compact": FingerprintVisitedStore,
+        "bloom": BloomVisitedStore,
+    }
+
+    @classmethod
+    def register(cls, name, store_class):
+        cls._registry[name] = store_class
+
+    @classmethod
+    def create(cls, name=DEFAULT_VISITED_STORE, expected_items=DEFAULT_EXPECTED_ITEMS, **kwargs):
+        """
+        :param name: store type name
+        :param expected_items: expected number of urls
+        :param kwargs: extra store specific parameters, e.g. error_rate for "bloom"
+        :return: a new VisitedStore
+        """
+        return cls._registry[name](expected_items=expected_items, **kwargs)
+
+    @classmethod
+    def registered_stores_names(cls):
+        return cls._registry.keys()
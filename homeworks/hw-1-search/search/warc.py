@@ -0,0 +1,246 @@
+import datetime
+import gzip
+import threading
+import uuid
+import zlib
+from .logger import SearchLogger
+
+
+WARC_VERSION = "WARC/1.1"
+SEARCH_PAGE_HEADER = "WARC-X-Search-Page"   # "<engine> <page number>", for search engine result pages
+READ_CHUNK_SIZE = 64 * 1024
+FLUSH_EVERY = 100                           # Records
+
+
+def warc_record(warc_type, url, block, content_type, extra_headers=None):
+    """
+    :param warc_type: "response", "warcinfo", ...
+    :param url: target url of the record, or None
+    :param block: bytes, content block of the record
+    :param content_type: content type of the block
+    :param extra_headers: optional dict of additional WARC header fields
+    :return: bytes, the record
+    """
+    headers = {
+        "WARC-Type": warc_type,
+        "WARC-Record-ID": f"<urn:uuid:{uuid.uuid4()}>",
+        "WARC-Date": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        **({"WARC-Target-URI": url} if url else {}),
+        **(extra_headers or {}),
+        "Content-Type": content_type,
+        "Content-Length": str(len(block)),
+    }
+    head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    return f"{WARC_VERSION}\r\n{head}\r\n".encode("utf-8") + block + b"\r\n\r\n"
+
+
+def parse_record(data):
+    """
+    :param data: bytes, a WARC record
+    :return: a pair (dict of WARC header fields, content block)
+    """
+    head, _, rest = data.partition(b"\r\n\r\n")
+    lines = head.decode("utf-8").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+    return headers, rest[:int(headers.get("Content-Length", len(rest)))]
+
+
+def parse_http_response(block):
+    """
+    :param block: bytes, content block of a WARC response record: HTTP headers and body
+    :return: string, the body, decoded according to the charset of the Content-Type header
+    """
+    head, _, body = block.partition(b"\r\n\r\n")
+    charset = "utf-8"
+    for line in head.decode("latin-1").split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-type" and "charset=" in value:
+            charset = value.split("charset=")[1].split(";")[0].strip()
+    return body.decode(charset, errors="replace")
+
+
+class WarcWriter:
+    """
+    Archives the pages read by the search (search engine result pages and crawled pages) to a
+    gzip-compressed WARC file, as the crawl runs. Each record is a separate gzip member, as usual
+    for .warc.gz files, so that the records can be read independently (see WarcReplay).
+
+    The bodies are stored as they were decoded by the search, re-encoded in UTF-8 (the Content-Type
+    of the records says so). Thread-safe.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_writer(cls):
+        """
+        :return: the shared WarcWriter instance, or None if archiving is not enabled
+        """
+        return cls._instance
+
+    @classmethod
+    def init_writer(cls, *args, **kwargs):
+        """
+        Enables archiving. Takes the same arguments as the constructor
+        """
+        cls.close_writer()
+        cls._instance = cls(*args, **kwargs)
+
+    @classmethod
+    def close_writer(cls):
+        if cls._instance:
+            cls._instance.close()
+        cls._instance = None
+
+    def __init__(self, path, info=None):
+        """
+        :param path: path to the .warc.gz file
+        :param info: optional dict of fields for the warcinfo record (e.g. search parameters)
+        """
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, mode="wb")
+        fields = {"software": "lshifr-otus-websearch", "format": "WARC File Format 1.1", **(info or {})}
+        self._write(warc_record(
+            "warcinfo", None, "".join(f"{name}: {value}\r\n" for name, value in fields.items()).encode("utf-8"),
+            "application/warc-fields"
+        ))
+
+    def _write(self, record):
+        member = gzip.compress(record, compresslevel=6)
+        with self._lock:
+            self._file.write(member)
+            self.count += 1
+            if self.count % FLUSH_EVERY == 0:
+                self._file.flush()
+
+    def write_response(self, url, text, search_page=None):
+        """
+        :param url: url of the page
+        :param text: string, the page contents
+        :param search_page: for search engine result pages, a pair (engine name, page number)
+        """
+        body = text.encode("utf-8")
+        block = (
+            "HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("latin-1") + body
+        extra_headers = {SEARCH_PAGE_HEADER: f"{search_page[0]} {search_page[1]}"} if search_page else None
+        self._write(warc_record("response", url, block, "application/http; msgtype=response", extra_headers))
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+        SearchLogger.get_logger().info("%s records written to the archive %s", self.count, self.path)
+
+
+class WarcReplay:
+    """
+    Serves pages from a WARC file written by WarcWriter instead of the network. When enabled,
+    read_web_page() makes no requests and no delays. The archive is scanned once, to index
+    the offsets of the records, and the records are read on demand.
+
+    Search engine result pages are looked up by url, and if not found - by the engine and page number.
+    So a search with a different query replays the result pages of the archived search, and
+    only the filtering of the links (query words, mode) changes.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_replay(cls):
+        """
+        :return: the shared WarcReplay instance, or None if replay is not enabled
+        """
+        return cls._instance
+
+    @classmethod
+    def init_replay(cls, *args, **kwargs):
+        """
+        Enables replay. Takes the same arguments as the constructor
+        """
+        cls._instance = cls(*args, **kwargs)
+
+    @classmethod
+    def disable_replay(cls):
+        if cls._instance:
+            cls._instance.close()
+        cls._instance = None
+
+    def __init__(self, path):
+        """
+        :param path: path to the .warc.gz file
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._file = open(path, mode="rb")
+        self._by_url = {}
+        self._by_search_page = {}
+        for offset, data in self._members():
+            headers, _ = parse_record(data)
+            if headers.get("WARC-Type") != "response":
+                continue
+            self._by_url[headers["WARC-Target-URI"]] = offset
+            if SEARCH_PAGE_HEADER in headers:
+                engine, page = headers[SEARCH_PAGE_HEADER].rsplit(" ", 1)
+                self._by_search_page[(engine, int(page))] = offset
+        SearchLogger.get_logger().info(
+            "Replaying %s pages (%s search engine result pages) from %s",
+            len(self._by_url), len(self._by_search_page), path
+        )
+
+    def _members(self, offset=0, limit=None):
+        """
+        Reads gzip members of the file
+        :param offset: file offset of the first member to read
+        :param limit: max number of members to read
+        :return: a generator of pairs (offset, decompressed member)
+        """
+        self._file.seek(offset)
+        data = b""
+        count = 0
+        while limit is None or count < limit:
+            start = offset
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks = []
+            while not decompressor.eof:
+                if not data:
+                    data = self._file.read(READ_CHUNK_SIZE)
+                    if not data:
+                        if chunks:
+                            SearchLogger.get_logger().warning("Truncated record at the end of %s", self.path)
+                        return
+                chunks.append(decompressor.decompress(data))
+                offset += len(data) - len(decompressor.unused_data)
+                data = decompressor.unused_data
+            yield start, b"".join(chunks)
+            count += 1
+
+    def _read(self, offset):
+        with self._lock:
+            _, data = next(self._members(offset, limit=1))
+        _, block = parse_record(data)
+        return parse_http_response(block)
+
+    def lookup(self, url, search_page=None):
+        """
+        :param url: url of the page
+        :param search_page: for search engine result pages, a pair (engine name, page number)
+        :return: string, the archived page contents, or None if the page is not in the archive
+        """
+        offset = self._by_url.get(url)
+        if offset is None and search_page:
+            offset = self._by_search_page.get(search_page)
+        if offset is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._read(offset)
+
+    def close(self):
+        self._file.close()
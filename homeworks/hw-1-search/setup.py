@@ -18,12 +18,15 @@ setup(
     url="https://github.com/possibly-harmless/WebPythonOTUS/tree/hw-1-search/homeworks/hw-1-search",
     author="Leonid Shifrin",
     license="MIT",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     include_package_data=True,
     install_requires=["requests", "beautifulsoup4", "lxml", "click", "tabulate"],
     entry_points={
         "console_scripts": [
             "websearch=search.__main__:main",
+            "websearch-results=search.resultstore:cli",
+            "websearch-service=search.service:main",
+            "websearch-worker=search.distributed:main",
         ]
     },
 )